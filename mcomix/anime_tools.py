@@ -1,100 +1,280 @@
+'''anime_tools.py - Animated images.'''
 
-import math
+import itertools
+from io import BytesIO
 
-from gi.repository import GdkPixbuf
+from gi.repository import GLib, GdkPixbuf
+from PIL import Image
 
 from mcomix import constants
+from mcomix import log
+from mcomix.lib import mt
 from mcomix.preferences import prefs
 
+#: Maximum number of frames in the frame cache, see _get_frame_cache().
+_MAX_CACHED_FRAMES = 10000
+#: Frame delays up to this value (in ms) are replaced by _DEFAULT_DELAY,
+#: like web browsers do.
+_MIN_DELAY = 10
+_DEFAULT_DELAY = 100
 
-class AnimeFrameBuffer:
-    def __init__(self, n_frames, loop=1):
+#: Filled on-demand by _get_frame_cache()
+_frame_cache = None
+_frame_cache_lock = mt.Lock()
+#: Decodes the next frame of the animations being played, see _Player.
+#: Filled on-demand by _get_thread()
+_thread = None
+#: Keys identifying the frames of each animated image in the frame cache.
+_source_keys = itertools.count()
+
+
+class FrameSource(object):
+
+    ''' Frames of an animated image, decoded on demand from the content of
+    the image file. '''
+
+    def __init__(self, data, n_frames, loop=1, background=None):
+        self.key = next(_source_keys)
+        self.data = data
         self.n_frames = n_frames
-        self.width = 0
-        self.height = 0
         if prefs['animation mode'] == constants.ANIMATION_INF:
             self.loop = 0
         elif prefs['animation mode'] == constants.ANIMATION_ONCE:
             self.loop = 1
         else:
             self.loop = 0 if loop > 10 else loop  # loop over 10 is infinitely
-
-        self.framelist = [None] * n_frames
-        self.duration = 0
-        self.fps = 0
-
-    def add_frame(self, index, pixbuf, duration, background=None):
-        if self.n_frames <= index:
-            raise EOFError('index over')
-        width = pixbuf.get_width()
-        height = pixbuf.get_height()
-        if self.width * self.height:
-            if width != self.width or height != self.height:
-                raise ValueError('frame with different size')
-        else:
-            self.width = width
-            self.height = height
         if prefs['animation background'] and background:
+            self.background = background
+        else:
+            self.background = None
+        #: Delay of each frame, in milliseconds (None until decoded).
+        self.delays = [None] * n_frames
+        self._im = None
+        self._lock = mt.Lock()
+
+    def decode(self, index):
+        ''' Decode frame <index>, and returns it as a pixbuf. '''
+        # Circular import.
+        from mcomix import image_tools
+        with self._lock:
+            if self._im is None:
+                self._im = Image.open(BytesIO(self.data))
+            # Seeking back restarts decoding from the first frame.
+            self._im.seek(index)
+            # Some formats only update the frame info once loaded.
+            self._im.load()
+            delay = int(self._im.info.get('duration', 0))
+            self.delays[index] = _DEFAULT_DELAY if delay <= _MIN_DELAY else delay
+            pixbuf = image_tools.pil_to_pixbuf(self._im)
+        if self.background is not None:
+            width, height = pixbuf.get_width(), pixbuf.get_height()
             pixbuf = pixbuf.composite_color_simple(
                 width, height, GdkPixbuf.InterpType.NEAREST,
-                255, 1024, background, background
+                255, 1024, self.background, self.background
             )
-        self.framelist[index] = (pixbuf, duration)
-        self.duration = math.gcd(duration, self.duration)
-
-    def copy(self):
-        newbuffer = AnimeFrameBuffer(self.n_frames, loop=self.loop)
-        for n, frame in enumerate(self.framelist):
-            pixbuf, duration = frame
-            newbuffer.add_frame(n, pixbuf, duration)
-        return newbuffer
-
-    def create_animation(self):
-        if not self.width * self.height:
-            raise ValueError('no frames')
-        if not self.fps:
-            if self.duration:
-                self.fps = 1000 / self.duration
-            else:
-                # all duration is 0, set fps to 60
-                # TODO: correctly deal with 0 duration
-                self.fps = 60
-        anime = GdkPixbuf.PixbufSimpleAnim.new(self.width, self.height, self.fps)
-        if self.loop:
-            anime.set_loop(False)
+        return pixbuf
+
+
+class Animation(object):
+
+    ''' An animated image, whose frames are only decoded when needed. Each
+    frame is kept once, with its own delay. transform() returns the same
+    animation with an operation applied to each frame, also on demand.
+    Decoded and transformed frames are kept in a cache shared by all
+    animations, and limited by the 'animation cache size' preference. '''
+
+    def __init__(self, source, ops=()):
+        self._source = source
+        #: Operations applied to each frame, as (function, args, kwargs).
+        self._ops = ops
+
+    @property
+    def n_frames(self):
+        return self._source.n_frames
+
+    @property
+    def loop(self):
+        ''' Number of times the animation is played, 0 for infinitely. '''
+        return self._source.loop
+
+    @property
+    def data_size(self):
+        ''' Size of the image file content, in bytes. '''
+        return len(self._source.data)
+
+    def transform(self, function, *args, **kwargs):
+        ''' Returns this animation with function(frame, *<args>,
+        **<kwargs>) applied to each frame, or this animation if transforms
+        are disabled. All arguments must be hashable (lists are converted
+        to tuples). '''
+        if not prefs['animation transform']:
+            return self
+        args = tuple(tuple(a) if isinstance(a, list) else a for a in args)
+        op = (function, args, tuple(sorted(kwargs.items())))
+        return Animation(self._source, self._ops + (op,))
+
+    def get_frame(self, index):
+        ''' Returns (pixbuf, delay in milliseconds) for frame <index>. '''
+        pixbuf = self._get_pixbuf(index)
+        return pixbuf, self._source.delays[index]
+
+    def get_static_image(self):
+        return self._get_pixbuf(0)
+
+    def is_static_image(self):
+        return False
+
+    def get_width(self):
+        return self.get_static_image().get_width()
+
+    def get_height(self):
+        return self.get_static_image().get_height()
+
+    def _get_pixbuf(self, index):
+        cache = _get_frame_cache()
+        key = (self._source.key, self._ops, index)
+        pixbuf = cache.get(key)
+        if pixbuf is not None:
+            return pixbuf
+        if self._ops:
+            pixbuf = Animation(self._source)._get_pixbuf(index)
+            for function, args, kwargs in self._ops:
+                pixbuf = function(pixbuf, *args, **dict(kwargs))
         else:
-            anime.set_loop(True)
-        for l in range(max(1, self.loop)):
-            for n, frame in enumerate(self.framelist):
-                if not frame:
-                    raise OSError('animation corrupted')
-                pixbuf, duration = frame
-                if not (duration and self.duration):
-                    loop = 1
-                else:
-                    loop = duration // self.duration
-                for c in range(loop):
-                    anime.add_frame(pixbuf)
-
-        anime._framebuffer = self
-
-        return anime
-
-
-def frame_executor(animation, function, args=(), kwargs={}):
-    if not prefs['animation transform']:
-        # transform disabled, do nothing
-        return animation
-    if not callable(function):
-        # function is not a function, do nothing
-        return animation
-    framebuffer = getattr(animation, '_framebuffer', None)
-    if not framebuffer:
-        # animation does not have AnimeFrameBuffer, do nothing
-        return animation
-    # call function on every frame
-    anime = AnimeFrameBuffer(framebuffer.n_frames, loop=framebuffer.loop)
-    for n, frame in enumerate(framebuffer.framelist):
-        pixbuf, duration = frame
-        anime.add_frame(n, function(pixbuf, *args, **kwargs), duration)
-    return anime.create_animation()
+            pixbuf = self._source.decode(index)
+        cache.add(key, pixbuf)
+        return pixbuf
+
+
+class _Player(object):
+
+    ''' Shows the frames of an animation in a Gtk.Image, each for its own
+    delay, until the image content is replaced. While a frame is shown, the
+    next one is decoded in the background, so that decoding neither blocks
+    the interface nor adds to the frame delay. '''
+
+    def __init__(self, image, animation):
+        self._image = image
+        self._animation = animation
+        self._loops = 0
+        self._pixbuf = None
+        self._timeout = None
+        self._stopped = False
+        #: Next frame as (index, pixbuf, delay), once decoded.
+        self._next = None
+        #: True once the current frame delay has elapsed.
+        self._due = False
+
+    def start(self):
+        pixbuf, delay = self._animation.get_frame(0)
+        self._show(0, pixbuf, delay)
+
+    def stop(self):
+        self._stopped = True
+        if self._timeout is not None:
+            GLib.source_remove(self._timeout)
+            self._timeout = None
+
+    def _show(self, index, pixbuf, delay):
+        self._pixbuf = pixbuf
+        self._image.set_from_pixbuf(pixbuf)
+        next_index = index + 1
+        if next_index == self._animation.n_frames:
+            self._loops += 1
+            if self._animation.loop and self._loops >= self._animation.loop:
+                return
+            next_index = 0
+        self._next = None
+        self._due = False
+        # Started before decoding the next frame, so the delay is kept.
+        self._timeout = GLib.timeout_add(delay, self._frame_due)
+        _get_thread().apply_async(self._decode, (next_index,))
+
+    def _decode(self, index):
+        # Run in the background thread.
+        try:
+            pixbuf, delay = self._animation.get_frame(index)
+        except Exception as e:
+            log.warning('Failed to decode animation frame %u: %s', index + 1, e)
+            return
+        GLib.idle_add(self._frame_ready, index, pixbuf, delay)
+
+    def _frame_ready(self, index, pixbuf, delay):
+        self._next = (index, pixbuf, delay)
+        if self._due:
+            # Decoded later than the frame delay.
+            self._next_frame()
+        return False
+
+    def _frame_due(self):
+        self._timeout = None
+        self._due = True
+        if self._next is not None:
+            self._next_frame()
+        return False
+
+    def _next_frame(self):
+        if self._stopped:
+            return
+        if self._image.get_pixbuf() is not self._pixbuf or \
+                not self._image.get_visible():
+            # Cleared, replaced or hidden.
+            return
+        self._show(*self._next)
+
+
+def play(image, animation):
+    ''' Show <animation> in the Gtk.Image <image>. '''
+    stop(image)
+    player = _Player(image, animation)
+    image._anime_player = player
+    player.start()
+
+
+def stop(image):
+    ''' Stop the animation shown in the Gtk.Image <image>, if any. '''
+    player = getattr(image, '_anime_player', None)
+    if player is not None:
+        player.stop()
+        image._anime_player = None
+
+
+def clear_cache():
+    ''' Remove all decoded and transformed frames from the cache. '''
+    with _frame_cache_lock:
+        if _frame_cache is not None:
+            _frame_cache.clear()
+
+
+def shutdown():
+    ''' Stop the background thread decoding frames, if it was used. '''
+    global _thread
+
+    with _frame_cache_lock:
+        thread, _thread = _thread, None
+    if thread is not None:
+        thread.terminate()
+        thread.join()
+
+
+def _get_thread():
+    global _thread
+
+    with _frame_cache_lock:
+        if _thread is None:
+            _thread = mt.ThreadPool(name='Animation', processes=1)
+        return _thread
+
+
+def _get_frame_cache():
+    global _frame_cache
+
+    with _frame_cache_lock:
+        if _frame_cache is None:
+            # Circular import.
+            from mcomix import page_cache
+            _frame_cache = page_cache.RenderCache(_MAX_CACHED_FRAMES)
+        _frame_cache.limit = prefs['animation cache size'] * 1048576
+        return _frame_cache
+
+# vim: expandtab:sw=4:ts=4
@@ -7,17 +7,22 @@ import os
 import errno
 import shutil
 import sys
+import tempfile
 import threading
 
 from mcomix import archive
 from mcomix import callback
 from mcomix import i18n
+from mcomix import log
 from mcomix import portability
 from mcomix import process
 from mcomix import tools
 from mcomix.lib import mountmanager
 from mcomix.preferences import prefs
 
+# Filled on-demand by MountArchive._is_available
+_mounter_available = {}
+
 
 class BaseArchive(object):
     ''' Base archive interface. All filenames passed from and into archives
@@ -27,12 +32,20 @@ class BaseArchive(object):
     ''' True if concurrent calls to extract is supported. '''
     support_concurrent_extractions = False
 
+    ''' True if read() is supported, i.e. members can be extracted
+    to memory without going through the filesystem. '''
+    support_memory_extraction = False
+
+    ''' True if iter_extract() is efficient for any subset of members,
+    e.g. extracting them with a single process. '''
+    support_batch_extraction = False
+
     def __init__(self, archive):
         assert isinstance(archive, str), 'File should be an Unicode string.'
 
         self.archive = archive
         self._password = None
-        self.is_encrypted = False
+        self._is_encrypted = False
         self._event = threading.Event()
         if self.support_concurrent_extractions:
             # When multiple concurrent extractions are supported,
@@ -60,18 +73,68 @@ class BaseArchive(object):
             isinstance(destination_dir, str)
         return os.path.join(destination_dir, filename)
 
-    def iter_extract(self, entries, destination_dir):
-        ''' Generator to extract <entries> from archive to <destination_dir>. '''
+    def read(self, filename):
+        ''' Returns the content of the file specified by <filename> as a
+        bytes-like object (e.g. bytes or memoryview).
+        This filename must be obtained by calling list_contents().
+        Only supported if <support_memory_extraction> is True. '''
+        raise NotImplementedError('Memory extraction is not supported.')
+
+    def read_in_place(self, filename):
+        ''' Returns the content of the file specified by <filename>
+        without reading it, as a reader.FileRange over the archive file (or
+        a memoryview for archives already in memory), if it is stored
+        uncompressed. Returns None if not supported. '''
+        return None
+
+    def iter_extract(self, entries, destination_dir, skip=None):
+        ''' Generator to extract <entries> from archive to <destination_dir>.
+        If given, <skip> is called with the name of each entry when reached,
+        and if it returns True the entry is not written (it is still
+        decompressed with solid archives) nor yielded. '''
         wanted = set(entries)
         for filename in self.iter_contents():
             if filename not in wanted:
                 continue
+            if skip is not None and skip(filename):
+                wanted.remove(filename)
+                if not wanted:
+                    break
+                continue
             self.extract(filename, destination_dir)
             yield filename
             wanted.remove(filename)
             if not wanted:
                 break
 
+    def set_target_size(self, size):
+        ''' Set the <size> pages are to be displayed at, for formats that
+        are rendered at a chosen resolution (e.g. PDF), or None for full
+        resolution. Returns the list of already extracted files that were
+        rendered at a resolution too small for <size>. '''
+        return []
+
+    @property
+    def is_encrypted(self):
+        ''' True if the archive is encrypted. '''
+        return self._is_encrypted
+
+    @is_encrypted.setter
+    def is_encrypted(self, value):
+        self._is_encrypted = value
+
+    def get_listing(self):
+        ''' Returns the state built by listing the archive contents as a
+        JSON serializable object, so it can be saved and later restored
+        with set_listing() instead of listing the archive again. Returns
+        None if not supported, or if the contents have not been listed. '''
+        return None
+
+    def set_listing(self, listing):
+        ''' Restore the state returned by get_listing() for the same
+        (unmodified) archive. Returns False if not supported. '''
+        return False
+
     def close(self):
         ''' Closes the archive and releases held resources. '''
         pass
@@ -198,6 +261,25 @@ class ExternalExecutableArchive(NonUnicodeArchive):
         # This builds the Unicode mapping and is likely required
         # for extracting filenames that have been internally mapped.
         self.filenames_initialized = False
+        # Encryption is only detected when first needed, as it usually
+        # requires running the executable (see is_encrypted).
+        self._is_encrypted = None
+
+    @property
+    def is_encrypted(self):
+        if self._is_encrypted is None:
+            # The arguments used for detection depend on this flag.
+            self._is_encrypted = False
+            self._is_encrypted = self._has_encryption()
+        return self._is_encrypted
+
+    @is_encrypted.setter
+    def is_encrypted(self, value):
+        self._is_encrypted = value
+
+    def _has_encryption(self):
+        ''' Returns True if the archive is encrypted. '''
+        return False
 
     def _get_executable(self):
         ''' Returns the executable's name or path. Return None if no executable
@@ -234,6 +316,84 @@ class ExternalExecutableArchive(NonUnicodeArchive):
 
         self.filenames_initialized = True
 
+    def _iter_extract_batch(self, entries, destination_dir, skip=None):
+        ''' Extract <entries> to <destination_dir> with a single process,
+        see iter_extract() for <skip>.
+        Needs <self._contents>, a list of (original name, size) of the
+        (non-empty) members in archive order, and
+        _get_extract_arguments(list_file) to write the members named
+        in <list_file> to STDOUT, one after the other. '''
+        if not self._get_executable():
+            return
+
+        if not self.filenames_initialized:
+            self.list_contents()
+
+        wanted = dict([(self._original_filename(unicode_name), unicode_name)
+                       for unicode_name in entries])
+        sizes = dict(self._contents)
+        for filename in [f for f in wanted if f not in sizes]:
+            # Empty files are not output at all.
+            unicode_name = wanted.pop(filename)
+            if skip is not None and skip(unicode_name):
+                continue
+            with self._create_file(os.path.join(destination_dir, unicode_name)):
+                pass
+            yield unicode_name
+        if not wanted:
+            return
+
+        if any(c in filename for filename in wanted for c in '*?'):
+            # Names from the list file would be used as wildcards and match
+            # other members, extract everything instead.
+            list_file = None
+            contents = self._contents
+        else:
+            contents = [(filename, size) for filename, size in self._contents
+                        if filename in wanted]
+            list_file = tempfile.NamedTemporaryFile(mode='wt', prefix='mcomix.list.')
+            list_file.write(''.join(filename + os.linesep for filename, size in contents))
+            list_file.flush()
+        try:
+            cmd = self._get_extract_arguments(
+                list_file=None if list_file is None else list_file.name)
+            with process.popen(cmd) as proc:
+                for filename, size in contents:
+                    unicode_name = wanted.pop(filename, None)
+                    if unicode_name is None or \
+                       (skip is not None and skip(unicode_name)):
+                        _copy_data(proc.stdout, None, size)
+                        if not wanted:
+                            break
+                        continue
+                    with self._create_file(os.path.join(destination_dir, unicode_name)) as output:
+                        _copy_data(proc.stdout, output, size)
+                    yield unicode_name
+                    if not wanted:
+                        break
+        finally:
+            if list_file is not None:
+                list_file.close()
+
+    def get_listing(self):
+        if not self.filenames_initialized:
+            return None
+        names = list(self.unicode_mapping.items())
+        # Only text output from the executable can be serialized.
+        if not all(isinstance(name, str) for unicode_name, name in names):
+            return None
+        return {
+            'names': names,
+            'solid': self.is_solid(),
+            'encrypted': self.is_encrypted,
+        }
+
+    def set_listing(self, listing):
+        self.unicode_mapping = dict(listing['names'])
+        self._is_encrypted = listing['encrypted']
+        self.filenames_initialized = True
+        return True
+
     def extract(self, filename, destination_dir):
         ''' Extract <filename> from the archive to <destination_dir>. '''
         assert isinstance(filename, str) and \
@@ -255,7 +415,22 @@ class ExternalExecutableArchive(NonUnicodeArchive):
         return destination_path
 
 
+def _copy_data(src, dst, size, chunk_size=1048576):
+    ''' Copy <size> bytes from <src> to <dst> (skip them if None). '''
+    while size > 0:
+        data = src.read(min(size, chunk_size))
+        if not data:
+            break
+        if dst is not None:
+            dst.write(data)
+        size -= len(data)
+
+
 class MountArchive(BaseArchive):
+    ''' Archive mounted with a FUSE filesystem. The archive is mounted once
+    and stays mounted until closed. Members are never copied: extracted
+    files are symbolic links to the mountpoint. '''
+
     def __init__(self, archive, mounter, options=[]):
         super(MountArchive, self).__init__(archive)
         self._src = self.archive
@@ -270,10 +445,30 @@ class MountArchive(BaseArchive):
         self._lock = threading.Lock()
 
         with self._lock:
-            with self._mgr(self._src, options=self._mountoptions) as m:
-                for paths in tools.walkpath(m.mountpoint):
-                    self._contents.append(os.path.join(*paths))
+            for paths in tools.walkpath(self._get_mountpoint()):
+                self._contents.append(os.path.join(*paths))
         self._contents.sort()
+        self._members = set(self._contents)
+
+    def _get_mountpoint(self):
+        ''' Returns the mountpoint, mounting the archive first if needed
+        (must be called with the lock held). '''
+        if not self._mgr.is_mounted():
+            self._mgr.mount(self._src, options=self._mountoptions)
+        return self._mgr.mountpoint
+
+    def _link(self, fn, mountpoint, dstdir):
+        ''' Create a symbolic link to member <fn> in <dstdir>. '''
+        src = os.path.join(mountpoint, fn)
+        dstfile = os.path.join(dstdir, fn)
+        if os.path.islink(dstfile):
+            if os.readlink(dstfile) == src:
+                return dstfile
+            # Link to a previous mountpoint.
+            os.remove(dstfile)
+        self._create_directory(os.path.dirname(dstfile))
+        os.symlink(src, dstfile)
+        return dstfile
 
     def iter_contents(self):
         yield from self._contents
@@ -286,39 +481,29 @@ class MountArchive(BaseArchive):
 
     def extract(self, fn, dstdir):
         with self._lock:
-            dstfile = os.path.join(dstdir, fn)
-            if self._mgr.is_mounted():
-                with open(os.path.join(self._mgr.mountpoint, fn), mode='rb') as src:
-                    data = src.read()
-            else:
-                with self._mgr(self._src, options=self._mountoptions) as m:
-                    with open(os.path.join(m.mountpoint, fn), mode='rb') as src:
-                        data = src.read()
-            with self._create_file(dstfile) as dst:
-                dst.write(data)
-        return dstfile
+            mountpoint = self._get_mountpoint()
+        return self._link(fn, mountpoint, dstdir)
 
-    def iter_extract(self, names, dstdir):
+    def iter_extract(self, names, dstdir, skip=None):
         with self._lock:
-            self._create_directory(dstdir)
-            if self._mgr.is_mounted():
-                if dstdir != self._mgr.mountpoint:
-                    # umount before change mountpoint
-                    self._mgr.umount()
-            if not self._mgr.is_mounted():
-                self._mgr.mount(self._src, options=self._mountoptions,
-                                mountpoint=dstdir)
-            for name in names:
-                if name in self._contents:
-                    yield name
+            mountpoint = self._get_mountpoint()
+        for name in names:
+            if skip is not None and skip(name):
+                continue
+            if name in self._members:
+                self._link(name, mountpoint, dstdir)
+                yield name
 
     def close(self):
+        if self._mgr is None:
+            return
         with self._lock:
-            while self._mgr.is_mounted():
+            if self._mgr.is_mounted():
+                # Do not wait for files still in use to be closed.
                 try:
-                    self._mgr.umount()
-                except BaseException:
-                    self._lock.acquire(timeout=.5)
+                    self._mgr.umount(lazy=True)
+                except Exception as e:
+                    log.warning('Failed to unmount "%s": %s', self._src, e)
 
     @staticmethod
     def _is_available(mounter):
@@ -326,6 +511,9 @@ class MountArchive(BaseArchive):
             return False
         if not prefs['mount']:
             return False
-        return shutil.which(mounter) and shutil.which('fusermount')
+        if mounter not in _mounter_available:
+            _mounter_available[mounter] = bool(
+                shutil.which(mounter) and shutil.which('fusermount'))
+        return _mounter_available[mounter]
 
 # vim: expandtab:sw=4:ts=4
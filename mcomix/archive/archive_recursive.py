@@ -9,6 +9,7 @@ from mcomix.preferences import prefs
 from mcomix.archive import archive_base
 from mcomix import archive_tools
 from mcomix import log
+from mcomix import reaper
 
 
 class RecursiveArchive(archive_base.BaseArchive):
@@ -16,7 +17,6 @@ class RecursiveArchive(archive_base.BaseArchive):
     def __init__(self, archive, prefix='mcomix.'):
         super(RecursiveArchive, self).__init__(archive.archive)
         self._main_archive = archive
-        self.is_encrypted = self._main_archive.is_encrypted
         self._tempdir = tempfile.TemporaryDirectory(prefix=prefix, dir=prefs['temporary directory'])
         self._sub_tempdirs = []
         self._sub_archives = set()
@@ -30,6 +30,14 @@ class RecursiveArchive(archive_base.BaseArchive):
         self._contents = []
         # Assume concurrent extractions are not supported.
         self.support_concurrent_extractions = False
+        # Same for extractions to memory.
+        self.support_memory_extraction = False
+        # And batched extractions.
+        self.support_batch_extraction = False
+
+    @property
+    def is_encrypted(self):
+        return self._main_archive.is_encrypted
 
     def _iter_contents(self, archive, root=None, decrypt=True):
         if archive.is_encrypted and not decrypt:
@@ -40,19 +48,22 @@ class RecursiveArchive(archive_base.BaseArchive):
         self._archive_root[archive] = root
         sub_archive_list = []
         for f in archive.iter_contents():
+            name = f if root is None else os.path.join(root, f)
+            self._entry_mapping[name] = (archive, f)
             if archive_tools.is_archive_file(f):
+                sub_archive = self._open_memory_sub_archive(archive, f, name)
+                if sub_archive is not None:
+                    # Read in place, so it can be listed right away, and
+                    # its contents are kept in order with the other files.
+                    for name in self._iter_sub_archive_contents(sub_archive):
+                        yield name
+                    continue
                 # We found a sub-archive, don't try to extract it now, as we
                 # must finish listing the containing archive contents before
                 # any extraction can be done.
                 sub_archive_list.append(f)
-                name = f if root is None else os.path.join(root, f)
-                self._entry_mapping[name] = (archive, f)
                 self._sub_archives.add(name)
                 continue
-            name = f
-            if root is not None:
-                name = os.path.join(root, name)
-            self._entry_mapping[name] = (archive, f)
             yield name
         for f in sub_archive_list:
             # Extract sub-archive.
@@ -66,14 +77,38 @@ class RecursiveArchive(archive_base.BaseArchive):
                 log.warning('Non-supported archive format: %s',
                             os.path.basename(sub_archive_path))
                 continue
-            sub_tempdir = tempfile.TemporaryDirectory(
-                prefix='sub_archive.{:04}.'.format(len(self._archive_list)),
-                dir=self.destdir)
-            sub_root = sub_tempdir.name
-            self._sub_tempdirs.append(sub_tempdir)
-            for name in self._iter_contents(sub_archive, sub_root):
+            for name in self._iter_sub_archive_contents(sub_archive):
                 yield name
-            os.remove(sub_archive_path)
+            if sub_archive.support_memory_extraction:
+                # Keep it around, so it can still be read from.
+                self._sub_archives.discard(os.path.join(root, f))
+            else:
+                os.remove(sub_archive_path)
+
+    def _iter_sub_archive_contents(self, sub_archive):
+        sub_tempdir = tempfile.TemporaryDirectory(
+            prefix='sub_archive.{:04}.'.format(len(self._archive_list)),
+            dir=self.destdir)
+        self._sub_tempdirs.append(sub_tempdir)
+        for name in self._iter_contents(sub_archive, sub_tempdir.name):
+            yield name
+
+    def _open_memory_sub_archive(self, archive, f, name):
+        ''' Try to open the sub-archive <f> of <archive> in place, from the
+        file (or memory) of its parent (e.g. a ZIP archive stored in a ZIP
+        archive), without extracting it. Returns None if not possible. '''
+        try:
+            data = archive.read_in_place(f)
+        except Exception as e:
+            log.debug('failed to read sub-archive %s: %s', name, e)
+            return None
+        if data is None:
+            # Would be a full copy: better extract it to disk.
+            return None
+        sub_archive = archive_tools.get_memory_archive_handler(name, data)
+        if sub_archive is not None:
+            log.debug('reading sub-archive in place: %s', name)
+        return sub_archive
 
     def _check_concurrent_extraction_support(self):
         supported = True
@@ -84,6 +119,18 @@ class RecursiveArchive(archive_base.BaseArchive):
                 break
         self.support_concurrent_extractions = supported
 
+    def _check_memory_extraction_support(self):
+        # We need all archives to support extractions to memory.
+        self.support_memory_extraction = all(
+            archive.support_memory_extraction
+            for archive in self._archive_list)
+
+    def _check_batch_extraction_support(self):
+        # Sub-archives are extracted again by iter_extract.
+        self.support_batch_extraction = not self._sub_archives and all(
+            archive.support_batch_extraction
+            for archive in self._archive_list)
+
     def iter_contents(self, decrypt=True):
         if self._contents_listed:
             for f in self._contents:
@@ -96,12 +143,58 @@ class RecursiveArchive(archive_base.BaseArchive):
         self._contents_listed = True
         # We can now check if concurrent extractions are really supported.
         self._check_concurrent_extraction_support()
+        self._check_memory_extraction_support()
+        self._check_batch_extraction_support()
 
     def list_contents(self, decrypt=True):
         if self._contents_listed:
             return self._contents
         return [f for f in self.iter_contents(decrypt=decrypt)]
 
+    def set_target_size(self, size):
+        names = []
+        for archive in self._archive_list:
+            root = self._archive_root[archive]
+            names.extend(os.path.join(root, f) for f in archive.set_target_size(size))
+        return names
+
+    def get_members(self):
+        ''' Returns the names of the listed files, relative to the archive
+        (or sub-archive) containing them. '''
+        if not self._contents_listed:
+            self.list_contents()
+        return [self._entry_mapping[name][1] for name in self._contents]
+
+    def get_listing(self):
+        # Restoring sub-archives is not supported, as they must be
+        # extracted (or at least opened) to be read anyway.
+        if not self._contents_listed or self._sub_archives or \
+           len(self._archive_list) > 1:
+            return None
+        listing = self._main_archive.get_listing()
+        if listing is None:
+            return None
+        return {'members': self.get_members(), 'archive': listing}
+
+    def set_listing(self, listing):
+        if self._contents_listed:
+            return False
+        if not self._main_archive.set_listing(listing['archive']):
+            return False
+        root = os.path.join(self.destdir, 'main_archive')
+        self._archive_list = [self._main_archive]
+        self._archive_root[self._main_archive] = root
+        self._contents = []
+        for f in listing['members']:
+            name = os.path.join(root, f)
+            self._entry_mapping[name] = (self._main_archive, f)
+            self._contents.append(name)
+        self._contents_listed = True
+        self._check_concurrent_extraction_support()
+        self._check_memory_extraction_support()
+        self._check_batch_extraction_support()
+        return True
+
     def extract(self, filename):
         if not self._contents_listed:
             self.list_contents()
@@ -114,7 +207,13 @@ class RecursiveArchive(archive_base.BaseArchive):
                   archive.archive, destination_dir, filename)
         return archive.extract(name, destination_dir)
 
-    def iter_extract(self, entries, destination_dir):
+    def read(self, filename):
+        if not self._contents_listed:
+            self.list_contents()
+        archive, name = self._entry_mapping[filename]
+        return archive.read(name)
+
+    def iter_extract(self, entries, destination_dir, skip=None):
         if not self._contents_listed:
             self.list_contents()
         # Unfortunately we can't just rely on BaseArchive default
@@ -136,7 +235,14 @@ class RecursiveArchive(archive_base.BaseArchive):
             log.debug('extracting from %s to %s: %s',
                       archive.archive, archive_destination_dir,
                       ' '.join(archive_wanted.keys()))
-            for f in archive.iter_extract(archive_wanted.keys(), archive_destination_dir):
+            archive_skip = None
+            if skip is not None:
+                # Sub-archives must be extracted to be listed.
+                def archive_skip(f, archive_wanted=archive_wanted):
+                    name = archive_wanted[f]
+                    return name not in self._sub_archives and skip(name)
+            for f in archive.iter_extract(archive_wanted.keys(), archive_destination_dir,
+                                          skip=archive_skip):
                 name = archive_wanted[f]
                 if name in self._sub_archives:
                     continue
@@ -159,8 +265,8 @@ class RecursiveArchive(archive_base.BaseArchive):
         for archive in reversed(self._archive_list):
             archive.close()
         for tempdir in self._sub_tempdirs:
-            tempdir.cleanup()
-        self._tempdir.cleanup()
+            reaper.cleanup(tempdir)
+        reaper.cleanup(self._tempdir)
 
     def __enter__(self):
         return self
@@ -5,6 +5,7 @@
 import math
 import os
 import re
+import threading
 
 from mcomix import log
 from mcomix import process
@@ -14,6 +15,10 @@ from mcomix.archive import archive_base
 PDF_RENDER_DPI_DEF = 72 * 4
 # Maximum DPI for rendering.
 PDF_RENDER_DPI_MAX = 72 * 10
+# DPI for quick previews, and minimum DPI for rendering.
+PDF_RENDER_DPI_PREVIEW = 72
+# Maximum number of pages rendered by a single process.
+_MAX_RENDER_PAGES = 8
 
 _pdf_possible = None
 _mutool_exec = []
@@ -26,10 +31,23 @@ class PdfArchive(archive_base.BaseArchive):
     ''' Concurrent calls to extract welcome! '''
     support_concurrent_extractions = True
 
+    ''' Consecutive pages are rendered by a single process, see iter_extract(). '''
+    support_batch_extraction = True
+
+    _page_regex = re.compile(r'^\s*<page\b.*\bnumber="(?P<number>\d+)"')
+    _mediabox_regex = re.compile(r'\bmediabox="(?P<mediabox>[^"]+)"')
     _fill_image_regex = re.compile(r'^\s*<fill_image\b.*\bmatrix="(?P<matrix>[^"]+)".*\bwidth="(?P<width>\d+)".*\bheight="(?P<height>\d+)".*/>\s*$')
 
     def __init__(self, archive):
         super(PdfArchive, self).__init__(archive)
+        # Optimal rendering DPI of each page, see _get_dpi().
+        self._dpi = {}
+        # Size of each page, in points.
+        self._page_size = {}
+        # DPI each extracted page was rendered at.
+        self._rendered = {}
+        self._target_size = None
+        self._dpi_lock = threading.Lock()
 
     def iter_contents(self):
         with process.popen(_mutool_exec + ['show', '--', self.archive, 'pages'],
@@ -38,38 +56,145 @@ class PdfArchive(archive_base.BaseArchive):
                 if line.startswith('page '):
                     yield line.split()[1] + '.png'
 
+    def set_target_size(self, size):
+        with self._dpi_lock:
+            self._target_size = size
+            return [str(page) + '.png' for page, dpi in self._rendered.items()
+                    if dpi < self._get_render_dpi(page)]
+
     def extract(self, filename, destination_dir):
         self._create_directory(destination_dir)
-        destination_path = os.path.join(destination_dir, filename)
         page_num, ext = os.path.splitext(filename)
-        # Try to find optimal DPI.
-        cmd = _mudraw_exec + _mudraw_trace_args + ['--', self.archive, str(page_num)]
-        log.debug('finding optimal DPI for %s: %s', filename, ' '.join(cmd))
+        page = int(page_num)
+        self._render(page, page, self._get_dpi([page])[page], destination_dir)
+        return os.path.join(destination_dir, filename)
+
+    def iter_extract(self, entries, destination_dir, skip=None):
+        self._create_directory(destination_dir)
+        pages = {}
+        for filename in entries:
+            if skip is not None and skip(filename):
+                continue
+            page_num, ext = os.path.splitext(filename)
+            pages[int(page_num)] = filename
+        if not pages:
+            return
+        dpi = self._get_dpi(sorted(pages))
+        if '%' in destination_dir:
+            # Would be interpreted as part of the output pattern.
+            max_length = 1
+        else:
+            max_length = _MAX_RENDER_PAGES
+        # Start with a single page: <entries> are in priority order, so the
+        # first one is usually the page being waited for. If slow to render,
+        # show a preview first. The others are rendered in page order.
+        first = next(iter(pages))
+        pending = sorted(page for page in pages if page != first)
+        with self._dpi_lock:
+            preview = first not in self._rendered and \
+                dpi[first] > 2 * PDF_RENDER_DPI_PREVIEW
+        if preview:
+            self._render(first, first, PDF_RENDER_DPI_PREVIEW, destination_dir)
+            yield pages[first]
+        self._render(first, first, dpi[first], destination_dir)
+        yield pages[first]
+        while pending:
+            first = last = pending.pop(0)
+            while pending and pending[0] == last + 1 and \
+                    dpi[pending[0]] == dpi[first] and \
+                    last - first + 1 < max_length:
+                last = pending.pop(0)
+            self._render(first, last, dpi[first], destination_dir)
+            for page in range(first, last + 1):
+                yield pages[page]
+
+    def _render(self, first, last, dpi, destination_dir):
+        ''' Render pages <first> to <last> at <dpi> to <destination_dir>.
+        Pages are rendered to a temporary file first, so that a page
+        rendered again does not replace the file while it is being read. '''
+        if first == last:
+            output = os.path.join(destination_dir, '%u.tmp.png' % first)
+        else:
+            # mutool replaces %d with the page number.
+            output = os.path.join(destination_dir, '%d.tmp.png')
+        cmd = _mudraw_exec + ['-r', str(dpi), '-o', output,
+                              '--', self.archive, '%u-%u' % (first, last)]
+        log.debug('rendering pages %u-%u: %s', first, last, ' '.join(cmd))
+        process.call(cmd)
+        for page in range(first, last + 1):
+            try:
+                os.replace(os.path.join(destination_dir, '%u.tmp.png' % page),
+                           os.path.join(destination_dir, '%u.png' % page))
+            except OSError as e:
+                log.warning('Failed to render page %u of "%s": %s',
+                            page, self.archive, e)
+                continue
+            with self._dpi_lock:
+                self._rendered[page] = dpi
+
+    def _get_dpi(self, pages):
+        ''' Return a dictionary with the rendering DPI for each page number
+        in <pages>: the optimal DPI, or less if enough for the target size.
+        The pages that were not analysed yet are traced with a single
+        process, and the results are cached. '''
+        with self._dpi_lock:
+            missing = [page for page in pages if page not in self._dpi]
+        if missing:
+            dpi, page_size = self._trace(missing)
+            with self._dpi_lock:
+                self._dpi.update(dpi)
+                self._page_size.update(page_size)
+        with self._dpi_lock:
+            return {page: self._get_render_dpi(page) for page in pages}
+
+    def _get_render_dpi(self, page):
+        # Must be called with the lock held.
+        dpi = self._dpi[page]
+        if self._target_size is None or page not in self._page_size:
+            return dpi
+        # Same as for JPEG draft decoding: the rendered page must not be
+        # smaller than the target size in either dimension.
+        scale = max(self._target_size) / min(self._page_size[page])
+        return min(dpi, max(PDF_RENDER_DPI_PREVIEW, int(math.ceil(72 * scale))))
+
+    def _trace(self, pages):
+        ''' Find the optimal DPI for the page numbers in <pages> (sorted),
+        based on the resolution of the images they contain. Returns a tuple
+        of dictionaries (dpi, page size in points). '''
+        cmd = _mudraw_exec + _mudraw_trace_args + ['--', self.archive, _format_pages(pages)]
+        log.debug('finding optimal DPI for %u pages: %s', len(pages), ' '.join(cmd))
+        max_dpi = dict.fromkeys(pages, PDF_RENDER_DPI_DEF)
+        max_size = dict.fromkeys(pages, 0)
+        page_size = {}
+        page = pages[0]
         with process.popen(cmd, universal_newlines=True) as proc:
-            max_size = 0
-            max_dpi = PDF_RENDER_DPI_DEF
             for line in proc.stdout:
+                match = self._page_regex.match(line)
+                if match:
+                    page = int(match.group('number'))
+                    match = self._mediabox_regex.search(line)
+                    if match:
+                        x0, y0, x1, y1 = [float(f) for f in match.group('mediabox').split()]
+                        if x1 - x0 > 0 and y1 - y0 > 0:
+                            page_size[page] = (x1 - x0, y1 - y0)
+                    continue
                 match = self._fill_image_regex.match(line)
-                if not match:
+                if not match or page not in max_size:
                     continue
                 matrix = [float(f) for f in match.group('matrix').split()]
                 for size, coeff1, coeff2 in (
                     (int(match.group('width')), matrix[0], matrix[1]),
                     (int(match.group('height')), matrix[2], matrix[3]),
                 ):
-                    if size < max_size:
+                    if size < max_size[page]:
                         continue
                     render_size = math.sqrt(coeff1 * coeff1 + coeff2 * coeff2)
                     dpi = int(size * 72 / render_size)
                     if dpi > PDF_RENDER_DPI_MAX:
                         dpi = PDF_RENDER_DPI_MAX
-                    max_size = size
-                    max_dpi = dpi
-        # Render...
-        cmd = _mudraw_exec + ['-r', str(max_dpi), '-o', destination_path, '--', self.archive, str(page_num)]
-        log.debug('rendering %s: %s', filename, ' '.join(cmd))
-        process.call(cmd)
-        return destination_path
+                    max_size[page] = size
+                    max_dpi[page] = dpi
+        return max_dpi, page_size
 
     @staticmethod
     def is_available():
@@ -122,4 +247,17 @@ class PdfArchive(archive_base.BaseArchive):
             log.info('MuPDF not available.')
         return _pdf_possible
 
+
+def _format_pages(pages):
+    ''' Format the page numbers in <pages> (sorted) as a list of ranges
+    suitable for mutool, e.g. "1-3,5". '''
+    ranges = []
+    for page in pages:
+        if ranges and ranges[-1][1] == page - 1:
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+    return ','.join(str(first) if first == last else '%u-%u' % (first, last)
+                    for first, last in ranges)
+
 # vim: expandtab:sw=4:ts=4
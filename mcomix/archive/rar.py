@@ -7,6 +7,8 @@ import sys
 import os
 import ctypes
 import ctypes.util
+import io
+import threading
 
 from mcomix import constants
 from mcomix.archive import archive_base
@@ -37,8 +39,15 @@ class RarArchive(archive_base.BaseArchive):
     class _ProcessingMode(object):
         ''' Rar file processing mode '''
         RAR_SKIP = 0
+        RAR_TEST = 1
         RAR_EXTRACT = 2
 
+    class _CallbackMessage(object):
+        ''' Rar callback messages '''
+        UCM_CHANGEVOLUME = 0
+        UCM_PROCESSDATA = 1
+        UCM_NEEDPASSWORD = 2
+
     class _ErrorCode(object):
         ''' Rar error codes '''
         ERAR_END_ARCHIVE = 10
@@ -112,9 +121,18 @@ class RarArchive(archive_base.BaseArchive):
         self._callback_function = None
         self._is_solid = False
         self.is_encrypted = False
+        # Member names, once fully listed, see get_listing().
+        self._names = None
         # Information about the current file will be stored in this structure
         self._headerdata = RarArchive._RARHeaderDataEx()
         self._current_filename = None
+        # Separate handle used by read(), so that reading a member
+        # does not disturb an extraction running in another thread.
+        self._read_lock = threading.Lock()
+        self._read_handle = None
+        self._read_callback_function = None
+        self._read_headerdata = RarArchive._RARHeaderDataEx()
+        self._read_buffer = None
 
         # Set up function prototypes.
         # Mandatory since pointers get truncated on x64 otherwise!
@@ -138,16 +156,25 @@ class RarArchive(archive_base.BaseArchive):
     def is_solid(self):
         return self._is_solid
 
+    @property
+    def support_memory_extraction(self):
+        # Members are read through a dedicated handle, see read(). Reading
+        # an entry from a solid archive would mean decompressing all the
+        # preceding ones again, so only do that for non-solid archives.
+        return not self._is_solid
+
     def iter_contents(self):
         ''' List archive contents. '''
         self._close()
         self._open()
+        names = []
         try:
             while True:
                 self._read_header()
                 if 0 != (0x10 & self._headerdata.Flags):
                     self._is_solid = True
                 filename = self._current_filename
+                names.append(filename)
                 yield filename
                 # Skip to the next entry if we're still on the same name
                 # (extract may have been called by iter_extract).
@@ -157,10 +184,22 @@ class RarArchive(archive_base.BaseArchive):
             log.error('Error while listing contents: %s', str(exc))
         except EOFError:
             # End of archive reached.
-            pass
+            self._names = names
         finally:
             self._close()
 
+    def get_listing(self):
+        if self._names is None or self.is_encrypted:
+            return None
+        return {'names': self._names, 'solid': self._is_solid}
+
+    def set_listing(self, listing):
+        if self.is_encrypted:
+            return False
+        self._names = listing['names']
+        self._is_solid = listing['solid']
+        return True
+
     def extract(self, filename, destination_dir):
         ''' Extract <filename> from the archive to <destination_dir>. '''
         if not self._handle:
@@ -194,24 +233,66 @@ class RarArchive(archive_base.BaseArchive):
         # After all files have been extracted, close() should be called to free the handler resources.
         return destination_path
 
+    def read(self, filename):
+        ''' Read <filename> from the archive into memory. The data is
+        collected from UCM_PROCESSDATA callbacks while testing the entry. '''
+        with self._read_lock:
+            looped = False
+            while True:
+                if self._read_handle is None:
+                    self._read_callback_function = UNRARCALLBACK(self._read_callback)
+                    self._read_handle = self._open_handle(self._read_callback_function)
+                errorcode = self._unrar.RARReadHeaderEx(
+                    self._read_handle, ctypes.byref(self._read_headerdata))
+                if RarArchive._ErrorCode.ERAR_END_ARCHIVE == errorcode:
+                    # Same as extract: jump back to archive start once.
+                    self._close_read_handle()
+                    if looped:
+                        raise KeyError(filename)
+                    looped = True
+                    continue
+                self._check_read_errorcode(errorcode)
+                if self._read_headerdata.FileNameW != filename:
+                    errorcode = self._unrar.RARProcessFileW(
+                        self._read_handle, RarArchive._ProcessingMode.RAR_SKIP,
+                        None, None)
+                    self._check_read_errorcode(errorcode)
+                    continue
+                self._read_buffer = io.BytesIO()
+                try:
+                    errorcode = self._unrar.RARProcessFileW(
+                        self._read_handle, RarArchive._ProcessingMode.RAR_TEST,
+                        None, None)
+                    self._check_read_errorcode(errorcode)
+                    return self._read_buffer.getvalue()
+                finally:
+                    self._read_buffer.close()
+                    self._read_buffer = None
+
     def close(self):
         ''' Close the archive handle '''
         self._close()
+        with self._read_lock:
+            self._close_read_handle()
 
     def _open(self):
         ''' Open rar handle for extraction. '''
         self._callback_function = UNRARCALLBACK(self._password_callback)
+        self._handle = self._open_handle(self._callback_function)
+
+    def _open_handle(self, callback_function):
+        ''' Open and return a new rar handle using <callback_function>. '''
         archivedata = RarArchive._RAROpenArchiveDataEx(ArcNameW=self.archive,
                                                        OpenMode=RarArchive._OpenMode.RAR_OM_EXTRACT,
-                                                       Callback=self._callback_function,
+                                                       Callback=callback_function,
                                                        UserData=0)
 
         handle = self._unrar.RAROpenArchiveEx(ctypes.byref(archivedata))
         if not handle:
             errormessage = UnrarException.get_error_message(archivedata.OpenResult)
             raise UnrarException('Couldn\'t open archive: %s' % errormessage)
-        self._unrar.RARSetCallback(handle, self._callback_function, 0)
-        self._handle = handle
+        self._unrar.RARSetCallback(handle, callback_function, 0)
+        return handle
 
     def _has_encryption(self):
         ''' Checks archive encryption. '''
@@ -275,9 +356,30 @@ class RarArchive(archive_base.BaseArchive):
             raise UnrarException('Couldn\'t close archive: %s' % errormessage)
         self._handle = None
 
+    def _close_read_handle(self):
+        ''' Close the handle used by read(), if any. '''
+        if self._read_handle is None:
+            return
+        self._unrar.RARCloseArchive(self._read_handle)
+        self._read_handle = None
+
+    def _check_read_errorcode(self, errorcode):
+        if 0 == errorcode:
+            return
+        self._close_read_handle()
+        raise UnrarException(UnrarException.get_error_message(errorcode))
+
+    def _read_callback(self, msg, userdata, buffer_address, buffer_size):
+        ''' Called by the unrar library while reading a file to memory. '''
+        if msg == RarArchive._CallbackMessage.UCM_PROCESSDATA:
+            if self._read_buffer is not None:
+                self._read_buffer.write(ctypes.string_at(buffer_address, buffer_size))
+            return 1
+        return self._password_callback(msg, userdata, buffer_address, buffer_size)
+
     def _password_callback(self, msg, userdata, buffer_address, buffer_size):
         ''' Called by the unrar library in case of missing password. '''
-        if msg == 2:  # UCM_NEEDPASSWORD
+        if msg == RarArchive._CallbackMessage.UCM_NEEDPASSWORD:
             self._get_password()
             if len(self._password) == 0:
                 # Abort extraction
@@ -18,6 +18,9 @@ class RarArchive(archive_base.ExternalExecutableArchive):
 
     STATE_HEADER, STATE_LISTING = 1, 2
 
+    # iter_extract() uses a single process for any set of members.
+    support_batch_extraction = True
+
     class EncryptedHeader(Exception):
         pass
 
@@ -26,9 +29,6 @@ class RarArchive(archive_base.ExternalExecutableArchive):
         self._is_solid = False
         self._contents = []
 
-        self.is_encrypted = False
-        self.is_encrypted = self._has_encryption()
-
     def _get_executable(self):
         return self._find_unrar_executable()
 
@@ -49,8 +49,10 @@ class RarArchive(archive_base.ExternalExecutableArchive):
         args.extend(('--', self.archive))
         return args
 
-    def _get_extract_arguments(self):
+    def _get_extract_arguments(self, list_file=None):
         args = [self._get_executable(), 'p', '-inul', '-@']
+        if list_file is not None:
+            args.append('-n@' + list_file)
         args.append(self._get_password_argument())
         args.extend(('--', self.archive))
         return args
@@ -81,6 +83,17 @@ class RarArchive(archive_base.ExternalExecutableArchive):
     def is_solid(self):
         return self._is_solid
 
+    def get_listing(self):
+        listing = super().get_listing()
+        if listing is not None:
+            listing['contents'] = self._contents
+        return listing
+
+    def set_listing(self, listing):
+        self._contents = [tuple(entry) for entry in listing['contents']]
+        self._is_solid = listing['solid']
+        return super().set_listing(listing)
+
     def _has_encryption(self):
         with process.popen(self._get_list_arguments(),
                            stderr=process.STDOUT,
@@ -138,31 +151,8 @@ class RarArchive(archive_base.ExternalExecutableArchive):
             process.call(cmd, stdout=output)
         return destination_path
 
-    def iter_extract(self, entries, destination_dir):
-
-        if not self._get_executable():
-            return
-
-        if not self.filenames_initialized:
-            self.list_contents()
-
-        with process.popen(self._get_extract_arguments()) as proc:
-            wanted = dict([(self._original_filename(unicode_name), unicode_name)
-                           for unicode_name in entries])
-
-            for filename, filesize in self._contents:
-                data = proc.stdout.read(filesize)
-                if filename not in wanted:
-                    continue
-                unicode_name = wanted.get(filename, None)
-                if unicode_name is None:
-                    continue
-                with self._create_file(os.path.join(destination_dir, unicode_name)) as new:
-                    new.write(data)
-                yield unicode_name
-                del wanted[filename]
-                if 0 == len(wanted):
-                    break
+    def iter_extract(self, entries, destination_dir, skip=None):
+        yield from self._iter_extract_batch(entries, destination_dir, skip=skip)
 
     @staticmethod
     def _find_unrar_executable():
@@ -11,15 +11,27 @@ from mcomix.archive import archive_base
 
 # Filled on-demand by SevenZipArchive
 _7z_executable = -1
+# Filled on-demand by is_7z_support_rar
+_7z_support_rar = None
 
 
 def is_7z_support_rar():
     '''Check whether p7zip has Rar.so, which is needed to Rar format'''
+    global _7z_support_rar
+    if _7z_support_rar is None:
+        _7z_support_rar = _check_7z_support_rar()
+    return _7z_support_rar
+
+
+def _check_7z_support_rar():
     if sys.platform == 'win32':
         # assume 7z in windows already support rar
         return True
+    executable = SevenZipArchive._find_7z_executable()
+    if not executable:
+        return False
     has_rar_so = False
-    with process.popen((SevenZipArchive._find_7z_executable(), 'i'),
+    with process.popen((executable, 'i'),
                        universal_newlines=True) as proc:
         libsblock = False
         for line in proc.stdout:
@@ -41,6 +53,9 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
 
     STATE_HEADER, STATE_LISTING, STATE_FOOTER = 1, 2, 3
 
+    # iter_extract() uses a single process for any set of members.
+    support_batch_extraction = True
+
     class EncryptedHeader(Exception):
         pass
 
@@ -49,9 +64,6 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
         self._is_solid = False
         self._contents = []
 
-        self.is_encrypted = False
-        self.is_encrypted = self._has_encryption()
-
     def _get_executable(self):
         return SevenZipArchive._find_7z_executable()
 
@@ -132,6 +144,17 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
     def is_solid(self):
         return self._is_solid
 
+    def get_listing(self):
+        listing = super().get_listing()
+        if listing is not None:
+            listing['contents'] = self._contents
+        return listing
+
+    def set_listing(self, listing):
+        self._contents = [tuple(entry) for entry in listing['contents']]
+        self._is_solid = listing['solid']
+        return super().set_listing(listing)
+
     def iter_contents(self):
         if not self._get_executable():
             return
@@ -180,31 +203,8 @@ class SevenZipArchive(archive_base.ExternalExecutableArchive):
                              stdout=output)
         return destination_path
 
-    def iter_extract(self, entries, destination_dir):
-
-        if not self._get_executable():
-            return
-
-        if not self.filenames_initialized:
-            self.list_contents()
-
-        with process.popen(self._get_extract_arguments()) as proc:
-            wanted = dict([(self._original_filename(unicode_name), unicode_name)
-                           for unicode_name in entries])
-
-            for filename, filesize in self._contents:
-                data = proc.stdout.read(filesize)
-                if filename not in wanted:
-                    continue
-                unicode_name = wanted.get(filename, None)
-                if unicode_name is None:
-                    continue
-                with self._create_file(os.path.join(destination_dir, unicode_name)) as new:
-                    new.write(data)
-                yield unicode_name
-                del wanted[filename]
-                if 0 == len(wanted):
-                    break
+    def iter_extract(self, entries, destination_dir, skip=None):
+        yield from self._iter_extract_batch(entries, destination_dir, skip=skip)
 
     @staticmethod
     def _find_7z_executable():
@@ -3,6 +3,7 @@
 ''' Unicode-aware wrapper for tarfile.TarFile. '''
 
 import collections
+import io
 import os
 import tarfile
 import threading
@@ -17,6 +18,10 @@ class TarArchive(archive_base.NonUnicodeArchive):
         super(TarArchive, self).__init__(archive)
         self._tar = tarfile.open(self.archive, 'r:*')
         self._lock = threading.Lock()
+        # Random access is only cheap on uncompressed tar archives,
+        # compressed ones must be decompressed from the start.
+        self.support_memory_extraction = isinstance(
+            self._tar.fileobj, io.BufferedReader)
 
         # tarfile is not thread-safe
         # so use OrderedDict to save TarInfo in order
@@ -38,18 +43,22 @@ class TarArchive(archive_base.NonUnicodeArchive):
     def iter_contents(self):
         yield from self._contents_info.keys()
 
-    def extract(self, filename, destination_dir):
-        destination_path = os.path.join(destination_dir, filename)
+    def read(self, filename):
         member = self._contents_info[filename]
         with self._lock:
             try:
                 with self._tar.extractfile(member) as fp:
-                    data = fp.read()
+                    return fp.read()
             except AttributeError:
                 log.warning(_('Corrupted file: %(filename)s'),
                             {'filename': filename})
-            with self._create_file(destination_path) as new:
-                new.write(data)
+        return b''
+
+    def extract(self, filename, destination_dir):
+        destination_path = os.path.join(destination_dir, filename)
+        data = self.read(filename)
+        with self._create_file(destination_path) as new:
+            new.write(data)
         return destination_path
 
     def close(self):
@@ -4,34 +4,41 @@
 
 import collections
 import os
+import struct
 import threading
 import zipfile
 
 from mcomix import log
 from mcomix.i18n import _
 from mcomix.archive import archive_base
+from mcomix.lib import reader
 
 
-def is_py_supported_zipfile(path):
-    '''Check if a given zipfile has all internal files stored with Python supported compression
-    '''
-    with zipfile.ZipFile(path, mode='r') as zip_file:
-        for file_info in zip_file.infolist():
-            try:
-                descr = zipfile._get_decompressor(file_info.compress_type)
-            except BaseException:
-                return False
-    return True
+class ZipArchive(archive_base.NonUnicodeArchive):
 
+    # Members are compressed independently, and each thread
+    # uses its own ZipFile handle, see _get_zip().
+    support_concurrent_extractions = True
+    support_memory_extraction = True
 
-class ZipArchive(archive_base.NonUnicodeArchive):
-    def __init__(self, archive):
+    def __init__(self, archive, data=None):
+        ''' Open the archive at path <archive>, or if <data> is not None,
+        the archive contained in <data>, a bytes-like object or a
+        reader.FileRange (see read_in_place()), which is read in place
+        (<archive> is then only used as a name). '''
         super(ZipArchive, self).__init__(archive)
-        self._zip = zipfile.ZipFile(archive, 'r')
+        self._data = data
         self._lock = threading.Lock()
-
-        # zipfile is usually not thread-safe
-        # so use OrderedDict to save ZipInfo in order
+        self._local = threading.local()
+        self._handles = []
+        # File objects opened on <data>, see _open_zip().
+        self._views = []
+        self._zip = self._open_zip()
+        # Archive file descriptor, used to read stored members,
+        # see _read_stored().
+        self._fd = None
+
+        # save ZipInfo in order
         # {unicode_name: ZipInfo}
         self._contents_info = collections.OrderedDict()
         for info in self._zip.infolist():
@@ -47,36 +54,179 @@ class ZipArchive(archive_base.NonUnicodeArchive):
         self.is_encrypted = self._has_encryption()
         self._password = None
 
-    def is_solid(self):
-        # zipfile is usually not thread-safe
-        # so treat it as a solid archive to reduce seek operate
-        return True
-
     def iter_contents(self):
         if self.is_encrypted and not self._password:
             self._get_password()
-            self._zip.setpassword(self._password)
+            self._set_password()
         yield from self._contents_info.keys()
 
-    def extract(self, filename, destination_dir):
-        destination_path = os.path.join(destination_dir, filename)
-        info = self._contents_info[filename]
-        with self._lock:
-            data = self._zip.read(info)
-        with self._create_file(destination_path) as new:
-            filelen = new.write(data)
+    def get_listing(self):
+        if self.is_encrypted:
+            return None
+        # The contents are listed when opening the archive, only check
+        # that the names are the same when restoring the listing.
+        return {'names': list(self._contents_info)}
+
+    def set_listing(self, listing):
+        return not self.is_encrypted and \
+            listing['names'] == list(self._contents_info)
 
-        if filelen != info.file_size:
+    def read(self, filename):
+        info = self._contents_info[filename]
+        if info.flag_bits & 0x1 and not self._password:
+            # Contents listed without asking for the password.
+            self._get_password()
+            self._set_password()
+        data = None
+        if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+            data = self._read_stored(info)
+        if data is None:
+            data = self._get_zip().read(info)
+
+        if len(data) != info.file_size:
             log.warning(
                 _('%(filename)s\'s extracted size is %(actual_size)d bytes,'
                   ' but should be %(expected_size)d bytes.'
                   ' The archive might be corrupt or in an unsupported format.'),
-                {'filename': filename, 'actual_size': filelen,
+                {'filename': filename, 'actual_size': len(data),
                  'expected_size': info.file_size})
+        return data
+
+    def extract(self, filename, destination_dir):
+        destination_path = os.path.join(destination_dir, filename)
+        data = self.read(filename)
+        with self._create_file(destination_path) as new:
+            new.write(data)
         return destination_path
 
     def close(self):
+        with self._lock:
+            for handle in self._handles:
+                handle.close()
+            self._handles.clear()
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
         self._zip.close()
+        with self._lock:
+            for view in self._views:
+                view.close()
+            self._views.clear()
+            if isinstance(self._data, memoryview):
+                # Let the parent archive close its own mapping.
+                self._data.release()
+            elif isinstance(self._data, reader.FileRange):
+                self._data.close()
+
+    def read_in_place(self, filename):
+        info = self._contents_info[filename]
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+            return None
+        if self._data is None and not hasattr(os, 'pread'):
+            return None
+        start = self._get_data_offset(info)
+        if start is None:
+            return None
+        if self._data is None:
+            return reader.FileRange(self.archive, start, info.compress_size)
+        if isinstance(self._data, reader.FileRange):
+            return self._data.subrange(start, info.compress_size)
+        return self._read_data(start, info.compress_size)
+
+    def _read_stored(self, info):
+        ''' Returns the content of the (uncompressed) stored member <info>,
+        read at once without going through zipfile, or None if it cannot be
+        read this way. For in-memory archives, a memoryview is returned and
+        no data is copied. The archive file is not memory mapped: it could
+        be truncated while mapped, which would crash the process. '''
+        read_at = self._get_reader()
+        if read_at is None:
+            return None
+        start = self._get_data_offset(info)
+        if start is None:
+            return None
+        try:
+            data = read_at(start, info.compress_size)
+        except OSError:
+            return None
+        if len(data) != info.compress_size:
+            return None
+        return data
+
+    def _get_data_offset(self, info):
+        ''' Returns the offset of the data of member <info> in the archive,
+        read from its local header, or None if it cannot be read. '''
+        read_at = self._get_reader()
+        if read_at is None:
+            return None
+        try:
+            offset = info.header_offset
+            header = read_at(offset, zipfile.sizeFileHeader)
+        except OSError:
+            return None
+        if len(header) != zipfile.sizeFileHeader or \
+           header[:4] != zipfile.stringFileHeader:
+            return None
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        return offset + zipfile.sizeFileHeader + name_length + extra_length
+
+    def _get_reader(self):
+        ''' Returns a function reading (offset, size) from the archive
+        without going through zipfile, or None if not supported. '''
+        if isinstance(self._data, reader.FileRange):
+            return self._data.read_at
+        if self._data is not None:
+            return self._read_data
+        if hasattr(os, 'pread'):
+            return self._pread
+        return None
+
+    def _read_data(self, offset, size):
+        return memoryview(self._data)[offset:offset + size]
+
+    def _pread(self, offset, size):
+        # The file offset is not used, so threads can read concurrently.
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.archive, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            fd = self._fd
+        return os.pread(fd, size, offset)
+
+    def _get_zip(self):
+        ''' Returns the ZipFile handle of the calling thread. zipfile
+        is not thread-safe, but members can be decompressed in parallel
+        using a separate handle for each thread. '''
+        handle = getattr(self._local, 'zip', None)
+        if handle is None:
+            handle = self._open_zip()
+            # Checked with the lock held, so the password cannot be
+            # set in between without being applied, see _set_password().
+            with self._lock:
+                if self._password:
+                    handle.setpassword(self._password)
+                self._handles.append(handle)
+            self._local.zip = handle
+        return handle
+
+    def _set_password(self):
+        ''' Apply the password to all ZipFile handles, including the
+        ones already opened by other threads. '''
+        with self._lock:
+            self._zip.setpassword(self._password)
+            for handle in self._handles:
+                handle.setpassword(self._password)
+
+    def _open_zip(self):
+        ''' Returns a new ZipFile handle on the archive. '''
+        if self._data is None:
+            return zipfile.ZipFile(self.archive, 'r')
+        if isinstance(self._data, reader.FileRange):
+            view = self._data.open()
+        else:
+            view = reader.MemoryViewIO(self._data)
+        with self._lock:
+            self._views.append(view)
+        return zipfile.ZipFile(view, 'r')
 
     def _has_encryption(self):
         ''' Checks all files in the archive for encryption.
@@ -1,16 +1,28 @@
 '''archive_extractor.py - Archive extraction class.'''
 
 import os
+import sys
 import threading
+import time
 import traceback
 
+from mcomix import archive_index
 from mcomix import archive_tools
 from mcomix import callback
+from mcomix import constants
 from mcomix import log
 from mcomix.lib import mt
 from mcomix.preferences import prefs
 from mcomix.i18n import _
 
+#: Maximum number of files extracted at once by a worker, see
+#: BaseArchive.support_batch_extraction.
+_BATCH_SIZE = 16
+#: Minimal distance (in reading order) from the wanted files for extracted
+#: files to be removed, or for their extraction to be put off, see
+#: set_wanted().
+_KEEP_DISTANCE = 8
+
 
 class Extractor(object):
 
@@ -30,6 +42,8 @@ class Extractor(object):
 
     def __init__(self):
         self._setupped = False
+        # Size pages are to be displayed at, see set_target_size().
+        self._target_size = None
         self._threadpool = mt.ThreadPool(
             name=self.__class__.__name__,
             processes=prefs['max extract threads'] or None)
@@ -40,8 +54,36 @@ class Extractor(object):
         None if the format of <src> isn't supported.
         '''
         self._src = src
+        self._mime = mime
         self._files = []
         self._extracted = set()
+        # Files being extracted again (e.g. rendered at a higher resolution),
+        # and still ready meanwhile.
+        self._refresh = set()
+        # Files currently being extracted by a worker.
+        self._extracting = set()
+        self._workers = 0
+        # True while a single pass extraction is running, see extract().
+        self._pass_running = False
+        # Time at which pending files became the head of the queue.
+        self._prioritized = {}
+        self._stats = {'extracted': 0, 'extract time': 0.0,
+                       'waited': 0, 'wait time': 0.0}
+        # Position of each file in the archive.
+        self._archive_index = {}
+        # Size of the extracted files, see _trim_workspace().
+        self._workspace = {}
+        self._workspace_size = 0
+        # Position of each file in reading order, and files currently
+        # wanted (the first one being the current file), see set_wanted().
+        self._reading_order = {}
+        self._wanted = []
+        # Progress of the current single pass extraction (solid archives):
+        # archive position of the first file and the last extracted file,
+        # and start time, see estimate_wait().
+        self._stream_first = None
+        self._stream_position = None
+        self._stream_start = None
         self._archive = archive_tools.get_recursive_archive_handler(
             src, mime=mime, prefix='mcomix.extractor.')
         if self._archive is None:
@@ -94,7 +136,29 @@ class Extractor(object):
             if not self._files:
                 # Nothing to do!
                 return
+            head = self._files[0]
+            if head not in self._prioritized:
+                self._prioritized[head] = time.monotonic()
+            if self._extract_started:
+                self.extract()
+
+    def set_reading_order(self, files):
+        '''Set the order in which <files> are read (i.e. page order), used
+        to find the extracted files farthest from the current file when
+        the extraction workspace exceeds its limit.
+        '''
+        with self._condition:
+            self._reading_order = {name: n for n, name in enumerate(files)}
+
+    def set_wanted(self, files):
+        '''Set the files currently wanted, the first one being the current
+        file: they are never removed from the extraction workspace. Files
+        far from them are extracted later, see _is_deferred().
+        '''
+        with self._condition:
+            self._wanted[:] = files
             if self._extract_started:
+                # Files put off until now might be extracted.
                 self.extract()
 
     def is_ready(self, name):
@@ -102,7 +166,87 @@ class Extractor(object):
         (as set by set_files()) is fully extracted.
         '''
         with self._condition:
-            return name in self._extracted
+            return name in self._extracted or name in self._refresh
+
+    def set_target_size(self, size):
+        '''Set the <size> pages are to be displayed at, for archives whose
+        pages are rendered at a chosen resolution (i.e. PDF), or None for
+        full resolution. Files already extracted at a resolution too small
+        for <size> are queued to be extracted again (they are still ready
+        meanwhile, and file_extracted is signaled again once done).
+        Return True if any file was queued.
+        '''
+        if size == self._target_size:
+            return False
+        self._target_size = size
+        if not self._setupped:
+            return False
+        with self._condition:
+            if not self._contents_listed:
+                # Will be set once listed.
+                return False
+            names = [name for name in self._archive.set_target_size(size)
+                     if name in self._extracted]
+            if not names:
+                return False
+            log.debug('Extracting again: %s', ' '.join(names))
+            self._extracted.difference_update(names)
+            self._refresh.update(names)
+            self._files.extend(names)
+            if self._extract_started:
+                self.extract()
+        return True
+
+    def support_memory_extraction(self):
+        '''Return True if files can be read directly to memory with read().'''
+        with self._condition:
+            return self._contents_listed \
+                and self._archive.support_memory_extraction
+
+    def read(self, name):
+        '''Return the content of the file <name> as bytes, without waiting
+        for it to be extracted to the destination directory.
+        '''
+        return self._archive.read(name)
+
+    def get_stats(self):
+        '''Return a dictionary with statistics about the extraction queue:
+        number of pending files, files being extracted, extracted files,
+        mean extraction time and mean time files waited once they were
+        asked for first (in seconds).
+        '''
+        with self._condition:
+            stats = self._stats
+            return {
+                'pending': len(self._files) - len(self._extracting),
+                'extracting': len(self._extracting),
+                'extracted': len(self._extracted),
+                'mean extract time': stats['extract time'] / max(1, stats['extracted']),
+                'mean wait time': stats['wait time'] / max(1, stats['waited']),
+            }
+
+    def estimate_wait(self, name):
+        '''Return the estimated time (in seconds) before the file <name>
+        is extracted, or None if no estimation is possible yet.
+        '''
+        with self._condition:
+            if name in self._extracted or name in self._refresh:
+                return 0.0
+            if self._stream_start is not None:
+                # Single pass: entries are extracted in archive order, and
+                # skipped entries still need to be decompressed.
+                done = self._stream_position - self._stream_first + 1
+                if done <= 0:
+                    return None
+                rate = (time.monotonic() - self._stream_start) / done
+                remaining = self._archive_index.get(name, 0) - self._stream_position
+                return max(0, remaining) * rate
+            if not self._stats['extracted'] or name not in self._files:
+                return None
+            pending = [f for f in self._files if f not in self._extracting]
+            position = pending.index(name) if name in pending else 0
+            mean = self._stats['extract time'] / self._stats['extracted']
+            return (position // max(1, self._workers) + 1) * mean
 
     def stop(self):
         '''Signal the extractor to stop extracting and kill the extracting
@@ -123,18 +267,27 @@ class Extractor(object):
         with self._condition:
             if not self._contents_listed:
                 return
-            if not self._extract_started:
-                mt = self._archive.support_concurrent_extractions \
-                    and not self._archive.is_solid()
-                if mt:
-                    self._threadpool.ucbmap(
-                        self._extract_file, self._files,
-                        callback=self._extraction_finished,
-                        error_callback=self._extract_files_errcb)
-                else:
+            self._extract_started = True
+            if not self._is_single_pass():
+                # Each worker picks the file with the highest priority
+                # (i.e. the first pending one in the list set with
+                # set_files()), so reordering takes effect immediately.
+                # Workers exit when the queue is empty, so start new ones
+                # as needed.
+                workers = prefs['max extract threads'] or constants.CPU_COUNT
+                for n in range(workers - self._workers):
+                    self._workers += 1
                     self._threadpool.apply_async(
-                        self._extract_all_files,
+                        self._extract_worker,
                         error_callback=self._extract_files_errcb)
+            elif not self._pass_running and \
+                    any(not self._is_deferred(f) for f in self._files):
+                # Files queued (or no longer put off) after the start of
+                # the current pass are extracted by the next one.
+                self._pass_running = True
+                self._threadpool.apply_async(
+                    self._extract_all_files,
+                    error_callback=self._extract_files_errcb)
 
     @callback.Callback
     def contents_listed(self, extractor, files):
@@ -146,6 +299,13 @@ class Extractor(object):
         ''' Called whenever a new file is extracted and ready. '''
         pass
 
+    @callback.Callback
+    def files_evicted(self, extractor, filenames):
+        ''' Called when extracted files were removed to limit the size of the
+        extraction workspace. They are no longer ready, and are extracted
+        again when put back in the file list with set_files(). '''
+        pass
+
     def close(self):
         '''Close any open file objects, need only be called manually if the
         extract() method isn't called.
@@ -158,22 +318,247 @@ class Extractor(object):
         if self._threadpool.closed:
             return True
         with self._condition:
-            self._files.remove(name)
+            if name in self._files:
+                self._files.remove(name)
+            self._extracting.discard(name)
+            self._refresh.discard(name)
             self._extracted.add(name)
+            prioritized = self._prioritized.pop(name, None)
+            if prioritized is not None:
+                self._stats['waited'] += 1
+                self._stats['wait time'] += time.monotonic() - prioritized
+            evicted = self._trim_workspace(name)
             self._condition.notify_all()
-        self.file_extracted(self, name)
+        if name not in evicted:
+            self.file_extracted(self, name)
+        if evicted:
+            self.files_evicted(self, evicted)
+
+    def _is_single_pass(self):
+        '''Return True if files are extracted in single passes through the
+        archive (e.g. solid archives), instead of by workers, see extract().
+        '''
+        return not self._archive.support_concurrent_extractions or \
+            self._archive.is_solid()
+
+    def _is_far(self, name):
+        '''Return True if <name> is far (in reading order) from the wanted
+        files (or from the first file if none are set), and not wanted or
+        asked for. Must be called with the lock held.
+        '''
+        if name in self._wanted or name in self._refresh or \
+           name in self._prioritized:
+            return False
+        far = len(self._reading_order)
+        position = self._reading_order.get(name, far)
+        wanted = [self._reading_order.get(f, 0) for f in self._wanted] or [0]
+        return min(abs(position - n) for n in wanted) >= _KEEP_DISTANCE
+
+    def _is_workspace_full(self):
+        '''Return True if the extraction workspace has no room left for
+        another file (of mean size). Must be called with the lock held.
+        '''
+        limit = prefs['max extraction workspace'] * 1048576
+        if not limit or not self._workspace:
+            return False
+        mean_size = self._workspace_size / len(self._workspace)
+        return self._workspace_size + mean_size > limit
+
+    def _is_deferred(self, name):
+        '''Return True if the extraction of <name> is put off, as it is far
+        from the wanted files (see _is_far()), and either files are extracted
+        in single passes, or the extraction workspace is full. A single pass
+        started for it would go through the archive again, only to fill the
+        workspace while the wanted files are read: it is only extracted by a
+        pass going over it anyway (see _extract_all_files()), or once the
+        wanted files get near it. Must be called with the lock held.
+        '''
+        if not self._is_far(name):
+            return False
+        if self._wanted and self._is_single_pass():
+            return True
+        return self._is_workspace_full()
+
+    def _is_passed_over(self, name):
+        '''Return True if a single pass reaching <name> should not write it:
+        it is far from the wanted files, and the pass is still on its way to
+        one of them, or the extraction workspace is full.
+        Must be called with the lock held.
+        '''
+        if not self._is_far(name):
+            return False
+        if self._is_workspace_full():
+            return True
+        position = self._archive_index.get(name, 0)
+        return any(self._archive_index.get(f, -1) > position
+                   for f in self._wanted if f not in self._extracted)
+
+    def _trim_workspace(self, name):
+        '''Account for the newly extracted file <name>, and if the
+        extraction workspace exceeds its limit, remove the extracted files
+        farthest (in reading order) from the current file. Only done when
+        files are extracted by workers (see extract()): with single pass
+        extractions (e.g. solid archives), extracting a file again would
+        take a full pass.
+        Return the list of removed files. Must be called with the lock held.
+        '''
+        try:
+            # Not the size of the file linked to, for members symlinked
+            # instead of extracted (e.g. by MountArchive).
+            size = os.lstat(os.path.join(self._dst, name)).st_size
+        except OSError:
+            size = 0
+        self._workspace_size += size - self._workspace.get(name, 0)
+        self._workspace[name] = size
+        limit = prefs['max extraction workspace'] * 1048576
+        if not limit or self._workspace_size <= limit or \
+           not self._archive.support_concurrent_extractions or \
+           self._archive.is_solid():
+            return []
+        current = self._reading_order.get(self._wanted[0], 0) \
+            if self._wanted else 0
+        far = len(self._reading_order)
+        candidates = []
+        for f in self._workspace:
+            if f in self._wanted or f in self._refresh or f in self._extracting:
+                continue
+            distance = abs(self._reading_order.get(f, far) - current)
+            if distance < _KEEP_DISTANCE:
+                continue
+            candidates.append((distance, f))
+        candidates.sort(reverse=True)
+        evicted = []
+        for distance, f in candidates:
+            if self._workspace_size <= limit:
+                break
+            try:
+                os.remove(os.path.join(self._dst, f))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                log.warning('Failed to remove extracted file "%s": %s', f, e)
+                continue
+            self._workspace_size -= self._workspace.pop(f)
+            self._extracted.discard(f)
+            evicted.append(f)
+        if evicted:
+            log.debug('Removed %u extracted files, workspace size: %u MiB',
+                      len(evicted), self._workspace_size // 1048576)
+        return evicted
+
+    def _extract_worker(self):
+        '''Extract pending files in priority order, until there are none
+        left or the extractor is stopped. When supported by the archive,
+        files are extracted in batches of up to _BATCH_SIZE files. Files
+        put off while the extraction workspace is full (see _is_deferred())
+        are left pending, until set_wanted() starts new workers.
+        '''
+        batch_size = _BATCH_SIZE if self._archive.support_batch_extraction else 1
+        try:
+            while not self._threadpool.closed:
+                with self._condition:
+                    names = [f for f in self._files
+                             if f not in self._extracting and
+                             not self._is_deferred(f)][:batch_size]
+                    if not names:
+                        return
+                    self._extracting.update(names)
+                start = time.monotonic()
+                done = set()
+                try:
+                    for name in self._extract_files(names):
+                        done.add(name)
+                        with self._condition:
+                            now = time.monotonic()
+                            self._stats['extracted'] += 1
+                            self._stats['extract time'] += now - start
+                            start = now
+                        if self._extraction_finished(name):
+                            return
+                except Exception:
+                    self._extract_files_errcb(self._threadpool.name, *sys.exc_info())
+                    with self._condition:
+                        for name in names:
+                            if name in done:
+                                continue
+                            self._extracting.discard(name)
+                            if name in self._files:
+                                self._files.remove(name)
+                    continue
+                # Files missing from the batch output are handled as
+                # with single extractions: considered done.
+                for name in names:
+                    if name not in done and \
+                       self._extraction_finished(name):
+                        return
+        finally:
+            with self._condition:
+                self._workers -= 1
 
     def _extract_all_files(self):
+        '''Extract the pending files in a single pass through the archive,
+        in archive order. Files passed over on the way to the wanted files
+        (see _is_passed_over()) are still decompressed with solid archives,
+        but not written, and stay pending for a later pass.
+        '''
         # With multiple extractions for each pass, some of the files might have
         # already been extracted.
         with self._condition:
-            files = list(set(self._files) - self._extracted)
+            files = [f for f in self._files if f not in self._extracted]
+            if not files:
+                self._pass_running = False
+                return
+            self._stream_first = min(self._archive_index.get(name, 0)
+                                     for name in files)
+            self._stream_position = self._stream_first - 1
+            self._stream_start = time.monotonic()
+
+        skipped = set()
+
+        def skip(name):
+            with self._condition:
+                if self._is_passed_over(name):
+                    skipped.add(name)
+                    return True
+            return False
 
         log.debug('Extracting from "%s" to "%s": "%s"',
                   self._src, self._dst, '", "'.join(files))
-        for name in self._archive.iter_extract(files, self._dst):
-            if self._extraction_finished(name):
+        done = set()
+        try:
+            for name in self._archive.iter_extract(files, self._dst, skip=skip):
+                done.add(name)
+                with self._condition:
+                    self._stream_position = max(self._stream_position,
+                                                self._archive_index.get(name, 0))
+                if self._extraction_finished(name):
+                    return
+        finally:
+            with self._condition:
+                self._stream_start = None
+                self._pass_running = False
+        # Files missing from the output are handled as with workers:
+        # considered done.
+        for name in files:
+            if name not in done and name not in skipped and \
+               self._extraction_finished(name):
                 return
+        # Start a new pass for the files queued meanwhile, if any.
+        self.extract()
+
+    def _extract_files(self, names):
+        '''Extract the files in <names> to the destination directory,
+        yielding each name as soon as the file is complete.
+        '''
+        # Batch extractions are used for single files too, as they can
+        # yield a file more than once, e.g. a quick preview of a PDF page
+        # before the page rendered at full resolution.
+        if len(names) == 1 and not self._archive.support_batch_extraction:
+            yield self._extract_file(names[0])
+            return
+        log.debug('Extracting from "%s" to "%s": "%s"',
+                  self._src, self._dst, '", "'.join(names))
+        yield from self._archive.iter_extract(names, self._dst)
 
     def _extract_file(self, name):
         '''Extract the file named <name> to the destination directory,
@@ -195,11 +580,22 @@ class Extractor(object):
                   ''.join(traceback.format_tb(tb)).strip())
 
     def _list_contents(self):
-        return [filename for filename in self._archive.iter_contents()]
+        index = archive_index.get_archive_index()
+        entry = index.load(self._src)
+        if entry is not None and entry['listing'] is not None and \
+           self._archive.set_listing(entry['listing']):
+            log.debug('Restored listing of %s from the archive index', self._src)
+            return self._archive.list_contents()
+        files = [filename for filename in self._archive.iter_contents()]
+        mime = self._mime or archive_tools.archive_mime_type(self._src)
+        index.store(self._src, mime, self._archive)
+        return files
 
     def _list_contents_cb(self, files):
+        self._archive.set_target_size(self._target_size)
         with self._condition:
             self._files[:] = files
+            self._archive_index = {name: n for n, name in enumerate(files)}
             self._contents_listed = True
         self.contents_listed(self, files)
 
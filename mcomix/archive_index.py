@@ -0,0 +1,163 @@
+'''archive_index.py - Persistent index of archive listings.'''
+
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+from mcomix import image_tools
+from mcomix import log
+from mcomix import tools
+from mcomix.lib import mt
+from mcomix.preferences import prefs
+
+_VERSION = 1
+_SUFFIX = '.json'
+#: Maximum number of archives in the index.
+_MAX_ENTRIES = 2000
+
+
+class ArchiveIndex(object):
+
+    ''' Stores the listing of archives, so that reopening an archive (or
+    adding it to the library) does not require listing its contents again,
+    which can be slow for big archives handled by an external executable.
+    Entries are keyed by the archive path, modification time and size, and
+    contain the member names, the image and comment files, the solid and
+    encrypted flags, and if supported by the archive handler, the state
+    needed to restore it without listing (including member sizes). The
+    names of encrypted archives are not saved.
+    '''
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.path.join(tools.get_cache_directory(), 'listings')
+        self.directory = directory
+        self._lock = mt.Lock()
+        self._count = None
+
+    def get_key(self, path):
+        ''' Returns the index key for the archive at <path>, or None if
+        <path> cannot be accessed. '''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        ident = '\0'.join((os.path.abspath(path), str(stat.st_mtime_ns),
+                           str(stat.st_size)))
+        return hashlib.sha1(ident.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def load(self, path):
+        ''' Returns the entry for the archive at <path> as a dictionary, or
+        None if the archive is not indexed (or was modified since). '''
+        key = self.get_key(path)
+        if key is None:
+            return None
+        entry_path = self._get_path(key)
+        try:
+            with open(entry_path, 'r', encoding='utf-8') as fp:
+                entry = json.load(fp)
+            if entry.get('version') != _VERSION:
+                raise ValueError('unsupported version')
+            # Mark as recently used.
+            os.utime(entry_path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.warning('Invalid archive index entry "%s": %s', entry_path, e)
+            self._remove(entry_path)
+            return None
+        if entry['comment extensions'] != prefs['comment extensions']:
+            entry['comments'] = _get_comments(entry['members'])
+        return entry
+
+    def store(self, path, mime, archive):
+        ''' Add (or update) the entry for the archive at <path>, with
+        format <mime> and <archive> the listed RecursiveArchive. '''
+        key = self.get_key(path)
+        if key is None:
+            return
+        encrypted = archive.is_encrypted
+        members = [] if encrypted else archive.get_members()
+        entry = {
+            'version': _VERSION,
+            'path': os.path.abspath(path),
+            'mime': mime,
+            'solid': archive.is_solid(),
+            'encrypted': encrypted,
+            'members': members,
+            'images': [f for f in members if image_tools.is_image_file(f)],
+            'comments': _get_comments(members),
+            'comment extensions': prefs['comment extensions'],
+            'listing': None if encrypted else archive.get_listing(),
+        }
+        try:
+            os.makedirs(self.directory, 0o700, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with open(fd, 'w', encoding='utf-8') as fp:
+                json.dump(entry, fp)
+            os.replace(tmp_path, self._get_path(key))
+        except (OSError, ValueError) as e:
+            log.warning('Failed to write archive index entry for "%s": %s', path, e)
+            return
+        with self._lock:
+            if self._count is None:
+                self._count = sum(1 for entry in self._iter_entries())
+            else:
+                self._count += 1
+            if self._count > _MAX_ENTRIES:
+                self._prune()
+
+    def _prune(self):
+        # Must be called with the lock held.
+        entries = []
+        for entry in self._iter_entries():
+            try:
+                entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                continue
+        entries.sort()
+        self._count = len(entries)
+        for mtime, path in entries[:len(entries) - _MAX_ENTRIES]:
+            if self._remove(path):
+                self._count -= 1
+
+    def _iter_entries(self):
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(_SUFFIX) and entry.is_file():
+                        yield entry
+        except FileNotFoundError:
+            return
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        return True
+
+
+def _get_comments(members):
+    exts = '|'.join(prefs['comment extensions'])
+    comment_re = re.compile(r'\.(%s)\s*$' % exts, re.I)
+    return list(filter(comment_re.search, members))
+
+
+_index = None
+
+
+def get_archive_index():
+    global _index
+
+    if _index is None:
+        _index = ArchiveIndex()
+    return _index
+
+# vim: expandtab:sw=4:ts=4
@@ -1,14 +1,25 @@
 '''archive_packer.py - Archive creation class.'''
 
-import io
+import collections
+import errno
 import os
-import shutil
+import stat
+import tempfile
 import threading
 import zipfile
+import zlib
 
+from mcomix import constants
 from mcomix import log
-from mcomix import tools
 from mcomix.i18n import _
+from mcomix.lib import mt
+
+#: Extensions of image formats that are already compressed: deflating
+#: them is a waste of time.
+_STORED_EXTENSIONS = frozenset((
+    '.jpg', '.jpeg', '.jpe', '.jfif', '.png', '.gif', '.webp',
+    '.jp2', '.j2k', '.jxl', '.avif', '.heic', '.heif', '.flif',
+))
 
 
 class Packer(object):
@@ -61,52 +72,113 @@ class Packer(object):
         used = set()
         fmt = '{{page:0{}d}} - {}{{ext}}'.format(
             len(str(len(self._image_files))), self._base_name)
-        with io.BytesIO() as buf:
-            with zipfile.ZipFile(buf, mode='w', allowZip64=True) as zfile:
-                try:
-                    for i, path in enumerate(self._image_files, start=1):
-                        b, e = os.path.splitext(path)
-                        fname = fmt.format(page=i, ext=e)
-                        used.add(fname)
-                        zfile.write(path, arcname=fname,
-                                    compress_type=zipfile.ZIP_DEFLATED,
-                                    compresslevel=9)
-
-                    for path in self._other_files:
-                        fname = os.path.basename(path)
-                        while fname in used:
-                            fname = '_{}'.format(fname)
-                        used.add(fname)
-                        zfile.write(path, arcname=fname,
-                                    compress_type=zipfile.ZIP_DEFLATED,
-                                    compresslevel=9)
-
-                except Exception as e:
-                    log.error(_('! Could not create archive, {}').format(e))
-                    return
-
-            # full data of zipfile is completed here
-            archivedata = buf.getvalue()
-
-        archive_dir = os.path.dirname(self._archive_path)
-        archive_len = len(archivedata)
-        if shutil.disk_usage(archive_dir).free < archive_len:
-            log.error(_('! Directory {} is out of space, {} needed.').format(
-                archive_dir, tools.format_byte_size(archive_len)
-            ))
+        members = []
+        for i, path in enumerate(self._image_files, start=1):
+            b, e = os.path.splitext(path)
+            fname = fmt.format(page=i, ext=e)
+            used.add(fname)
+            members.append((path, fname))
+        for path in self._other_files:
+            fname = os.path.basename(path)
+            while fname in used:
+                fname = '_{}'.format(fname)
+            used.add(fname)
+            members.append((path, fname))
+
+        # Write to a temporary file next to the destination, renamed once
+        # complete, so an existing archive is never left half written.
+        archive_dir = os.path.dirname(self._archive_path) or os.curdir
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                prefix='tmp.', suffix='.' + os.path.basename(self._archive_path),
+                dir=archive_dir)
+        except OSError as e:
+            log.error(_('! Could not create archive at path "%s", {}').format(e),
+                      self._archive_path)
             return
 
         try:
-            with open(self._archive_path, mode='wb') as fp:
-                fp.write(archivedata)
+            with open(fd, mode='wb') as fp:
+                with zipfile.ZipFile(fp, mode='w', allowZip64=True) as zfile:
+                    self._write_members(zfile, members)
+            os.chmod(tmp_path, self._get_mode())
+            os.replace(tmp_path, self._archive_path)
         except Exception as e:
-            log.error(_('! Could not create archive at path "%s", {}').format(e),
-                      self._archive_path)
+            if isinstance(e, OSError) and e.errno == errno.ENOSPC:
+                log.error(_('! Directory {} is out of space.').format(archive_dir))
+            else:
+                log.error(_('! Could not create archive at path "%s", {}').format(e),
+                          self._archive_path)
             try:
-                os.remove(self._archive_path)
-            except BaseException:
+                os.remove(tmp_path)
+            except OSError:
                 pass
         else:
             self._packing_successful = True
 
+    def _write_members(self, zfile, members):
+        ''' Write <members>, a list of (path, archive name), to <zfile>.
+        Members are read and compressed in parallel, a few at a time,
+        and written in order as soon as they are ready. '''
+        pool = mt.ThreadPool(name=self.__class__.__name__,
+                             processes=constants.CPU_COUNT)
+        try:
+            pending = collections.deque()
+            members = iter(members)
+            while True:
+                while len(pending) < 2 * constants.CPU_COUNT:
+                    member = next(members, None)
+                    if member is None:
+                        break
+                    pending.append(pool.apply_async(_compress, member))
+                if not pending:
+                    break
+                zinfo, data = pending.popleft().get()
+                _write_compressed(zfile, zinfo, data)
+        finally:
+            pool.terminate()
+
+    def _get_mode(self):
+        ''' Returns the permissions of the archive: same as the archive
+        being replaced, or the default ones for a new file. '''
+        try:
+            return stat.S_IMODE(os.stat(self._archive_path).st_mode)
+        except OSError:
+            umask = os.umask(0)
+            os.umask(umask)
+            return 0o666 & ~umask
+
+
+def _compress(path, arcname):
+    ''' Read the file at <path>, and return a tuple (ZipInfo, data) for
+    the archive member <arcname>, with its data compressed. Images in an
+    already compressed format are stored as is, as are the files deflate
+    does not make any smaller. '''
+    zinfo = zipfile.ZipInfo.from_file(path, arcname=arcname)
+    with open(path, mode='rb') as fp:
+        data = fp.read()
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data)
+    zinfo.compress_type = zipfile.ZIP_STORED
+    if os.path.splitext(arcname)[1].lower() not in _STORED_EXTENSIONS:
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) < len(data):
+            zinfo.compress_type = zipfile.ZIP_DEFLATED
+            data = compressed
+    zinfo.compress_size = len(data)
+    return zinfo, data
+
+
+def _write_compressed(zfile, zinfo, data):
+    ''' Append the member <zinfo> to <zfile>, with its <data> already
+    compressed: this is not supported by ZipFile, which always compresses
+    the data it writes itself (and one member at a time). '''
+    zinfo.header_offset = zfile.fp.tell()
+    zfile.fp.write(zinfo.FileHeader())
+    zfile.fp.write(data)
+    zfile.filelist.append(zinfo)
+    zfile.NameToInfo[zinfo.filename] = zinfo
+    zfile.start_dir = zfile.fp.tell()
+
 # vim: expandtab:sw=4:ts=4
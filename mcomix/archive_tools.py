@@ -1,17 +1,21 @@
 '''archive_tools.py - Archive tool functions.'''
 
+import functools
 import os
 import re
 import shutil
+import struct
 import zipfile
 import tarfile
 import tempfile
 import operator
 
+from mcomix import archive_index
 from mcomix import image_tools
 from mcomix import constants
 from mcomix import log
 from mcomix.i18n import _
+from mcomix.lib import reader
 from mcomix.archive import (
     archivemount,
     lha_external,
@@ -147,6 +151,12 @@ def is_archive_file(path):
     return path.lower().endswith(tuple(SUPPORTED_ARCHIVE_EXTS))
 
 
+#: Size of the block read at the start of a file to detect its type.
+_SNIFF_SIZE = 1024
+
+_CENTRAL_DIR = struct.Struct(zipfile.structCentralDir)
+
+
 def archive_mime_type(path):
     '''Return the archive type of <path> or None for non-archives.'''
     try:
@@ -156,68 +166,133 @@ def archive_mime_type(path):
             if not os.access(path, os.R_OK):
                 return None
 
-            if zipfile.is_zipfile(path):
-                if zip_py.is_py_supported_zipfile(path):
-                    return constants.ZIP
-                else:
-                    return constants.ZIP_EXTERNAL
+            stat = os.stat(path)
+            return _sniff_mime_type(os.path.abspath(path),
+                                    stat.st_mtime_ns, stat.st_size)
+
+    except Exception:
+        log.warning(_('! Could not read %s'), path)
+
+    return None
 
-            with open(path, 'rb') as fd:
-                magic = fd.read(10)
 
+@functools.lru_cache(maxsize=4096)
+def _sniff_mime_type(path, mtime_ns, size):
+    '''Return the archive type of <path>, reading its first block once,
+    and for ZIP files, the central directory. Results are cached by path,
+    modification time and size (<mtime_ns> and <size>).'''
+    with open(path, 'rb') as fd:
+        magic = fd.read(_SNIFF_SIZE)
+
+        supported = _sniff_zip(fd)
+        if supported is not None:
+            return constants.ZIP if supported else constants.ZIP_EXTERNAL
+
+        if _is_tar_header(magic):
+            return constants.TAR
+
+        for compressed_magic, mime in (
+            ((b'\x1f\x8b\x08',), constants.GZIP),
+            ((b'BZh',), constants.BZIP2),
+            ((b'\x5d\x00\x00\x80', b'\xfd7zXZ'), constants.XZ),
+        ):
+            if not magic.startswith(compressed_magic):
+                continue
+            if mime == constants.BZIP2 and magic[4:10] != b'1AY&SY':
+                continue
+            # The tar header must be decompressed first.
+            fd.seek(0)
             try:
-                istarfile = tarfile.is_tarfile(path)
-            except IOError:
+                with tarfile.open(fileobj=fd, mode='r:*'):
+                    return mime
+            except (tarfile.TarError, IOError, EOFError):
                 # Tarfile raises an error when accessing certain network shares
-                istarfile = False
+                return None
 
-            if istarfile and os.path.getsize(path) > 0:
-                if magic.startswith(b'\x1f\x8b\x08'):
-                    return constants.GZIP
-                elif magic.startswith(b'BZh') and magic[4:10] == b'1AY&SY':
-                    return constants.BZIP2
-                elif magic.startswith((b'\x5d\x00\x00\x80', b'\xfd7zXZ')):
-                    return constants.XZ
-                else:
-                    return constants.TAR
+    if magic.startswith(b'Rar!\x1a\x07'):
+        if sevenzip_external.is_7z_support_rar():
+            return constants.RAR
+        else:
+            return constants.RAR5
 
-            if magic.startswith(b'Rar!\x1a\x07'):
-                if sevenzip_external.is_7z_support_rar():
-                    return constants.RAR
-                else:
-                    return constants.RAR5
+    if magic[0:6] == b'7z\xbc\xaf\x27\x1c':
+        return constants.SEVENZIP
 
-            if magic[0:6] == b'7z\xbc\xaf\x27\x1c':
-                return constants.SEVENZIP
+    if magic[2:].startswith((b'-lh', b'-lz')):
+        return constants.LHA
 
-            if magic[2:].startswith((b'-lh', b'-lz')):
-                return constants.LHA
+    if magic[0:4] == b'%PDF':
+        return constants.PDF
 
-            if magic[0:4] == b'%PDF':
-                return constants.PDF
+    if magic.startswith((b'sqsh', b'hsqs')):
+        return constants.SQUASHFS
 
-            if magic.startswith((b'sqsh', b'hsqs')):
-                return constants.SQUASHFS
+    return None
 
-    except Exception:
-        log.warning(_('! Could not read %s'), path)
 
-    return None
+def _sniff_zip(fd):
+    '''Return None if <fd> is not a ZIP file, True if all its members use
+    a compression method supported by the zipfile module, False otherwise.
+    Only the central directory is read, without building ZipInfo objects.'''
+    endrec = zipfile._EndRecData(fd)
+    if endrec is None:
+        return None
+    size_cd = endrec[zipfile._ECD_SIZE]
+    offset_cd = endrec[zipfile._ECD_OFFSET]
+    # Account for data prepended to the archive (e.g. self-extracting).
+    concat = endrec[zipfile._ECD_LOCATION] - size_cd - offset_cd
+    if endrec[zipfile._ECD_SIGNATURE] == zipfile.stringEndArchive64:
+        concat -= zipfile.sizeEndCentDir64 + zipfile.sizeEndCentDir64Locator
+    fd.seek(offset_cd + concat)
+    data = fd.read(size_cd)
+    compress_types = set()
+    pos = 0
+    while pos + _CENTRAL_DIR.size <= len(data):
+        centdir = _CENTRAL_DIR.unpack_from(data, pos)
+        if centdir[zipfile._CD_SIGNATURE] != zipfile.stringCentralDir:
+            raise zipfile.BadZipFile('Bad magic number for central directory')
+        compress_types.add(centdir[zipfile._CD_COMPRESS_TYPE])
+        pos += (_CENTRAL_DIR.size +
+                centdir[zipfile._CD_FILENAME_LENGTH] +
+                centdir[zipfile._CD_EXTRA_FIELD_LENGTH] +
+                centdir[zipfile._CD_COMMENT_LENGTH])
+    for compress_type in compress_types:
+        try:
+            zipfile._get_decompressor(compress_type)
+        except BaseException:
+            return False
+    return True
+
+
+def _is_tar_header(block):
+    '''Return True if <block> starts with a valid (uncompressed) tar header.'''
+    try:
+        tarfile.TarInfo.frombuf(block[:tarfile.BLOCKSIZE],
+                                tarfile.ENCODING, 'surrogateescape')
+    except tarfile.HeaderError:
+        return False
+    return True
 
 
 def get_archive_info(path):
     '''Return a tuple (mime, num_pages, size) with info about the archive
     at <path>, or None if <path> doesn't point to a supported
     '''
-    mime = archive_mime_type(path)
-    with get_recursive_archive_handler(path, mime=mime,
-                                       prefix='mcomix_archive_info.') as archive:
-        if archive is None:
-            return None
+    index = archive_index.get_archive_index()
+    entry = index.load(path)
+    if entry is not None:
+        return (entry['mime'], len(entry['images']), os.stat(path).st_size)
 
+    mime = archive_mime_type(path)
+    archive = get_recursive_archive_handler(path, mime=mime,
+                                            prefix='mcomix_archive_info.')
+    if archive is None:
+        return None
+    with archive:
         files = archive.list_contents(decrypt=False)
         num_pages = sum([image_tools.is_image_file(f) for f in files])
         size = os.stat(path).st_size
+        index.store(path, mime, archive)
 
         return (mime, num_pages, size)
 
@@ -239,6 +314,34 @@ def get_archive_handler(path, mime=None):
     return handler(path)
 
 
+def get_memory_archive_handler(path, data):
+    ''' Returns a handler for the archive contained in <data>, a bytes-like
+    object or a reader.FileRange (see BaseArchive.read_in_place()), read in
+    place without a temporary copy, or None if that is not possible: only
+    ZIP archives with members compressed using a method supported by the
+    zipfile module can be read this way. <path> is only used to name the
+    archive.
+    '''
+    if isinstance(data, reader.FileRange):
+        fd = data.open()
+    else:
+        fd = reader.MemoryViewIO(data)
+    archive = None
+    with fd:
+        try:
+            supported = _sniff_zip(fd)
+        except (OSError, zipfile.BadZipFile):
+            supported = False
+    if supported:
+        try:
+            archive = zip_py.ZipArchive(path, data=data)
+        except (OSError, zipfile.BadZipFile) as e:
+            log.warning('Failed to open archive "%s": %s', path, e)
+    if archive is None and isinstance(data, reader.FileRange):
+        data.close()
+    return archive
+
+
 def get_recursive_archive_handler(path, mime=None, **kwargs):
     ''' Same as <get_archive_handler> but the handler will transparently handle
     archives within archives.
@@ -40,7 +40,7 @@ class Clipboard(object):
     def copy_image_path(self, *args):
         ''' Copies the current page to clipboard. '''
 
-        path = self._window.imagehandler.get_path_to_page()
+        path = self._window.imagehandler.get_extracted_path_to_page()
         self._clipboard.set_text(path, -1)
 
     def copy_book_path(self, book_path):
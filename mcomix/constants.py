@@ -64,8 +64,8 @@ RESPONSE_REPLACE = 7
 RESPONSE_NEW = 8
 
 # These are bit field values, so only use powers of two.
-STATUS_PAGE, STATUS_RESOLUTION, STATUS_PATH, STATUS_FILENAME, STATUS_FILENUMBER, STATUS_FILESIZE = \
-    1, 2, 4, 8, 16, 32
+STATUS_PAGE, STATUS_RESOLUTION, STATUS_PATH, STATUS_FILENAME, STATUS_FILENUMBER, STATUS_FILESIZE, \
+    STATUS_CACHE = 1, 2, 4, 8, 16, 32, 64
 SHOW_DOUBLE_AS_ONE_TITLE, SHOW_DOUBLE_AS_ONE_WIDE = 1, 2
 
 MAX_LIBRARY_COVER_SIZE = 500
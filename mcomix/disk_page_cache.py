@@ -0,0 +1,205 @@
+'''disk_page_cache.py - Persistent cache of decoded pages.'''
+
+import hashlib
+import os
+import struct
+
+from gi.repository import GdkPixbuf, GLib
+
+from mcomix import image_tools
+from mcomix import log
+from mcomix import tools
+from mcomix.lib import mt
+from mcomix.preferences import prefs
+
+#: File header: magic, version, width, height, rowstride, has alpha, orientation.
+_HEADER = struct.Struct('<4sHIIIBB')
+_MAGIC = b'MCXP'
+_VERSION = 1
+_SUFFIX = '.page'
+
+
+class DiskPageCache(object):
+
+    ''' Stores decoded pages as raw RGB(A) pixels with a small header, so
+    that reopening a book does not require extracting and decoding the
+    pages again. Entries are keyed by the archive (or image) path,
+    modification time and size, and the archive member name. The cache
+    size is capped by the 'decoded page cache size' preference, least
+    recently used entries being removed first.
+    '''
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.path.join(tools.get_cache_directory(), 'pages')
+        self.directory = directory
+        #: Writes are done in the background, one at a time.
+        self._thread = mt.ThreadPool(name=self.__class__.__name__, processes=1)
+        self._lock = mt.Lock()
+        #: Total size of the cache, computed on first store.
+        self._size = None
+
+    def get_key(self, path, member=''):
+        ''' Returns the cache key for <member> of the archive at <path>
+        (<member> is empty for plain image files), or None if <path>
+        cannot be accessed. '''
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        ident = '\0'.join((os.path.abspath(path), str(stat.st_mtime_ns),
+                           str(stat.st_size), member))
+        return hashlib.sha1(ident.encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def contains(self, key):
+        ''' Returns True if an entry exists for <key>. '''
+        return os.path.isfile(self._get_path(key))
+
+    def load(self, key):
+        ''' Returns the pixbuf stored for <key>, or None. '''
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as fp:
+                magic, version, width, height, rowstride, has_alpha, orientation = \
+                    _HEADER.unpack(fp.read(_HEADER.size))
+                if magic != _MAGIC or version != _VERSION:
+                    raise ValueError('invalid header')
+                data = fp.read()
+            if len(data) != rowstride * height:
+                raise ValueError('truncated data')
+            # Mark as recently used.
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error) as e:
+            log.warning('Invalid decoded page cache entry "%s": %s', path, e)
+            self._remove(path)
+            return None
+        pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(
+            GLib.Bytes.new(data), GdkPixbuf.Colorspace.RGB,
+            bool(has_alpha), 8, width, height, rowstride)
+        if orientation:
+            setattr(pixbuf, 'orientation', str(orientation))
+        return pixbuf
+
+    def store(self, key, pixbuf):
+        ''' Asynchronously store <pixbuf> for <key>. Animations are not
+        supported and silently ignored. '''
+        if image_tools.is_animation(pixbuf):
+            return
+        self._thread.apply_async(self._store, (key, pixbuf))
+
+    def _store(self, key, pixbuf):
+        path = self._get_path(key)
+        try:
+            orientation = int(getattr(pixbuf, 'orientation', 0))
+        except ValueError:
+            orientation = 0
+        header = _HEADER.pack(_MAGIC, _VERSION,
+                              pixbuf.get_width(), pixbuf.get_height(),
+                              pixbuf.get_rowstride(),
+                              int(pixbuf.get_has_alpha()), orientation)
+        data = pixbuf.get_pixels()
+        size = len(header) + len(data)
+        try:
+            old_size = os.stat(path).st_size
+        except OSError:
+            old_size = 0
+        try:
+            os.makedirs(self.directory, 0o700, exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as fp:
+                fp.write(header)
+                fp.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warning('Failed to write decoded page cache entry "%s": %s', path, e)
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = self._get_total_size()
+            else:
+                # Replaced entries are already counted.
+                self._size += size - old_size
+            if self._size > prefs['decoded page cache size'] * 1048576:
+                self._prune()
+
+    def clear(self):
+        ''' Remove all entries. '''
+        with self._lock:
+            for entry in self._iter_entries():
+                self._remove(entry.path)
+            self._size = 0
+
+    def close(self):
+        ''' Stop pending writes. '''
+        self._thread.terminate()
+        self._thread.join()
+        self._thread.renew()
+
+    def _prune(self):
+        # Must be called with the lock held.
+        limit = prefs['decoded page cache size'] * 1048576
+        entries = []
+        for entry in self._iter_entries():
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        self._size = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if self._size <= limit:
+                break
+            if self._remove(path):
+                self._size -= size
+        log.debug('Decoded page cache size: %u bytes', self._size)
+
+    def _get_total_size(self):
+        size = 0
+        for entry in self._iter_entries():
+            try:
+                size += entry.stat().st_size
+            except OSError:
+                pass
+        return size
+
+    def _iter_entries(self):
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(_SUFFIX) and entry.is_file():
+                        yield entry
+        except FileNotFoundError:
+            return
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        return True
+
+
+_cache = None
+
+
+def get_disk_page_cache():
+    global _cache
+
+    if _cache is None:
+        _cache = DiskPageCache()
+    return _cache
+
+
+def shutdown():
+    ''' Stop pending writes, if the cache was used. '''
+    if _cache is not None:
+        _cache.close()
+
+# vim: expandtab:sw=4:ts=4
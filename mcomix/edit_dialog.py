@@ -2,7 +2,6 @@
 
 import os
 import re
-import tempfile
 
 from gi.repository import Gdk, Gtk, GLib
 
@@ -92,43 +91,26 @@ class _EditArchiveDialog(Gtk.Dialog):
 
         image_files = self._image_area.get_file_listing()
         comment_files = self._comment_area.get_file_listing()
-
-        try:
-            fd, tmp_path = tempfile.mkstemp(
-                suffix='.%s' % os.path.basename(archive_path),
-                prefix='tmp.', dir=os.path.dirname(archive_path)
-            )
-            # Close open tempfile handle (writing is handled by the packer)
-            os.close(fd)
-            fail = False
-
-        except BaseException:
-            fail = True
+        # Pages read directly from the archive, or removed from the
+        # extraction directory, must be extracted first.
+        self._window.filehandler.wait_on_files(image_files + comment_files)
+
+        # Preserve permissions if currently edited files come from an archive
+        mode = None
+        if (self._window.filehandler.archive_type is not None and
+                os.path.exists(self._window.filehandler.get_path_to_base())):
+            mode = os.stat(self._window.filehandler.get_path_to_base()).st_mode
+
+        # The packer writes to a temporary file, renamed once complete.
+        packer = archive_packer.Packer(image_files, comment_files, archive_path,
+                                       os.path.splitext(os.path.basename(archive_path))[0])
+        packer.pack()
+        fail = not packer.wait()
 
         if not fail:
-            packer = archive_packer.Packer(image_files, comment_files, tmp_path,
-                                           os.path.splitext(os.path.basename(archive_path))[0])
-            packer.pack()
-            packing_success = packer.wait()
-
-            if packing_success:
-                # Preserve permissions if currently edited files come from an archive
-                if (self._window.filehandler.archive_type is not None and
-                        os.path.exists(self._window.filehandler.get_path_to_base())):
-                    mode = os.stat(self._window.filehandler.get_path_to_base()).st_mode
-                else:
-                    mode = os.stat(tmp_path).st_mode
-
-                # Remove existing file (Win32 fails on rename otherwise)
-                if os.path.exists(archive_path):
-                    os.unlink(archive_path)
-
-                os.rename(tmp_path, archive_path)
+            if mode is not None:
                 os.chmod(archive_path, mode)
-
-                _close_dialog()
-            else:
-                fail = True
+            _close_dialog()
 
         self._window.set_cursor(None)
         if fail:
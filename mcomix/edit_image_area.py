@@ -85,7 +85,12 @@ class _ImageArea(Gtk.ScrolledWindow):
         path = uid
         try:
             if not self._window.filehandler.file_is_available(path):
-                return None
+                # Maybe readable from the archive without extracting it.
+                data = self._window.filehandler.read_file(path)
+                if data is None:
+                    return None
+                return image_tools.load_pixbuf_bytes_size(
+                    data, self._thumbnail_size, self._thumbnail_size)
         except KeyError:
             # Not a page from the current archive, ignore.
             pass
@@ -55,6 +55,7 @@ class FileHandler(object):
         #: Archive extractor.
         self._extractor = archive_extractor.Extractor()
         self._extractor.file_extracted += self._extracted_file
+        self._extractor.files_evicted += self._evicted_files
         self._extractor.contents_listed += self._listed_contents
         #: Condition to wait on when extracting archives and waiting on files.
         self._condition = None
@@ -306,7 +307,13 @@ class FileHandler(object):
         self._name_table = dict(zip(image_files, archive_images))
         self._name_table.update(zip(self._comment_files, comment_files))
 
-        self._extractor.set_files(archive_images + comment_files)
+        if self._extractor.support_memory_extraction():
+            # Pages are read directly from the archive, and only extracted
+            # when their file is needed, see _wait_on_file().
+            self._extractor.set_files(comment_files)
+        else:
+            self._extractor.set_files(archive_images + comment_files)
+        self._extractor.set_reading_order(archive_images + comment_files)
 
         self._archive_opened(image_files)
 
@@ -576,6 +583,19 @@ class FileHandler(object):
         filepath = os.path.join(extractor.get_directory(), name)
         self.file_available([filepath])
 
+    @callback.Callback
+    def files_evicted(self, filepaths):
+        ''' Called when files from the opened archive were removed from the
+        extraction directory, see Extractor.files_evicted. They are
+        extracted again when asked for (e.g. by _wait_on_file()). '''
+        pass
+
+    def _evicted_files(self, extractor, names):
+        if not self.file_loaded:
+            return
+        directory = extractor.get_directory()
+        self.files_evicted([os.path.join(directory, name) for name in names])
+
     def _wait_on_comment(self, num):
         '''Block the running (main) thread until the file corresponding to
         comment <num> has been fully extracted.
@@ -593,6 +613,9 @@ class FileHandler(object):
 
         try:
             name = self._name_table[path]
+            if not self._extractor.is_ready(name):
+                # Make sure it is queued (e.g. if it was evicted).
+                self._ask_for_files([path])
             with self._condition:
                 while not self._extractor.is_ready(name) and not self._stop_waiting:
                     self._condition.wait()
@@ -600,6 +623,90 @@ class FileHandler(object):
             log.error('Waiting on extraction of "%s" failed: %s', path, ex)
             return
 
+    def wait_on_files(self, paths):
+        '''Block the running (main) thread until the files <paths> from the
+        archive have all been extracted (files not from the archive are
+        ignored). Missing files are queued at once, and kept extracted even
+        if far from the current page, see Extractor.set_wanted().
+        '''
+        if self.archive_type is None:
+            return
+
+        paths = [path for path in paths if path in self._name_table]
+        names = [self._name_table[path] for path in paths]
+        self._extractor.set_wanted(names)
+        pending = [path for path, name in zip(paths, names)
+                   if not self._extractor.is_ready(name)]
+        if not pending:
+            return
+        self._ask_for_files(pending)
+        pending = {self._name_table[path] for path in pending}
+        with self._condition:
+            while not self._stop_waiting:
+                pending = {name for name in pending
+                           if not self._extractor.is_ready(name)}
+                if not pending:
+                    break
+                self._condition.wait()
+
+    def get_member_name(self, path):
+        '''Return the name of the archive member extracted to <path>,
+        relative to the archive root, or None if <path> is not from an
+        archive.
+        '''
+        if self.archive_type is None or path not in self._name_table:
+            return None
+        return os.path.relpath(path, self._tmp_dir)
+
+    def can_read_file(self):
+        '''Return True if files from the current archive can be read
+        directly to memory with read_file().
+        '''
+        if self.archive_type is None:
+            return False
+        return self._extractor.support_memory_extraction()
+
+    def read_file(self, path):
+        '''Return the content of the archive member <path> as bytes, read
+        directly from the archive. Return None if <path> is not from an
+        archive, or if the archive does not support extraction to memory.
+        '''
+        if path is None or not self.can_read_file():
+            return None
+        try:
+            return self._extractor.read(self._name_table[path])
+        except Exception as ex:
+            log.error('Reading "%s" from archive failed: %s', path, ex)
+            return None
+
+    def estimate_wait(self, path):
+        '''Return the estimated time (in seconds) before the file <path>
+        is available, or None if unknown.
+        '''
+        if self.archive_type is None:
+            return 0.0
+        name = self._name_table.get(path)
+        if name is None:
+            return None
+        return self._extractor.estimate_wait(name)
+
+    def set_target_size(self, size):
+        '''Set the <size> pages are displayed at, allowing PDF pages to be
+        rendered at a lower resolution, see Extractor.set_target_size().
+        Return True if pages are to be extracted again.
+        '''
+        return self._extractor.set_target_size(size)
+
+    def set_wanted_files(self, files):
+        '''Set the <files> currently wanted (the first one being the
+        current page), so that they are kept in the extraction directory,
+        see Extractor.set_wanted().
+        '''
+        if self.archive_type is None:
+            return
+        self._extractor.set_wanted([self._name_table[path] for path in files
+                                    if path in self._name_table])
+
     def _ask_for_files(self, files):
         '''Ask for <files> to be given priority for extraction.
         '''
@@ -610,10 +717,15 @@ class FileHandler(object):
             extractor_files = self._extractor.get_files()
             for path in reversed(files):
                 name = self._name_table[path]
-                if not self._extractor.is_ready(name):
+                # Pending files, including those being extracted again,
+                # and evicted files, to be extracted again.
+                if name in extractor_files:
                     extractor_files.remove(name)
-                    extractor_files.insert(0, name)
+                elif self._extractor.is_ready(name):
+                    continue
+                extractor_files.insert(0, name)
             self._extractor.set_files(extractor_files)
+        log.debug('Extraction queue: %s', self._extractor.get_stats())
 
     def write_fileinfo_file(self):
         '''Write current open file information.'''
@@ -4,13 +4,17 @@ import os
 import traceback
 
 from mcomix.preferences import prefs
+from mcomix import anime_tools
 from mcomix import i18n
 from mcomix import tools
 from mcomix import image_tools
 from mcomix import thumbnail_tools
 from mcomix import constants
 from mcomix import callback
+from mcomix import disk_page_cache
 from mcomix import log
+from mcomix import page_cache
+from mcomix import page_info
 from mcomix.lib import mt
 
 
@@ -48,18 +52,46 @@ class ImageHandler(object):
         #: List of pixbufs we want to cache
         self._wanted_pixbufs = []
         #: Pixbuf map from page > Pixbuf
-        self._raw_pixbufs = {}
+        self._raw_pixbufs = page_cache.PageCache()
+        #: Minimal size pages need to be decoded at (None for full size)
+        self._draft_size = None
+        #: Cache of displayable pixbufs, see render_pixbuf()
+        self._rendered_pixbufs = page_cache.RenderCache(16)
         #: How many pages to keep in cache
         self._cache_pages = prefs['max pages to cache']
+        #: Persistent cache of decoded pages
+        self._disk_cache = disk_page_cache.get_disk_page_cache()
+        #: Map page > decoded page cache key (None if not cacheable),
+        #: computed on demand, see _get_disk_key()
+        self._disk_keys = {}
+        #: Map page > whether it was found in the decoded page cache,
+        #: checked on demand, see _is_disk_cached()
+        self._cached_images = {}
+        #: Metadata of the pages, read from the image headers
+        self._page_info = page_info.PageInfoTable()
+        #: Map page > edge colors, see image_tools.get_edge_colors()
+        self._edge_colors = {}
+        #: Map (left page, right page) > automatic background color
+        self._auto_backgrounds = {}
+        self._edge_colors_lock = mt.Lock()
 
         self._window.filehandler.file_available += self._file_available
+        self._window.filehandler.files_evicted += self._files_evicted
 
     def _get_pixbuf(self, index):
         '''Return the pixbuf indexed by <index> from cache.
         Pixbufs not found in cache are fetched from disk first.
         '''
-        self._cache_pixbuf(index)
-        return self._raw_pixbufs[index]
+        pixbuf = self._raw_pixbufs.lookup(index)
+        if pixbuf is None:
+            pixbuf = self._cache_pixbuf(index)
+        if pixbuf is None and not self._is_disk_cached(index):
+            # The decoded page cache entry was not usable, try again
+            # from the archive.
+            pixbuf = self._cache_pixbuf(index)
+        if pixbuf is None:
+            return self._raw_pixbufs[index]
+        return pixbuf
 
     def get_pixbufs(self, number_of_bufs):
         '''Returns number_of_bufs pixbufs for the image(s) that should be
@@ -75,21 +107,47 @@ class ImageHandler(object):
         ''' Returns an automatically calculated background color
         for the current page(s). '''
 
-        pixbufs = self.get_pixbufs(number_of_bufs)
-
-        if len(pixbufs) == 1:
-            auto_bg = image_tools.get_most_common_edge_color(pixbufs[0])
-        elif len(pixbufs) == 2:
-            left, right = pixbufs
+        if number_of_bufs == 1:
+            left = right = self._current_image_index
+        elif number_of_bufs == 2:
+            left = self._current_image_index
+            right = left + 1
             if self._window.is_manga_mode:
                 left, right = right, left
-
-            auto_bg = image_tools.get_most_common_edge_color((left, right))
         else:
             assert False, 'Unexpected pixbuf count'
 
+        with self._edge_colors_lock:
+            auto_bg = self._auto_backgrounds.get((left, right))
+        if auto_bg is not None:
+            return auto_bg
+        left_colors = self._get_edge_colors(left)[0]
+        right_colors = self._get_edge_colors(right)[1]
+        auto_bg = image_tools.get_common_edge_color(left_colors, right_colors)
+        with self._edge_colors_lock:
+            self._auto_backgrounds[(left, right)] = auto_bg
         return auto_bg
 
+    def _get_edge_colors(self, index):
+        with self._edge_colors_lock:
+            edge_colors = self._edge_colors.get(index)
+        if edge_colors is None:
+            # Not computed when the page was cached.
+            edge_colors = self._set_edge_colors(index, self._get_pixbuf(index))
+        return edge_colors
+
+    def _set_edge_colors(self, index, pixbuf):
+        ''' Compute the edge colors of page <index> (decoded to <pixbuf>),
+        so that the automatic background color of the pages displayed with
+        it is quick to find. Returns the edge colors. '''
+        edge_colors = image_tools.get_edge_colors(pixbuf)
+        with self._edge_colors_lock:
+            self._edge_colors[index] = edge_colors
+            for pages in [pages for pages in self._auto_backgrounds
+                          if index in pages]:
+                del self._auto_backgrounds[pages]
+        return edge_colors
+
     def do_cacheing(self):
         '''Make sure that the correct pixbufs are stored in cache. These
         are (in the current implementation) the current image(s), and
@@ -106,36 +164,97 @@ class ImageHandler(object):
 
             # Get list of wanted pixbufs.
             wanted_pixbufs = self._ask_for_pages(self.get_current_page())
+            if -1 == self._cache_pages:
+                # All pages are to be cached, keep them all extracted.
+                wanted_files = [self._image_files[self._current_image_index]]
+                wanted_files.extend(self._image_files)
+            else:
+                wanted_files = [self._image_files[index] for index in wanted_pixbufs]
+            self._window.filehandler.set_wanted_files(wanted_files)
+            self._raw_pixbufs.limit = prefs['max cache size'] * 1048576
+            self._rendered_pixbufs.limit = self._raw_pixbufs.limit // 4
+            self._raw_pixbufs.set_current(self._current_image_index,
+                                          wanted_pixbufs)
+            log.debug('Page cache: %s', self._raw_pixbufs.get_stats_text())
             if -1 != self._cache_pages:
                 # We're not caching everything, remove old pixbufs.
                 for index in set(self._raw_pixbufs) - set(wanted_pixbufs):
                     del self._raw_pixbufs[index]
+                with self._edge_colors_lock:
+                    for index in set(self._edge_colors) - set(wanted_pixbufs):
+                        del self._edge_colors[index]
+                    for pages in [pages for pages in self._auto_backgrounds
+                                  if not set(pages) <= set(wanted_pixbufs)]:
+                        del self._auto_backgrounds[pages]
             log.debug('Caching page(s) %s',
                       ' '.join([str(index + 1) for index in wanted_pixbufs]))
             self._wanted_pixbufs[:] = wanted_pixbufs
             # Start caching available images not already in cache.
+            # Pages read straight from the archive do not need to be extracted.
+            read_memory = self._window.filehandler.can_read_file()
             wanted_pixbufs = [index for index in wanted_pixbufs
-                              if index in self._available_images]
+                              if read_memory or index in self._available_images
+                              or self._is_disk_cached(index)]
             self._thread.map_async(self._cache_pixbuf, wanted_pixbufs)
         finally:
             self._lock.release()
 
     def _cache_pixbuf(self, index):
-        self._wait_on_page(index + 1)
-        with self._cache_lock[index]:
-            if index in self._raw_pixbufs:
-                return
+        read_memory = self._window.filehandler.can_read_file()
+        disk_cached = self._is_disk_cached(index)
+        if not read_memory and not disk_cached:
+            self._wait_on_page(index + 1)
+        with self._cache_lock.setdefault(index, mt.Lock()):
+            pixbuf = self._raw_pixbufs.get(index)
+            if pixbuf is not None:
+                return pixbuf
             with self._lock:
                 if index not in self._wanted_pixbufs:
                     return
+            disk_key = self._get_disk_key(index)
+            if disk_cached:
+                pixbuf = self._disk_cache.load(disk_key)
+                if pixbuf is not None:
+                    log.debug('Loaded page %u from decoded page cache', index + 1)
+                    self._cache_edge_colors(index, pixbuf)
+                    self._raw_pixbufs[index] = pixbuf
+                    self.page_cached(index)
+                    return pixbuf
+                self._cached_images[index] = False
+                if not read_memory and index not in self._available_images:
+                    # Will be cached once extracted, see page_available().
+                    return
+            path = self._image_files[index]
+            data = None
+            if read_memory:
+                data = self._window.filehandler.read_file(path)
+                if data is None and index not in self._available_images:
+                    # Will be cached from the extracted file, see page_available().
+                    return
+                if data is not None and self._page_info.get(index) is None:
+                    self._page_info.add_data(index, data)
             log.debug('Caching page %u', index + 1)
+            draft_size = self._draft_size
             try:
-                pixbuf = image_tools.load_pixbuf(self._image_files[index])
+                if data is None:
+                    pixbuf = image_tools.load_pixbuf(path, draft_size=draft_size)
+                else:
+                    pixbuf = image_tools.load_pixbuf_bytes(data, draft_size=draft_size)
                 tools.garbage_collect()
+                if disk_key is not None and image_tools.get_draft_scale(pixbuf) == 1.0:
+                    self._disk_cache.store(disk_key, pixbuf)
             except Exception as e:
                 log.error('Could not load pixbuf for page %u: %r', index + 1, e)
                 pixbuf = image_tools.MISSING_IMAGE_ICON
+            self._cache_edge_colors(index, pixbuf)
             self._raw_pixbufs[index] = pixbuf
+            self.page_cached(index)
+            return pixbuf
+
+    def _cache_edge_colors(self, index, pixbuf):
+        # Only needed for the automatic background color.
+        if prefs['smart bg'] or prefs['smart thumb bg']:
+            self._set_edge_colors(index, pixbuf)
 
     def set_page(self, page_num):
         '''Set up filehandler to the page <page_num>.
@@ -147,6 +266,39 @@ class ImageHandler(object):
     def set_image_files(self, files):
         # Set list of image file names
         self._image_files[:] = files
+        self._disk_keys.clear()
+        self._cached_images.clear()
+
+    def _get_disk_key(self, index):
+        ''' Returns the decoded page cache key of page <index>, or None
+        if the page cannot be cached. Keys are only computed when a page is
+        first needed, as this requires accessing the file. '''
+        if index in self._disk_keys:
+            return self._disk_keys[index]
+        filehandler = self._window.filehandler
+        key = None
+        # PDF pages are rendered at a resolution depending on the display.
+        if prefs['decoded page cache'] and \
+           filehandler.archive_type != constants.PDF and \
+           0 <= index < len(self._image_files):
+            path = self._image_files[index]
+            if filehandler.archive_type is None:
+                key = self._disk_cache.get_key(path)
+            else:
+                member = filehandler.get_member_name(path)
+                if member is not None:
+                    key = self._disk_cache.get_key(self._base_path, member)
+        self._disk_keys[index] = key
+        return key
+
+    def _is_disk_cached(self, index):
+        ''' Returns True if page <index> is in the decoded page cache. '''
+        cached = self._cached_images.get(index)
+        if cached is None:
+            key = self._get_disk_key(index)
+            cached = key is not None and self._disk_cache.contains(key)
+            self._cached_images[index] = cached
+        return cached
 
     def get_image_files(self):
         # Get list of image file names
@@ -159,6 +311,82 @@ class ImageHandler(object):
     def clear_raw_pixbufs(self):
         # Clear map of page > Pixbuf
         self._raw_pixbufs.clear()
+        self._rendered_pixbufs.clear()
+
+    def set_draft_size(self, size):
+        '''Set the minimal <size> pages need to be decoded at, allowing
+        reduced resolution decoding of large JPEG images, and rendering
+        of PDF pages. If <size> is None, pages are decoded at full
+        resolution. Cached pages decoded at a resolution too small for
+        <size> are dropped.
+        '''
+        if size is not None:
+            size = tuple(size)
+        if size == self._draft_size:
+            return
+        self._draft_size = size
+        dropped = False
+        for index in list(self._raw_pixbufs):
+            pixbuf = self._raw_pixbufs.get(index)
+            draft_size = getattr(pixbuf, 'draft_size', None)
+            if draft_size is None:
+                continue
+            if size is None or draft_size[0] < size[0] or draft_size[1] < size[1]:
+                self._raw_pixbufs.pop(index)
+                dropped = True
+        # PDF pages already rendered may have to be rendered again.
+        if self._window.filehandler.set_target_size(size):
+            dropped = True
+        if dropped:
+            log.debug('Reloading pages at a higher resolution')
+            self.do_cacheing()
+
+    def get_cached_pixbuf(self, index):
+        '''Return the pixbuf indexed by <index> if already in cache,
+        or None. Never blocks.
+        '''
+        return self._raw_pixbufs.get(index)
+
+    def render_pixbuf(self, index, size, rotation, pixbuf=None):
+        '''Return the pixbuf indexed by <index> scaled to <size>, rotated
+        by <rotation>, flipped and enhanced according to the current
+        preferences. Results are cached, so redrawing the same page with
+        the same parameters does not require rendering it again.
+        '''
+        if pixbuf is None:
+            pixbuf = self._get_pixbuf(index)
+        key = (self._image_files[index], tuple(size), rotation,
+               image_tools.get_draft_scale(pixbuf),
+               prefs['vertical flip'], prefs['horizontal flip'],
+               prefs['scaling quality'],
+               prefs['checkered bg for transparent images'],
+               self._window.enhancer.get_parameters())
+        rendered = self._rendered_pixbufs.get(key)
+        if rendered is not None:
+            return rendered
+        rendered = image_tools.fit_pixbuf_to_rectangle(pixbuf, size, rotation)
+        rendered = image_tools.trans_pixbuf(
+            rendered,
+            flip=prefs['vertical flip'],
+            flop=prefs['horizontal flip']
+        )
+        rendered = self._window.enhancer.enhance(rendered)
+        self._rendered_pixbufs.add(key, rendered)
+        return rendered
+
+    def prerender_pixbuf(self, index, size, rotation):
+        '''Render the pixbuf indexed by <index> in the background,
+        see render_pixbuf(). Does nothing if the page is not in cache.
+        '''
+        pixbuf = self._raw_pixbufs.get(index)
+        if pixbuf is None:
+            return
+        self._thread.apply_async(self.render_pixbuf,
+                                 (index, size, rotation, pixbuf))
+
+    def get_cache_info(self):
+        ''' Returns a short description of the page cache state. '''
+        return self._raw_pixbufs.get_stats_text()
 
     def get_current_path(self):
         # Get current image path
@@ -188,12 +416,18 @@ class ImageHandler(object):
             return False
 
         for page in (page, page + 1):
-            if not self.page_is_available(page):
+            # Only read the page header if possible.
+            info = self._get_page_info(page)
+            if info is not None:
+                width, height = info.width, info.height
+                rotation = image_tools.get_orientation_rotation(info.orientation)
+            elif not self.page_is_available(page):
                 return False
-            pixbuf = self._get_pixbuf(page - 1)
-            width, height = pixbuf.get_width(), pixbuf.get_height()
-            if prefs['auto rotate from exif']:
+            else:
+                pixbuf = self._get_pixbuf(page - 1)
+                width, height = pixbuf.get_width(), pixbuf.get_height()
                 rotation = image_tools.get_implied_rotation(pixbuf)
+            if prefs['auto rotate from exif']:
                 assert rotation in (0, 90, 180, 270)
                 if rotation in (90, 270):
                     width, height = height, width
@@ -227,7 +461,16 @@ class ImageHandler(object):
         self._image_files.clear()
         self._current_image_index = None
         self._available_images.clear()
+        self._disk_keys.clear()
+        self._cached_images.clear()
+        self._page_info.clear()
+        with self._edge_colors_lock:
+            self._edge_colors.clear()
+            self._auto_backgrounds.clear()
         self._raw_pixbufs.clear()
+        self._raw_pixbufs.reset_stats()
+        self._rendered_pixbufs.clear()
+        anime_tools.clear_cache()
 
     def page_is_available(self, page=None):
         ''' Returns True if <page> is available and calls to get_pixbufs
@@ -244,8 +487,13 @@ class ImageHandler(object):
         else:
             index_list = [page - 1]
 
+        if self._window.filehandler.can_read_file():
+            # Read directly from the archive, see _cache_pixbuf().
+            return True
+
         for index in index_list:
-            if index not in self._available_images:
+            if index not in self._available_images and \
+               not self._is_disk_cached(index):
                 return False
 
         return True
@@ -256,14 +504,24 @@ class ImageHandler(object):
         file has been extracted. '''
         log.debug('Page %u is available', page)
         index = page - 1
-        assert index not in self._available_images
-        self._cache_lock[index] = mt.Lock()
+        if index in self._available_images:
+            # Extracted again, see _reload_page().
+            return
+        self._cache_lock.setdefault(index, mt.Lock())
         self._available_images.add(index)
+        if self._page_info.get(index) is None:
+            self._page_info.add(index, self._image_files[index])
         # Check if we need to cache it.
         if index in self._wanted_pixbufs or -1 == self._cache_pages:
             self._thread.apply_async(
                 self._cache_pixbuf, (index,))
 
+    @callback.Callback
+    def page_cached(self, index):
+        ''' Called whenever the page <index> has been decoded and stored
+        in the cache. '''
+        pass
+
     def _file_available(self, filepaths):
         ''' Called by the filehandler when a new file becomes available. '''
         # Find the page that corresponds to <filepath>
@@ -272,9 +530,35 @@ class ImageHandler(object):
 
         available = sorted(filepaths)
         for i, imgpath in enumerate(self._image_files):
-            if tools.bin_search(available, imgpath) >= 0:
+            if tools.bin_search(available, imgpath) < 0:
+                continue
+            if i in self._available_images:
+                self._thread.apply_async(self._reload_page, (i,))
+            else:
                 self.page_available(i + 1)
 
+    def _files_evicted(self, filepaths):
+        ''' Called by the filehandler when files were removed from the
+        extraction directory: the corresponding pages must be extracted
+        again before being read from disk. '''
+        evicted = set(filepaths)
+        for i, imgpath in enumerate(self._image_files):
+            if imgpath in evicted:
+                self._available_images.discard(i)
+
+    def _reload_page(self, index):
+        ''' Called when the file for the page <index> has been extracted
+        again (e.g. a PDF page rendered at a higher resolution). '''
+        with self._cache_lock.setdefault(index, mt.Lock()):
+            self._raw_pixbufs.pop(index)
+        # Rendered pixbufs are keyed on the page file, see render_pixbuf().
+        path = self._image_files[index]
+        self._rendered_pixbufs.remove_matching(lambda key: key[0] == path)
+        # The size of rendered pages (i.e. PDF) may have changed.
+        self._page_info.add(index, self._image_files[index])
+        self._cache_pixbuf(index)
+        self.page_available(index + 1)
+
     def get_number_of_pages(self):
         '''Return the number of pages in the current archive/directory.'''
         return len(self._image_files)
@@ -334,6 +618,9 @@ class ImageHandler(object):
             return ('-1', '-1') if double else '-1'
 
         def get_fsize(page):
+            info = self._get_page_info(page)
+            if info is not None:
+                return tools.format_byte_size(info.filesize)
             path = self.get_path_to_page(page)
             try:
                 fsize = 0 if path is None else os.stat(path).st_size
@@ -370,6 +657,10 @@ class ImageHandler(object):
         '''Return a tuple (width, height) with the size of <page>. If <page>
         is None, return the size of the current page.
         '''
+        info = self._get_page_info(page)
+        if info is not None:
+            return (info.width, info.height)
+
         self._wait_on_page(page)
 
         page_path = self.get_path_to_page(page)
@@ -383,6 +674,10 @@ class ImageHandler(object):
         '''Return a string with the name of the mime type of <page>. If
         <page> is None, return the mime type name of the current page.
         '''
+        info = self._get_page_info(page)
+        if info is not None:
+            return info.format
+
         self._wait_on_page(page)
 
         page_path = self.get_path_to_page(page)
@@ -392,6 +687,22 @@ class ImageHandler(object):
         _format, width, height = image_tools.get_image_info(page_path)
         return _format
 
+    def _get_page_info(self, page=None):
+        '''Return the PageInfo of <page> (or of the current page if None),
+        or None if not known (yet). Pages that can be read directly from
+        the archive are read if needed, instead of waiting for them to be
+        extracted.
+        '''
+        if page is None:
+            page = self.get_current_page()
+        info = self._page_info.get(page - 1)
+        if info is not None or page - 1 in self._available_images:
+            return info
+        data = self._window.filehandler.read_file(self.get_path_to_page(page))
+        if data is None:
+            return None
+        return self._page_info.add_data(page - 1, data)
+
     def get_thumbnail(self, page=None, width=128, height=128, create=False,
                       nowait=False):
         '''Return a thumbnail pixbuf of <page> that fit in a box with
@@ -403,14 +714,25 @@ class ImageHandler(object):
 
         If <nowait> is True, don't wait for <page> to be available.
         '''
-        if not self._wait_on_page(page, check_only=nowait):
-            # Page is not available!
-            return None
         path = self.get_path_to_page(page)
-
         if path is None:
             return None
 
+        if not create and not self._wait_on_page(page, check_only=True):
+            # Not extracted, but maybe readable from the archive.
+            data = self._window.filehandler.read_file(path)
+            if data is not None:
+                try:
+                    return image_tools.load_pixbuf_bytes_size(data, width, height)
+                except Exception:
+                    log.debug('Failed to create thumbnail for image "%s":\n%s',
+                              path, traceback.format_exc())
+                    return image_tools.MISSING_IMAGE_ICON
+
+        if not self._wait_on_page(page, check_only=nowait):
+            # Page is not available!
+            return None
+
         try:
             thumbnailer = thumbnail_tools.Thumbnailer(store_on_disk=create,
                                                       size=(width, height))
@@ -420,6 +742,30 @@ class ImageHandler(object):
                       path, traceback.format_exc())
             return image_tools.MISSING_IMAGE_ICON
 
+    def estimate_page_wait(self, page=None):
+        '''Return the estimated time (in seconds) before <page> (or the
+        current page if None) is available, or None if unknown.
+        '''
+        if page is None:
+            page = self.get_current_page()
+        if self.page_is_available(page):
+            return 0.0
+        path = self.get_path_to_page(page)
+        if path is None:
+            return None
+        return self._window.filehandler.estimate_wait(path)
+
+    def get_extracted_path_to_page(self, page=None):
+        '''Return the full path to the image file for <page>, or the current
+        page if <page> is None, once extracted: pages read directly from the
+        archive are only extracted when their file is needed (e.g. to be
+        copied, or opened with another program).
+        '''
+        if self.get_path_to_page(page) is None:
+            return None
+        self._wait_on_page(page)
+        return self.get_path_to_page(page)
+
     def _wait_on_page(self, page, check_only=False):
         '''Block the running (main) thread until the file corresponding to
         image <page> has been fully extracted.
@@ -437,7 +783,7 @@ class ImageHandler(object):
             # Asked for check only...
             return False
 
-        log.debug('Waiting for page %u', page)
+        log.debug('Waiting for page %u', index + 1)
         path = self.get_path_to_page(page)
         self._window.filehandler._wait_on_file(path)
         return True
@@ -471,9 +817,15 @@ class ImageHandler(object):
         log.debug('Ask for priority extraction around page %u: %s',
                   page + 1, ' '.join([str(n + 1) for n in page_list]))
 
-        files = [self._image_files[index]
-                 for index in page_list
-                 if index not in self._available_images]
+        if self._window.filehandler.can_read_file():
+            # Read directly from the archive, only extracted if needed, see
+            # get_extracted_path_to_page().
+            files = []
+        else:
+            files = [self._image_files[index]
+                     for index in page_list
+                     if index not in self._available_images
+                     and not self._is_disk_cached(index)]
 
         if files:
             self._window.filehandler._ask_for_files(files)
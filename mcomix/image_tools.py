@@ -12,17 +12,22 @@ from gi.repository import GdkPixbuf, Gio, GLib
 from PIL import Image
 from PIL import ImageEnhance
 from PIL import ImageOps
-from PIL import ImageSequence
 
 from mcomix import anime_tools
 from mcomix import constants
 from mcomix import log
 from mcomix import tools
+from mcomix.lib import decoder
 from mcomix.lib import reader
 from mcomix.lib import FlifImagePlugin
 from mcomix.preferences import prefs
 from mcomix.i18n import _
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 if tools.use_gui():
     from gi.repository import Gdk, Gtk
 
@@ -53,27 +58,36 @@ def _getexif(im):
         return exif
 
     # Exif of PNG is still buggy in Pillow 6.0.0
+    if not _load_raw_profile_exif(im):
+        return {}
+
+    # load Exif again
+    try:
+        exif.update(im.getexif())
+    except AttributeError:
+        pass
+    return exif
+
+
+def _load_raw_profile_exif(im):
+    ''' Set the Exif data of <im> from its "Raw profile type exif" PNG text
+    chunk (as written by ImageMagick). Return False if there is no valid
+    such chunk. '''
     try:
         l1, l2, size, *lines = im.info.get('Raw profile type exif').splitlines()
         if l2 != 'exif':
             # Not valid Exif data.
-            return {}
+            return False
         size = int(size)
         data = binascii.unhexlify(''.join(lines))
         if len(data) != size:
             # Size not match.
-            return {}
+            return False
         im.info['exif'] = data
     except BaseException:
         # Not valid Exif data.
-        return {}
-
-    # load Exif again
-    try:
-        exif.update(im.getexif())
-    except AttributeError:
-        pass
-    return exif
+        return False
+    return True
 
 
 def rotate_pixbuf(src, rotation):
@@ -116,11 +130,8 @@ def get_fitting_size(source_size, target_size,
 
 
 def trans_pixbuf(src, flip=False, flop=False):
-    if is_animation(src):
-        return anime_tools.frame_executor(
-            src, trans_pixbuf,
-            kwargs=dict(flip=flip, flop=flop)
-        )
+    if isinstance(src, anime_tools.Animation):
+        return src.transform(trans_pixbuf, flip=flip, flop=flop)
     if flip:
         src = src.flip(horizontal=False)
     if flop:
@@ -129,11 +140,8 @@ def trans_pixbuf(src, flip=False, flop=False):
 
 
 def fit_pixbuf_to_rectangle(src, rect, rotation):
-    if is_animation(src):
-        return anime_tools.frame_executor(
-            src, fit_pixbuf_to_rectangle,
-            args=(rect, rotation)
-        )
+    if isinstance(src, anime_tools.Animation):
+        return src.transform(fit_pixbuf_to_rectangle, rect, rotation)
     return fit_in_rectangle(src, rect[0], rect[1],
                             rotation=rotation,
                             keep_ratio=False,
@@ -225,127 +233,213 @@ def get_most_common_edge_color(pixbufs, edge=2):
     doesn't work as expected together with get_pixels().
     '''
 
-    def group_colors(colors, steps=10):
-        ''' This rounds a list of colors in C{colors} to the next nearest value,
-        i.e. 128, 83, 10 becomes 130, 85, 10 with C{steps}=5. This compensates for
-        dirty colors where no clear dominating color can be made out.
-
-        @return: The color that appears most often in the prominent group.'''
-
-        # Start group
-        group = (0, 0, 0)
-        # List of (count, color) pairs, group contains most colors
-        colors_in_prominent_group = []
-        color_count_in_prominent_group = 0
-        # List of (count, color) pairs, current color group
-        colors_in_group = []
-        color_count_in_group = 0
-
-        for count, color in colors:
-
-            # Round color
-            rounded = [0] * len(color)
-            for i, color_value in enumerate(color):
-                if steps % 2 == 0:
-                    middle = steps // 2
-                else:
-                    middle = steps // 2 + 1
-
-                remainder = color_value % steps
-                if remainder >= middle:
-                    color_value = color_value + (steps - remainder)
-                else:
-                    color_value = color_value - remainder
-
-                rounded[i] = min(255, max(0, color_value))
-
-            # Change prominent group if necessary
-            if rounded == group:
-                # Color still fits in the previous color group
-                colors_in_group.append((count, color))
-                color_count_in_group += count
-            else:
-                # Color group changed, check if current group has more colors
-                # than last group
-                if color_count_in_group > color_count_in_prominent_group:
-                    colors_in_prominent_group = colors_in_group
-                    color_count_in_prominent_group = color_count_in_group
-
-                group = rounded
-                colors_in_group = [(count, color)]
-                color_count_in_group = count
-
-        # Cleanup if only one edge color group was found
-        if color_count_in_group > color_count_in_prominent_group:
-            colors_in_prominent_group = colors_in_group
-
-        colors_in_prominent_group.sort(key=operator.itemgetter(0), reverse=True)
-        # List is now sorted by color count, first color appears most often
-        return colors_in_prominent_group[0][1]
-
-    def get_edge_pixbuf(pixbuf, side, edge):
-        ''' Returns a pixbuf corresponding to the side passed in <side>.
-        Valid sides are 'left', 'right', 'top', 'bottom'. '''
-        pixbuf = static_image(pixbuf)
-        width = pixbuf.get_width()
-        height = pixbuf.get_height()
-        edge = min(edge, width, height)
-
-        subpix = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB,
-                                      pixbuf.get_has_alpha(), 8, edge, height)
-        if side == 'left':
-            pixbuf.copy_area(0, 0, edge, height, subpix, 0, 0)
-        elif side == 'right':
-            pixbuf.copy_area(width - edge, 0, edge, height, subpix, 0, 0)
-        elif side == 'top':
-            pixbuf.copy_area(0, 0, width, edge, subpix, 0, 0)
-        elif side == 'bottom':
-            pixbuf.copy_area(0, height - edge, width, edge, subpix, 0, 0)
-        else:
-            assert False, 'Invalid edge side'
-
-        return subpix
-
     if not pixbufs:
         return (0, 0, 0)
 
     if not isinstance(pixbufs, (tuple, list)):
-        left_edge = get_edge_pixbuf(pixbufs, 'left', edge)
-        right_edge = get_edge_pixbuf(pixbufs, 'right', edge)
+        left_colors, right_colors = get_edge_colors(pixbufs, edge)
     else:
         assert len(pixbufs) == 2, 'Expected two pages in list'
-        left_edge = get_edge_pixbuf(pixbufs[0], 'left', edge)
-        right_edge = get_edge_pixbuf(pixbufs[1], 'right', edge)
-
-    # Find all edge colors. Color count is separate for all four edges
-    ungrouped_colors = []
-    for edge in (left_edge, right_edge):
-        im = pixbuf_to_pil(edge)
-        ungrouped_colors.extend(im.getcolors(im.size[0] * im.size[1]))
-
-    # Sum up colors from all edges
-    ungrouped_colors.sort(key=operator.itemgetter(1))
-    most_used = group_colors(ungrouped_colors)
+        left_colors = get_edge_colors(pixbufs[0], edge)[0]
+        right_colors = get_edge_colors(pixbufs[1], edge)[1]
+    return get_common_edge_color(left_colors, right_colors)
+
+
+def get_edge_colors(pixbuf, edge=2):
+    '''Return the colors along the left and right edges (<edge> pixels
+    wide) of <pixbuf>, as a tuple (left, right) of values to be passed to
+    get_common_edge_color(). Much faster if NumPy is available.
+    '''
+    if numpy is None:
+        # Color count is separate for each edge.
+        return tuple(_get_pil_colors(_get_edge_pixbuf(pixbuf, side, edge))
+                     for side in ('left', 'right'))
+    pixbuf = static_image(pixbuf)
+    width = pixbuf.get_width()
+    height = pixbuf.get_height()
+    channels = pixbuf.get_n_channels()
+    pixels = numpy.ndarray((height, width, channels), numpy.uint8,
+                           _get_pixel_data(pixbuf),
+                           strides=(pixbuf.get_rowstride(), channels, 1))
+    edge = min(edge, width, height)
+    colors = []
+    for strip in (pixels[:, :edge], pixels[:, width - edge:]):
+        # Pack each color in an integer, ordered like the color tuples.
+        keys = numpy.zeros(strip.shape[:2], numpy.uint32)
+        for channel in range(channels):
+            keys = (keys << 8) | strip[:, :, channel]
+        keys, counts = numpy.unique(keys, return_counts=True)
+        colors.append((channels, keys, counts))
+    return tuple(colors)
+
+
+def get_common_edge_color(left_colors, right_colors):
+    '''Return the most commonly occurring color in <left_colors> and
+    <right_colors>, the colors along the left edge of a page and the right
+    edge of the same or another page (see get_edge_colors()). The result
+    is the same as get_most_common_edge_color() for these pages.
+    '''
+    if numpy is None or left_colors[0] != right_colors[0]:
+        if numpy is not None:
+            # Pages with and without alpha channel.
+            left_colors = _get_colors_list(left_colors)
+            right_colors = _get_colors_list(right_colors)
+        # Sum up colors from all edges
+        ungrouped_colors = left_colors + right_colors
+        ungrouped_colors.sort(key=operator.itemgetter(1))
+        most_used = _group_colors(ungrouped_colors)
+    else:
+        most_used = _group_colors_numpy(left_colors, right_colors)
     return [color / 255 for color in most_used]
 
 
-def pil_to_pixbuf(im, keep_orientation=False):
-    '''Return a pixbuf created from the PIL <im>.'''
-    if im.mode.startswith('RGB'):
-        has_alpha = im.mode == 'RGBA'
-    elif im.mode in ('LA', 'P'):
-        has_alpha = True
+def _group_colors(colors, steps=10):
+    ''' This rounds a list of colors in C{colors} to the next nearest value,
+    i.e. 128, 83, 10 becomes 130, 85, 10 with C{steps}=5. This compensates for
+    dirty colors where no clear dominating color can be made out.
+
+    @return: The color that appears most often in the prominent group.'''
+
+    # Start group
+    group = (0, 0, 0)
+    # List of (count, color) pairs, group contains most colors
+    colors_in_prominent_group = []
+    color_count_in_prominent_group = 0
+    # List of (count, color) pairs, current color group
+    colors_in_group = []
+    color_count_in_group = 0
+
+    for count, color in colors:
+
+        # Round color
+        rounded = [0] * len(color)
+        for i, color_value in enumerate(color):
+            if steps % 2 == 0:
+                middle = steps // 2
+            else:
+                middle = steps // 2 + 1
+
+            remainder = color_value % steps
+            if remainder >= middle:
+                color_value = color_value + (steps - remainder)
+            else:
+                color_value = color_value - remainder
+
+            rounded[i] = min(255, max(0, color_value))
+
+        # Change prominent group if necessary
+        if rounded == group:
+            # Color still fits in the previous color group
+            colors_in_group.append((count, color))
+            color_count_in_group += count
+        else:
+            # Color group changed, check if current group has more colors
+            # than last group
+            if color_count_in_group > color_count_in_prominent_group:
+                colors_in_prominent_group = colors_in_group
+                color_count_in_prominent_group = color_count_in_group
+
+            group = rounded
+            colors_in_group = [(count, color)]
+            color_count_in_group = count
+
+    # Cleanup if only one edge color group was found
+    if color_count_in_group > color_count_in_prominent_group:
+        colors_in_prominent_group = colors_in_group
+
+    colors_in_prominent_group.sort(key=operator.itemgetter(0), reverse=True)
+    # List is now sorted by color count, first color appears most often
+    return colors_in_prominent_group[0][1]
+
+
+def _group_colors_numpy(left_colors, right_colors, steps=10):
+    ''' Same as _group_colors() for the colors of both edges, with NumPy. '''
+    channels = left_colors[0]
+    keys = numpy.concatenate((left_colors[1], right_colors[1]))
+    counts = numpy.concatenate((left_colors[2], right_colors[2]))
+    # Stable sort, so that ties are broken as with _group_colors().
+    order = numpy.argsort(keys, kind='stable')
+    keys = keys[order]
+    counts = counts[order]
+    shifts = 8 * numpy.arange(channels - 1, -1, -1)
+    colors = (keys[:, numpy.newaxis].astype(numpy.int64) >> shifts) & 0xff
+
+    # Round colors
+    if steps % 2 == 0:
+        middle = steps // 2
     else:
-        has_alpha = False
-    target_mode = 'RGBA' if has_alpha else 'RGB'
-    if im.mode != target_mode:
-        im = im.convert(target_mode)
-    pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(
-        GLib.Bytes.new(im.tobytes()), GdkPixbuf.Colorspace.RGB,
-        has_alpha, 8,
-        im.size[0], im.size[1],
-        (4 if has_alpha else 3) * im.size[0]
-    )
+        middle = steps // 2 + 1
+    remainder = colors % steps
+    rounded = numpy.where(remainder >= middle,
+                          colors + (steps - remainder), colors - remainder)
+    rounded = numpy.clip(rounded, 0, 255)
+
+    # Consecutive colors with the same rounded value form a group.
+    new_group = numpy.ones(len(keys), dtype=bool)
+    new_group[1:] = numpy.any(rounded[1:] != rounded[:-1], axis=1)
+    groups = numpy.cumsum(new_group) - 1
+    # First group with the most colors, and its most frequent color.
+    prominent_group = numpy.argmax(numpy.bincount(groups, weights=counts))
+    in_group = numpy.flatnonzero(groups == prominent_group)
+    most_used = in_group[numpy.argmax(counts[in_group])]
+    return tuple(int(color) for color in colors[most_used])
+
+
+def _get_edge_pixbuf(pixbuf, side, edge):
+    ''' Returns a pixbuf corresponding to the side passed in <side>.
+    Valid sides are 'left', 'right', 'top', 'bottom'. '''
+    pixbuf = static_image(pixbuf)
+    width = pixbuf.get_width()
+    height = pixbuf.get_height()
+    edge = min(edge, width, height)
+
+    subpix = GdkPixbuf.Pixbuf.new(GdkPixbuf.Colorspace.RGB,
+                                  pixbuf.get_has_alpha(), 8, edge, height)
+    if side == 'left':
+        pixbuf.copy_area(0, 0, edge, height, subpix, 0, 0)
+    elif side == 'right':
+        pixbuf.copy_area(width - edge, 0, edge, height, subpix, 0, 0)
+    elif side == 'top':
+        pixbuf.copy_area(0, 0, width, edge, subpix, 0, 0)
+    elif side == 'bottom':
+        pixbuf.copy_area(0, height - edge, width, edge, subpix, 0, 0)
+    else:
+        assert False, 'Invalid edge side'
+
+    return subpix
+
+
+def _get_pil_colors(pixbuf):
+    im = pixbuf_to_pil(pixbuf)
+    return im.getcolors(im.size[0] * im.size[1])
+
+
+def _get_colors_list(colors):
+    # Convert colors from get_edge_colors() (with NumPy) to a list of
+    # (count, color) tuples, as returned by PIL getcolors().
+    channels, keys, counts = colors
+    return [(int(count), tuple((int(key) >> 8 * (channels - 1 - channel)) & 0xff
+                               for channel in range(channels)))
+            for key, count in zip(keys, counts)]
+
+
+def _new_pixbuf(data, has_alpha, width, height, rowstride):
+    ''' Returns a pixbuf over the pixels in the bytes object <data>.
+    GLib.Bytes.new_take() adopts the buffer PyGObject copies <data> to,
+    while GLib.Bytes.new() would copy it once more. '''
+    return GdkPixbuf.Pixbuf.new_from_bytes(
+        GLib.Bytes.new_take(data), GdkPixbuf.Colorspace.RGB,
+        has_alpha, 8, width, height, rowstride)
+
+
+def pil_to_pixbuf(im, keep_orientation=False):
+    '''Return a pixbuf created from the PIL <im>. The image is only
+    converted if its pixels cannot be packed as RGB or RGBA directly.'''
+    mode = decoder.get_mode(im)
+    if im.mode not in decoder.RAW_MODES:
+        im = im.convert(mode)
+    pixbuf = _new_pixbuf(decoder.pack(im, mode), mode == 'RGBA',
+                         im.size[0], im.size[1], len(mode) * im.size[0])
     if keep_orientation:
         # Keep orientation metadata.
         orientation = _getexif(im).get(274, None)
@@ -355,26 +449,36 @@ def pil_to_pixbuf(im, keep_orientation=False):
 
 
 def pixbuf_to_pil(pixbuf):
-    '''Return a PIL image created from <pixbuf>.'''
+    '''Return a PIL image created from <pixbuf>. RGBA pixels are shared
+    with the image (which is then read-only).'''
     dimensions = pixbuf.get_width(), pixbuf.get_height()
     stride = pixbuf.get_rowstride()
-    pixels = pixbuf.get_pixels()
+    pixels = _get_pixel_data(pixbuf)
     mode = 'RGBA' if pixbuf.get_has_alpha() else 'RGB'
     im = Image.frombuffer(mode, dimensions, pixels, 'raw', mode, stride, 1)
     return im
 
 
+def _get_pixel_data(pixbuf):
+    ''' Returns the pixels of <pixbuf>, as a bytes-like object. '''
+    try:
+        # For pixbufs created from bytes (see pil_to_pixbuf()), this avoids
+        # get_pixels() making a mutable copy of their pixels inside the
+        # pixbuf. GLib.Bytes.get_data() still returns a copy of them.
+        return pixbuf.read_pixel_bytes().get_data()
+    except AttributeError:
+        # GdkPixbuf < 2.32
+        return pixbuf.get_pixels()
+
+
 def is_animation(pixbuf):
-    return isinstance(pixbuf, GdkPixbuf.PixbufAnimation)
+    return isinstance(pixbuf, (GdkPixbuf.PixbufAnimation, anime_tools.Animation))
 
 
 def disable_transform(pixbuf):
-    if is_animation(pixbuf):
-        if not hasattr(pixbuf, '_framebuffer'):
-            return True
-        if not prefs['animation transform']:
-            return True
-    return False
+    if isinstance(pixbuf, anime_tools.Animation):
+        return not prefs['animation transform']
+    return is_animation(pixbuf)
 
 
 def static_image(pixbuf):
@@ -384,6 +488,16 @@ def static_image(pixbuf):
     return pixbuf
 
 
+def get_pixbuf_size(pixbuf):
+    ''' Returns the (approximate) memory used by <pixbuf>, in bytes. '''
+    if isinstance(pixbuf, anime_tools.Animation):
+        # Its frames are accounted for by the frame cache of anime_tools.
+        return pixbuf.data_size
+    if is_animation(pixbuf):
+        return get_pixbuf_size(pixbuf.get_static_image())
+    return pixbuf.get_rowstride() * pixbuf.get_height()
+
+
 def unwrap_image(image):
     ''' Returns an object that contains the image data based on
     gtk.Image.get_storage_type or None if image is None or image.get_storage_type
@@ -409,44 +523,100 @@ def unwrap_image(image):
 
 
 def set_from_pixbuf(image, pixbuf):
-    if is_animation(pixbuf):
+    anime_tools.stop(image)
+    if isinstance(pixbuf, anime_tools.Animation):
+        return anime_tools.play(image, pixbuf)
+    elif is_animation(pixbuf):
         return image.set_from_animation(pixbuf)
     else:
         return image.set_from_pixbuf(pixbuf)
 
 
-def load_animation(im):
+def load_animation(im, fp):
+    ''' Returns an anime_tools.Animation for the animated image <im>,
+    opened from the file object <fp>. Only the first frame is decoded. '''
     if im.format == 'GIF' and im.mode == 'P':
         # TODO: Pillow has bug with gif animation
         # https://github.com/python-pillow/Pillow/labels/GIF
         raise NotImplementedError('Pillow has bug with gif animation, '
                                   'fallback to GdkPixbuf')
-    anime = anime_tools.AnimeFrameBuffer(im.n_frames, loop=im.info['loop'])
     background = im.info.get('background', None)
     if isinstance(background, tuple):
         color = 0
         for n, c in enumerate(background):
             color |= c << n * 8
         background = color
-    frameiter = ImageSequence.Iterator(im)
-    for n, frame in enumerate(frameiter):
-        anime.add_frame(n, pil_to_pixbuf(frame),
-                        int(frame.info.get('duration', 0)),
-                        background=background)
-    return anime.create_animation()
+    fp.seek(0)
+    source = anime_tools.FrameSource(fp.read(), im.n_frames,
+                                     loop=im.info.get('loop', 1),
+                                     background=background)
+    anime = anime_tools.Animation(source)
+    # Fail early if not supported.
+    anime.get_static_image()
+    return anime
+
+
+def _load_pil_pixbuf(fp, enable_anime, draft_size=None):
+    ''' Loads a pixbuf (or an animation) from the file object <fp> using PIL.
+    If <draft_size> is not None, JPEG images may be decoded at a reduced
+    resolution, as long as the result is not smaller than <draft_size>. '''
+    with Image.open(fp) as im:
+        original_size = im.size
+        if draft_size is not None and im.format == 'JPEG':
+            im.draft(None, draft_size)
+        # make sure n_frames loaded
+        im.load()
+        if enable_anime and getattr(im, 'is_animated', False):
+            return load_animation(im, fp)
+        pixbuf = pil_to_pixbuf(im, keep_orientation=True)
+        if im.size != original_size:
+            setattr(pixbuf, 'draft_size', tuple(draft_size))
+            setattr(pixbuf, 'draft_scale', original_size[0] / im.size[0])
+        return pixbuf
 
 
-def load_pixbuf(path):
-    ''' Loads a pixbuf from a given image file. '''
+def _load_decoded_pixbuf(source, draft_size=None):
+    ''' Loads a pixbuf from <source> (a path, or the image file content)
+    decoded by a worker process, see lib.decoder. Returns None if this is
+    not possible (e.g. unsupported format, or animated image). '''
+    try:
+        decoded = decoder.decode(source, draft_size=draft_size)
+    except Exception as e:
+        log.debug('Failed to decode image in a worker process: %s', e)
+        return None
+    if decoded is None:
+        return None
+    with decoded:
+        # The pixels must be copied out of shared memory, as PyGObject
+        # only takes them as bytes, see _new_pixbuf().
+        pixbuf = _new_pixbuf(decoded.tobytes(), decoded.has_alpha,
+                             decoded.size[0], decoded.size[1],
+                             decoded.rowstride)
+    if decoded.orientation is not None:
+        setattr(pixbuf, 'orientation', str(decoded.orientation))
+    if decoded.size != decoded.original_size:
+        setattr(pixbuf, 'draft_size', tuple(draft_size))
+        setattr(pixbuf, 'draft_scale', decoded.original_size[0] / decoded.size[0])
+    return pixbuf
+
+
+def get_draft_scale(pixbuf):
+    ''' Returns the ratio between the original image size and the size
+    <pixbuf> was decoded at, see load_pixbuf(). '''
+    return getattr(pixbuf, 'draft_scale', 1.0)
+
+
+def load_pixbuf(path, draft_size=None):
+    ''' Loads a pixbuf from a given image file. See _load_pil_pixbuf()
+    for <draft_size>. '''
     enable_anime = prefs['animation mode'] != constants.ANIMATION_DISABLED
+    if prefs['decode in worker processes'] and decoder.is_available():
+        pixbuf = _load_decoded_pixbuf(path, draft_size=draft_size)
+        if pixbuf is not None:
+            return pixbuf
     try:
-        with reader.LockedFileIO(path) as fio:
-            with Image.open(fio) as im:
-                # make sure n_frames loaded
-                im.load()
-                if enable_anime and getattr(im, 'is_animated', False):
-                    return load_animation(im)
-                return pil_to_pixbuf(im, keep_orientation=True)
+        with reader.FileReader(path) as fio:
+            return _load_pil_pixbuf(fio, enable_anime, draft_size=draft_size)
     except BaseException:
         pass
     if enable_anime:
@@ -461,7 +631,7 @@ def load_pixbuf_size(path, width, height):
     ''' Loads a pixbuf from a given image file and scale it to fit
     inside (width, height). '''
     try:
-        with reader.LockedFileIO(path) as fio:
+        with reader.FileReader(path) as fio:
             with Image.open(fio) as im:
                 im.thumbnail((width, height), resample=Image.BOX)
                 return pil_to_pixbuf(im, keep_orientation=True)
@@ -487,6 +657,23 @@ def load_pixbuf_size(path, width, height):
                                 scaling_quality=GdkPixbuf.InterpType.BILINEAR)
 
 
+def load_pixbuf_bytes_size(imgdata, width, height):
+    ''' Loads a pixbuf from the image file content passed in <imgdata>,
+    and scale it to fit inside (width, height), like load_pixbuf_size(). '''
+    try:
+        with reader.MemoryViewIO(imgdata) as fio:
+            with Image.open(fio) as im:
+                im.thumbnail((width, height), resample=Image.BOX)
+                return pil_to_pixbuf(im, keep_orientation=True)
+    except BaseException:
+        pass
+    loader = GdkPixbuf.PixbufLoader()
+    loader.write(bytes(imgdata))
+    loader.close()
+    return fit_in_rectangle(loader.get_pixbuf(), width, height,
+                            scaling_quality=GdkPixbuf.InterpType.BILINEAR)
+
+
 def load_pixbuf_data(imgdata):
     ''' Loads a pixbuf from the data passed in <imgdata>. '''
     try:
@@ -500,6 +687,30 @@ def load_pixbuf_data(imgdata):
     return loader.get_pixbuf()
 
 
+def load_pixbuf_bytes(imgdata, draft_size=None):
+    ''' Loads a pixbuf from the image file content passed in <imgdata>,
+    with the same handling of animations as load_pixbuf(). '''
+    enable_anime = prefs['animation mode'] != constants.ANIMATION_DISABLED
+    if prefs['decode in worker processes'] and decoder.is_available():
+        pixbuf = _load_decoded_pixbuf(bytes(imgdata), draft_size=draft_size)
+        if pixbuf is not None:
+            return pixbuf
+    try:
+        with reader.MemoryViewIO(imgdata) as fio:
+            return _load_pil_pixbuf(fio, enable_anime, draft_size=draft_size)
+    except BaseException:
+        pass
+    loader = GdkPixbuf.PixbufLoader()
+    loader.write(bytes(imgdata))
+    loader.close()
+    if enable_anime:
+        pixbuf = loader.get_animation()
+        if pixbuf.is_static_image():
+            return pixbuf.get_static_image()
+        return pixbuf
+    return loader.get_pixbuf()
+
+
 def enhance(pixbuf, brightness=1.0, contrast=1.0, saturation=1.0,
             sharpness=1.0, autocontrast=False):
     '''Return a modified pixbuf from <pixbuf> where the enhancement operations
@@ -508,14 +719,10 @@ def enhance(pixbuf, brightness=1.0, contrast=1.0, saturation=1.0,
     but only if the image mode is supported by ImageOps.autocontrast (i.e.
     it is L or RGB.)
     '''
-    if is_animation(pixbuf):
-        return anime_tools.frame_executor(
-            pixbuf, enhance,
-            kwargs=dict(
-                brightness=brightness, contrast=contrast,
-                saturation=saturation, sharpness=1.0,
-                autocontrast=False
-            )
+    if isinstance(pixbuf, anime_tools.Animation):
+        return pixbuf.transform(
+            enhance, brightness=brightness, contrast=contrast,
+            saturation=saturation, sharpness=1.0, autocontrast=False
         )
     im = pixbuf_to_pil(pixbuf)
     if brightness != 1.0:
@@ -543,6 +750,13 @@ def get_implied_rotation(pixbuf):
     orientation = getattr(pixbuf, 'orientation', None)
     if orientation is None:
         orientation = pixbuf.get_option('orientation')
+    return get_orientation_rotation(orientation)
+
+
+def get_orientation_rotation(orientation):
+    '''Return the rotation in degrees implied by the Exif <orientation>
+    (as a string, like the pixbuf option), see get_implied_rotation().
+    '''
     if orientation == '3':
         return 180
     elif orientation == '6':
@@ -607,15 +821,32 @@ def text_color_for_background_color(bgcolor):
         65535.0 / 2.0 else GTK_GDK_COLOR_WHITE
 
 
+def get_image_header_info(path):
+    '''Return image informations read from the header of the image file
+    at <path> (the pixel data is not read):
+        (format, width, height, orientation)
+    with <orientation> the Exif orientation (as a string, like the pixbuf
+    option), or None. Raise an exception if not supported by PIL.
+    '''
+    with Image.open(path) as im:
+        orientation = None
+        # For PNG, Exif data not found in the header can only be looked
+        # for by loading the whole image.
+        if im.format != 'PNG' or 'exif' in im.info or \
+           _load_raw_profile_exif(im):
+            orientation = im.getexif().get(274, None)
+        if orientation is not None:
+            orientation = str(orientation)
+        return (im.format, im.size[0], im.size[1], orientation)
+
+
 def get_image_info(path):
     '''Return image informations:
         (format, width, height)
     '''
     info = None
     try:
-        with reader.LockedFileIO(path) as fio:
-            with Image.open(fio) as im:
-                return (im.format,) + im.size
+        return get_image_header_info(path)[:3]
     except BaseException:
         info = GdkPixbuf.Pixbuf.get_file_info(path)
         if info[0] is None:
@@ -43,6 +43,8 @@ class MagnifyingLens(object):
             # FIXME: If no file is currently loaded, the cursor will still be hidden.
             self._window.cursor_handler.set_cursor_type(constants.NO_CURSOR)
             self._window.osd.clear()
+            # The lens needs full resolution pages.
+            self._window.imagehandler.set_draft_size(None)
 
             if self._point:
                 self._draw_lens(*self._point)
@@ -0,0 +1,174 @@
+'''decoder.py - Image decoding in worker processes.
+
+Decoding pages in worker processes keeps the Python side of the work
+(conversion, EXIF parsing, copies) from competing with the GUI for the
+GIL. Decoded pixels are returned through shared memory. This module must
+not depend on GTK, as it is imported by the worker processes.
+'''
+
+import concurrent.futures
+import io
+import multiprocessing
+import threading
+
+from PIL import Image
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+
+#: Filled on-demand by _get_executor()
+_executor = None
+_lock = threading.Lock()
+
+#: PIL modes that can be packed directly to RGB or RGBA (the pixel formats
+#: of pixbufs), mapped to the corresponding mode.
+RAW_MODES = {
+    'RGB': 'RGB',
+    'RGBA': 'RGBA',
+    'RGBX': 'RGB',
+}
+
+
+class DecodedImage(object):
+
+    ''' Pixels of an image decoded by a worker process, in shared memory.
+    The block is unlinked once attached, and released by close(). '''
+
+    def __init__(self, name, mode, size, original_size, orientation):
+        self.mode = mode
+        self.size = size
+        self.original_size = original_size
+        self.orientation = orientation
+        self._shm = shared_memory.SharedMemory(name=name)
+        # Nothing else attaches to it: unlink it right away, so it is not
+        # leaked if something fails later.
+        self._shm.unlink()
+
+    @property
+    def has_alpha(self):
+        return self.mode == 'RGBA'
+
+    @property
+    def rowstride(self):
+        return len(self.mode) * self.size[0]
+
+    @property
+    def pixels(self):
+        ''' A memoryview of the pixels, only valid until close(). '''
+        return self._shm.buf[:self.rowstride * self.size[1]]
+
+    def tobytes(self):
+        ''' Returns a copy of the pixels. '''
+        return self.pixels.tobytes()
+
+    def close(self):
+        self._shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def get_mode(im):
+    ''' Returns the mode (RGB or RGBA) the PIL <im> is to be packed in. '''
+    mode = RAW_MODES.get(im.mode)
+    if mode is not None:
+        return mode
+    return 'RGBA' if im.mode in ('LA', 'P') else 'RGB'
+
+
+def pack(im, rawmode):
+    ''' Returns the pixels of <im> packed in <rawmode>. Same as
+    im.tobytes('raw', rawmode), but encoded to a single buffer, instead of
+    chunks that must then be joined (i.e. copied again). '''
+    im.load()
+    if im.size[0] == 0 or im.size[1] == 0:
+        return b''
+    encoder = Image._getencoder(im.mode, 'raw', rawmode)
+    encoder.setimage(im.im, (0, 0) + im.size)
+    bufsize = len(rawmode) * im.size[0] * im.size[1]
+    chunks = []
+    while True:
+        consumed, errcode, data = encoder.encode(bufsize)
+        chunks.append(data)
+        if errcode:
+            break
+    if errcode < 0:
+        raise RuntimeError('encoder error {} in tobytes'.format(errcode))
+    if len(chunks) == 1:
+        return chunks[0]
+    return b''.join(chunks)
+
+
+def is_available():
+    ''' Returns True if images can be decoded in worker processes, which
+    requires shared memory support (Python 3.8 or later). '''
+    return shared_memory is not None
+
+
+def decode(source, draft_size=None):
+    ''' Decode the image <source> (a path, or the image file content as
+    bytes) to RGB or RGBA pixels in a worker process. See
+    image_tools.load_pixbuf() for <draft_size>. Returns a DecodedImage,
+    or None for animated images (better handled in the main process). '''
+    result = _get_executor().submit(_decode, source, draft_size).result()
+    if result is None:
+        return None
+    return DecodedImage(*result)
+
+
+def shutdown():
+    ''' Stop the worker processes. '''
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            return
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _get_executor():
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            # Forking a multi-threaded GUI process is not safe.
+            _executor = concurrent.futures.ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def _decode(source, draft_size):
+    # Run in a worker process.
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with Image.open(source) as im:
+        original_size = im.size
+        if draft_size is not None and im.format == 'JPEG':
+            im.draft(None, draft_size)
+        im.load()
+        if getattr(im, 'is_animated', False):
+            return None
+        orientation = im.getexif().get(274, None)
+        mode = get_mode(im)
+        if im.mode not in RAW_MODES:
+            im = im.convert(mode)
+        data = pack(im, mode)
+        size = im.size
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    try:
+        shm.buf[:len(data)] = data
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+    return shm.name, mode, size, original_size, orientation
+
+# vim: expandtab:sw=4:ts=4
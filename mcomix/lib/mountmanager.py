@@ -126,9 +126,11 @@ class MountManager:
 
             return self
 
-    def umount(self):
+    def umount(self, lazy=False):
         '''
         Umount if manager is mounted, or raise Exception.
+        If <lazy> is True, detach the filesystem without waiting
+        for it to be no longer busy.
         '''
         with self._lock:
             if self._errno:
@@ -138,9 +140,11 @@ class MountManager:
             if not os.path.ismount(self.mountpoint):
                 raise self.NotMounted(self.mountpoint)
 
-            if subprocess.run((self._fusermount, '-u', self.mountpoint)).returncode:
+            option = '-uz' if lazy else '-u'
+            if subprocess.run((self._fusermount, option, self.mountpoint)).returncode:
                 raise self.UmountFailed(self.mountpoint)
-            self._cmdthread.join()
+            if not lazy:
+                self._cmdthread.join()
             self._cmdthread = None
 
     def is_mounted(self):
@@ -1,11 +1,164 @@
 import io
+import os
+import weakref
 from threading import Lock
 
-_IOLock = Lock()
+# Lock for each path being read, see _get_path_lock().
+_path_locks = weakref.WeakValueDictionary()
+_path_locks_lock = Lock()
 
 
-class LockedFileIO(io.BytesIO):
+def _get_path_lock(path):
+    # Reads of the same file are serialized, reads of different
+    # files are done in parallel.
+    with _path_locks_lock:
+        lock = _path_locks.get(path)
+        if lock is None:
+            lock = _path_locks[path] = Lock()
+        return lock
+
+
+class _PositionalIO(io.RawIOBase):
+
+    ''' Read-only file object over <size> bytes read with _read_at(). '''
+
+    def __init__(self, size):
+        super().__init__()
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        data = self._read_at(self._pos, len(b))
+        n = len(data)
+        b[:n] = data
+        self._pos += n
+        return n
+
+    def readall(self):
+        data = bytes(self._read_at(self._pos, max(0, self._size - self._pos)))
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError('invalid whence ({})'.format(whence))
+        if pos < 0:
+            raise ValueError('negative seek position {}'.format(pos))
+        self._pos = pos
+        return pos
+
+    def tell(self):
+        return self._pos
+
+    def _read_at(self, offset, size):
+        ''' Returns up to <size> bytes from <offset>, as a bytes-like
+        object. '''
+        raise NotImplementedError()
+
+
+class MemoryViewIO(_PositionalIO):
+
+    ''' Read-only file object over a bytes-like object, without copying
+    it first (unlike io.BytesIO with a memoryview). Data is only copied
+    into the caller's buffer by readinto(); use getbuffer() to access it
+    in place. '''
+
+    def __init__(self, data):
+        view = memoryview(data).cast('B')
+        super().__init__(len(view))
+        self._view = view
+
+    def getbuffer(self):
+        ''' Returns a memoryview of the whole content. '''
+        return self._view[:]
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+    def _read_at(self, offset, size):
+        return self._view[offset:offset + size]
+
+
+class FileRange(object):
+
+    ''' The <size> bytes at <offset> in the file at <path> (e.g. a
+    member stored in an archive), read in place with os.pread(): threads
+    can read concurrently, each through its own file object (see open()),
+    without sharing a file position. The file is opened on first read, and
+    is not memory mapped (see FileReader). Requires os.pread(). '''
+
+    def __init__(self, path, offset, size):
+        self.path = path
+        self.offset = offset
+        self.size = size
+        self._fd = None
+        self._lock = Lock()
+
+    def __len__(self):
+        return self.size
+
+    def read_at(self, offset, size):
+        ''' Returns up to <size> bytes from <offset> in the range. '''
+        size = min(size, self.size - offset)
+        if size <= 0:
+            return b''
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+            fd = self._fd
+        return os.pread(fd, size, self.offset + offset)
+
+    def subrange(self, offset, size):
+        ''' Returns the FileRange of <size> bytes at <offset> in this one. '''
+        return FileRange(self.path, self.offset + offset,
+                         max(0, min(size, self.size - offset)))
+
+    def open(self):
+        ''' Returns a new file object over the range. '''
+        return FileRangeIO(self)
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+
+class FileRangeIO(_PositionalIO):
+
+    ''' Read-only file object over a FileRange. '''
+
+    def __init__(self, file_range):
+        super().__init__(file_range.size)
+        self._range = file_range
+
+    def _read_at(self, offset, size):
+        return self._range.read_at(offset, size)
+
+
+class FileReader(io.BytesIO):
+
+    ''' Read-only file object over the content of the file at <path>.
+    The file is read at once by the unbuffered file object, in a buffer
+    sized from its status, which io.BytesIO then uses without copying it.
+    The file is not memory mapped: it could be truncated while mapped,
+    e.g. by an extraction, which would crash the process. '''
+
     def __init__(self, path):
-        with _IOLock:
-            with open(path, mode='rb') as f:
-                super().__init__(f.read())
+        with _get_path_lock(path):
+            with open(path, mode='rb', buffering=0) as f:
+                data = f.readall()
+        super().__init__(data)
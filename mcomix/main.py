@@ -6,8 +6,10 @@ import threading
 
 from gi.repository import GLib, Gdk, Gtk
 
+from mcomix import anime_tools
 from mcomix import constants
 from mcomix import cursor_handler
+from mcomix import disk_page_cache
 from mcomix import i18n
 from mcomix import icons
 from mcomix import enhance_backend
@@ -17,6 +19,7 @@ from mcomix import image_handler
 from mcomix import image_tools
 from mcomix import lens
 from mcomix import preferences
+from mcomix import reaper
 from mcomix.preferences import prefs
 from mcomix import ui
 from mcomix import slideshow
@@ -35,6 +38,7 @@ from mcomix import tools
 from mcomix import layout
 from mcomix import log
 from mcomix.i18n import _
+from mcomix.lib import decoder
 
 
 class MainWindow(Gtk.Window):
@@ -64,6 +68,8 @@ class MainWindow(Gtk.Window):
         self.layout = _dummy_layout()
         self._spacing = 2
         self._waiting_for_redraw = False
+        #: Viewport size of the last drawn page(s), used for pre-rendering
+        self._render_viewport_size = None
 
         self._image_box = Gtk.HBox(homogeneous=False, spacing=2)  # XXX transitional(kept for osd.py)
         self._main_layout = Gtk.Layout()
@@ -84,6 +90,7 @@ class MainWindow(Gtk.Window):
         self.filehandler.file_opened += self._on_file_opened
         self.imagehandler = image_handler.ImageHandler(self)
         self.imagehandler.page_available += self._page_available
+        self.imagehandler.page_cached += self._page_cached
         self.thumbnailsidebar = thumbbar.ThumbnailSidebar(self)
 
         self.statusbar = status.Statusbar()
@@ -407,53 +414,17 @@ class MainWindow(Gtk.Window):
             self._waiting_for_redraw = False
             return False
 
+        # Set even if the page is not available yet, so that PDF pages can
+        # be rendered at the right resolution from the start.
+        self.imagehandler.set_draft_size(self.get_draft_size())
+
         if self.imagehandler.page_is_available():
-            distribution_axis = constants.DISTRIBUTION_AXIS
-            alignment_axis = constants.ALIGNMENT_AXIS
             pixbuf_count = 2 if self.displayed_double() else 1  # XXX limited to at most 2 pages
             pixbuf_list = list(self.imagehandler.get_pixbufs(pixbuf_count))
             do_not_transform = [image_tools.disable_transform(x) for x in pixbuf_list]
-            size_list = [[pixbuf.get_width(), pixbuf.get_height()]
-                         for pixbuf in pixbuf_list]
-
-            if self.is_manga_mode:
-                orientation = constants.MANGA_ORIENTATION
-            else:
-                orientation = constants.WESTERN_ORIENTATION
-
-            # Rotation handling:
-            # - apply Exif rotation on individual images
-            # - apply automatic rotation (size based) on whole page
-            # - apply manual rotation on whole page
-            if prefs['auto rotate from exif']:
-                rotation_list = [image_tools.get_implied_rotation(pixbuf)
-                                 for pixbuf in pixbuf_list]
-            else:
-                rotation_list = [0] * len(pixbuf_list)
-            virtual_size = [0, 0]
-            for i in range(pixbuf_count):
-                if rotation_list[i] in (90, 270):
-                    size_list[i].reverse()
-                size = size_list[i]
-                virtual_size[distribution_axis] += size[distribution_axis]
-                virtual_size[alignment_axis] = max(virtual_size[alignment_axis],
-                                                   size[alignment_axis])
-            rotation = self._get_size_rotation(*virtual_size)
-            rotation = (rotation + prefs['rotation']) % 360
-            if rotation in (90, 270):
-                distribution_axis, alignment_axis = alignment_axis, distribution_axis
-                orientation = list(orientation)
-                orientation.reverse()
-                for i in range(pixbuf_count):
-                    size_list[i].reverse()
-            if rotation in (180, 270):
-                orientation = tools.vector_opposite(orientation)
-            for i in range(pixbuf_count):
-                rotation_list[i] = (rotation_list[i] + rotation) % 360
-            if prefs['vertical flip'] and rotation in (90, 270):
-                orientation = tools.vector_opposite(orientation)
-            if prefs['horizontal flip'] and rotation in (0, 180):
-                orientation = tools.vector_opposite(orientation)
+            size_list, rotation_list, rotation, orientation, \
+                distribution_axis, alignment_axis = \
+                self._get_pages_geometry(pixbuf_list)
 
             viewport_size = ()  # dummy
             expand_area = False
@@ -486,27 +457,28 @@ class MainWindow(Gtk.Window):
                     expand_area = True
                     viewport_size = ()  # start anew
 
+            first_index = self.imagehandler.get_current_page() - 1
             for i in range(pixbuf_count):
-                pixbuf_list[i] = image_tools.fit_pixbuf_to_rectangle(
-                    pixbuf_list[i], scaled_sizes[i], rotation_list[i])
+                pixbuf_list[i] = self.imagehandler.render_pixbuf(
+                    first_index + i, scaled_sizes[i], rotation_list[i],
+                    pixbuf=pixbuf_list[i])
 
-            for i in range(pixbuf_count):
-                pixbuf_list[i] = image_tools.trans_pixbuf(
-                    pixbuf_list[i],
-                    flip=prefs['vertical flip'],
-                    flop=prefs['horizontal flip']
-                )
-                pixbuf_list[i] = self.enhancer.enhance(pixbuf_list[i])
+            self._render_viewport_size = viewport_size
+            self._prerender_neighbours()
 
             for i in range(pixbuf_count):
                 image_tools.set_from_pixbuf(self.images[i], pixbuf_list[i])
 
-            resolutions = [(*size, scaled_size[0] / size[0])
-                           for scaled_size, size in zip(scaled_sizes, size_list)]
+            draft_scales = [image_tools.get_draft_scale(pixbuf) for pixbuf in pixbuf_list]
+            resolutions = [(round(size[0] * scale), round(size[1] * scale),
+                            scaled_size[0] / (size[0] * scale))
+                           for scaled_size, size, scale
+                           in zip(scaled_sizes, size_list, draft_scales)]
 
             if self.is_manga_mode:
                 resolutions.reverse()
             self.statusbar.set_resolution(resolutions)
+            self.statusbar.set_cache_info(self.imagehandler.get_cache_info())
             self.statusbar.update()
 
             smartbg = prefs['smart bg']
@@ -557,11 +529,130 @@ class MainWindow(Gtk.Window):
             for i in range(len(self.images)):
                 self.images[i].hide()
             self._show_scrollbars([False] * len(self._scroll))
+            self._update_wait_message()
 
         self._waiting_for_redraw = False
 
         return False
 
+    def get_draft_size(self):
+        ''' Returns the minimal size pages need to be decoded at for display,
+        or None if they must be decoded at full resolution (manual zoom,
+        magnifying lens). '''
+        if self.zoom.get_fit_mode() == constants.ZOOM_MODE_MANUAL or \
+           not self.zoom.is_identity_user_zoom() or self.lens.enabled:
+            return None
+        size = max(self.get_visible_area_size())
+        if self.zoom.get_fit_mode() == constants.ZOOM_MODE_SIZE:
+            size = max(size, prefs['fit to size px'])
+        # Whatever the rotation, fit mode or page layout, a page is never
+        # displayed larger than this in either dimension.
+        return (size, size)
+
+    def _get_pages_geometry(self, pixbuf_list):
+        ''' Determines how the pages in <pixbuf_list> are to be displayed.
+        Returns a tuple (size_list, rotation_list, rotation, orientation,
+        distribution_axis, alignment_axis). '''
+
+        pixbuf_count = len(pixbuf_list)
+        distribution_axis = constants.DISTRIBUTION_AXIS
+        alignment_axis = constants.ALIGNMENT_AXIS
+        size_list = [[pixbuf.get_width(), pixbuf.get_height()]
+                     for pixbuf in pixbuf_list]
+
+        if self.is_manga_mode:
+            orientation = constants.MANGA_ORIENTATION
+        else:
+            orientation = constants.WESTERN_ORIENTATION
+
+        # Rotation handling:
+        # - apply Exif rotation on individual images
+        # - apply automatic rotation (size based) on whole page
+        # - apply manual rotation on whole page
+        if prefs['auto rotate from exif']:
+            rotation_list = [image_tools.get_implied_rotation(pixbuf)
+                             for pixbuf in pixbuf_list]
+        else:
+            rotation_list = [0] * pixbuf_count
+        virtual_size = [0, 0]
+        for i in range(pixbuf_count):
+            if rotation_list[i] in (90, 270):
+                size_list[i].reverse()
+            size = size_list[i]
+            virtual_size[distribution_axis] += size[distribution_axis]
+            virtual_size[alignment_axis] = max(virtual_size[alignment_axis],
+                                               size[alignment_axis])
+        rotation = self._get_size_rotation(*virtual_size)
+        rotation = (rotation + prefs['rotation']) % 360
+        if rotation in (90, 270):
+            distribution_axis, alignment_axis = alignment_axis, distribution_axis
+            orientation = list(orientation)
+            orientation.reverse()
+            for i in range(pixbuf_count):
+                size_list[i].reverse()
+        if rotation in (180, 270):
+            orientation = tools.vector_opposite(orientation)
+        for i in range(pixbuf_count):
+            rotation_list[i] = (rotation_list[i] + rotation) % 360
+        if prefs['vertical flip'] and rotation in (90, 270):
+            orientation = tools.vector_opposite(orientation)
+        if prefs['horizontal flip'] and rotation in (0, 180):
+            orientation = tools.vector_opposite(orientation)
+
+        return (size_list, rotation_list, rotation, orientation,
+                distribution_axis, alignment_axis)
+
+    def _prerender_pages(self, first_index, count):
+        ''' Render the <count> pages starting at <first_index> in the
+        background, at the size they would be displayed with the current
+        zoom and viewport. Does nothing unless all pages are in cache. '''
+        viewport_size = self._render_viewport_size
+        if viewport_size is None:
+            return
+        number_of_pages = self.imagehandler.get_number_of_pages()
+        indices = [index for index in range(first_index, first_index + count)
+                   if 0 <= index < number_of_pages]
+        if not indices:
+            return
+        pixbuf_list = [self.imagehandler.get_cached_pixbuf(index)
+                       for index in indices]
+        if None in pixbuf_list:
+            return
+        size_list, rotation_list, rotation, orientation, \
+            distribution_axis, alignment_axis = \
+            self._get_pages_geometry(pixbuf_list)
+        zoom_dummy_size = list(viewport_size)
+        zoom_dummy_size[distribution_axis] = max(
+            1, zoom_dummy_size[distribution_axis] - self._spacing * (len(indices) - 1))
+        scaled_sizes = self.zoom.get_zoomed_size(
+            size_list, zoom_dummy_size, distribution_axis,
+            [image_tools.disable_transform(pixbuf) for pixbuf in pixbuf_list])
+        for index, scaled_size, page_rotation in zip(indices, scaled_sizes, rotation_list):
+            self.imagehandler.prerender_pixbuf(index, scaled_size, page_rotation)
+
+    def _get_neighbour_pages(self):
+        ''' Returns a list of (first index, count) for the pages displayed
+        before and after the current one(s). '''
+        current_page = self.imagehandler.get_current_page()
+        if not current_page:
+            return []
+        count = 2 if self.displayed_double() else 1
+        index = current_page - 1
+        return [(index + count, count), (index - count, count)]
+
+    def _prerender_neighbours(self):
+        ''' Render the pages before and after the current one(s) in the
+        background, so that flipping pages does not require scaling on the
+        UI thread. '''
+        for first_index, count in self._get_neighbour_pages():
+            self._prerender_pages(first_index, count)
+
+    def _page_cached(self, index):
+        ''' Called by the image handler once the page <index> is decoded. '''
+        for first_index, count in self._get_neighbour_pages():
+            if first_index <= index < first_index + count:
+                self._prerender_pages(first_index, count)
+
     def _update_page_information(self):
         ''' Updates the window with information that can be gathered
         even when the page pixbuf(s) aren't ready yet. '''
@@ -623,6 +714,8 @@ class MainWindow(Gtk.Window):
         if current_page <= page < (current_page + nb_pages):
             self.draw_image(scroll_to=self._last_scroll_destination)
             self._update_page_information()
+        elif not self.imagehandler.page_is_available():
+            self._update_wait_message()
 
         # Use first page as application icon when opening archives.
         if (page == 1
@@ -631,6 +724,19 @@ class MainWindow(Gtk.Window):
             pixbuf = self.imagehandler.get_thumbnail(page, 48, 48)
             self.set_icon(pixbuf)
 
+    def _update_wait_message(self):
+        ''' Show an estimation of when the current page will be available
+        in the statusbar. '''
+        current_page = self.imagehandler.get_current_page()
+        if not current_page:
+            return
+        eta = self.imagehandler.estimate_page_wait(current_page)
+        if eta is None:
+            return
+        self.statusbar.set_message(
+            _('Extracting page %(page)d, about %(seconds)d second(s) left') %
+            {'page': current_page, 'seconds': round(eta)})
+
     def _on_file_opened(self):
         self.uimanager.set_sensitivities()
         number, count = self.filehandler.get_file_number()
@@ -1040,7 +1146,7 @@ class MainWindow(Gtk.Window):
         save_dialog.set_current_name(suggested_name.encode('utf-8'))
 
         if save_dialog.run() == Gtk.ResponseType.ACCEPT and save_dialog.get_filename():
-            shutil.copy(self.imagehandler.get_path_to_page(),
+            shutil.copy(self.imagehandler.get_extracted_path_to_page(),
                         save_dialog.get_filename())
 
         save_dialog.destroy()
@@ -1145,6 +1251,10 @@ class MainWindow(Gtk.Window):
         if main_dialog._dialog is not None:
             main_dialog._dialog.close()
         backend.LibraryBackend().close()
+        reaper.join()
+        decoder.shutdown()
+        disk_page_cache.shutdown()
+        anime_tools.shutdown()
 
 
 #: Main window instance
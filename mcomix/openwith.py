@@ -73,6 +73,10 @@ class OpenWithCommand(object):
                             self.get_label())
             return
 
+        if window.filehandler.archive_type is not None:
+            # The current page may not have been extracted yet.
+            window.imagehandler.get_extracted_path_to_page()
+
         current_dir = os.getcwd()
         try:
             if self.is_valid_workdir(window):
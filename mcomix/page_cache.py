@@ -0,0 +1,193 @@
+'''page_cache.py - Memory-budgeted caches for page pixbufs.'''
+
+from collections import OrderedDict
+
+from mcomix import image_tools
+from mcomix import log
+from mcomix.lib import mt
+
+
+class PageCache(object):
+
+    ''' Cache mapping page indices to decoded pixbufs. The cache size is
+    accounted in bytes, and when the limit is exceeded, the pages farthest
+    away from the current page are evicted first, wanted pages (i.e. the
+    current and preloaded ones) never are. Hits, misses and evictions are
+    counted for display in the statusbar.
+    '''
+
+    def __init__(self, limit=0):
+        #: Cache size limit, in bytes (0 for unlimited)
+        self.limit = limit
+        #: Current page index, used as a reference for eviction
+        self.current = 0
+        #: Indices of the pages that are never evicted
+        self.wanted = frozenset()
+        #: Store page index => (pixbuf, size)
+        self._cache = {}
+        self._size = 0
+        self._lock = mt.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, index):
+        with self._lock:
+            return index in self._cache
+
+    def __len__(self):
+        with self._lock:
+            return len(self._cache)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._cache))
+
+    def __getitem__(self, index):
+        with self._lock:
+            return self._cache[index][0]
+
+    def get(self, index, default=None):
+        ''' Return the pixbuf for page <index>, or <default> if not cached. '''
+        with self._lock:
+            entry = self._cache.get(index)
+            return default if entry is None else entry[0]
+
+    def lookup(self, index):
+        ''' Same as get(), but update the hits/misses counters. '''
+        with self._lock:
+            entry = self._cache.get(index)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def __setitem__(self, index, pixbuf):
+        size = image_tools.get_pixbuf_size(pixbuf)
+        with self._lock:
+            old = self._cache.pop(index, None)
+            if old is not None:
+                self._size -= old[1]
+            self._cache[index] = (pixbuf, size)
+            self._size += size
+            self._evict(keep=index)
+
+    def __delitem__(self, index):
+        with self._lock:
+            pixbuf, size = self._cache.pop(index)
+            self._size -= size
+
+    def pop(self, index, default=None):
+        ''' Remove and return the pixbuf for page <index>, or <default>. '''
+        with self._lock:
+            entry = self._cache.pop(index, None)
+            if entry is None:
+                return default
+            self._size -= entry[1]
+            return entry[0]
+
+    @property
+    def size(self):
+        ''' Total size of the cached pixbufs, in bytes. '''
+        return self._size
+
+    def set_current(self, index, wanted=()):
+        ''' Set the current page index to <index>, and the indices of the
+        <wanted> pages, and evict pages if the limit has changed since the
+        last call. '''
+        with self._lock:
+            self.current = index
+            self.wanted = frozenset(wanted)
+            self._evict(keep=index)
+
+    def clear(self):
+        ''' Remove all pixbufs from the cache. '''
+        with self._lock:
+            self._cache.clear()
+            self._size = 0
+
+    def reset_stats(self):
+        ''' Reset hits/misses/evictions counters. '''
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def get_stats_text(self):
+        ''' Returns a short description of the cache state. '''
+        with self._lock:
+            return '{:.0f} MiB, {} pages, {} hits, {} misses, {} evicted'.format(
+                self._size / 1048576, len(self._cache),
+                self.hits, self.misses, self.evictions)
+
+    def _evict(self, keep):
+        # Must be called with the lock held.
+        if not self.limit:
+            return
+        by_distance = sorted(self._cache, reverse=True,
+                             key=lambda index: abs(index - self.current))
+        for index in by_distance:
+            if self._size <= self.limit:
+                break
+            if index in (keep, self.current) or index in self.wanted:
+                continue
+            pixbuf, size = self._cache.pop(index)
+            self._size -= size
+            self.evictions += 1
+            log.debug('Evicted page %u from cache (%u bytes)', index + 1, size)
+
+
+class RenderCache(object):
+
+    ''' Cache of pixbufs ready to be displayed (i.e. scaled, rotated,
+    flipped and enhanced), keyed by page and rendering parameters. Least
+    recently used pixbufs are evicted first, when either <maxcount> or
+    the size limit (in bytes, 0 for unlimited) is exceeded.
+    '''
+
+    def __init__(self, maxcount, limit=0):
+        assert maxcount > 0
+        self.maxcount = maxcount
+        self.limit = limit
+        #: Store key => (pixbuf, size)
+        self._cache = OrderedDict()
+        self._size = 0
+        self._lock = mt.Lock()
+
+    def get(self, key):
+        ''' Return the pixbuf for <key>, or None if not cached. '''
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            self._cache.move_to_end(key)
+            return entry[0]
+
+    def add(self, key, pixbuf):
+        ''' Add <pixbuf> to the cache for <key>. '''
+        size = image_tools.get_pixbuf_size(pixbuf)
+        with self._lock:
+            old = self._cache.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._cache[key] = (pixbuf, size)
+            self._size += size
+            while len(self._cache) > 1 and (
+                    len(self._cache) > self.maxcount or
+                    (self.limit and self._size > self.limit)):
+                old_key, (old_pixbuf, old_size) = self._cache.popitem(last=False)
+                self._size -= old_size
+
+    def remove_matching(self, predicate):
+        ''' Remove the pixbufs whose key matches <predicate>. '''
+        with self._lock:
+            for key in [key for key in self._cache if predicate(key)]:
+                pixbuf, size = self._cache.pop(key)
+                self._size -= size
+
+    def clear(self):
+        ''' Remove all pixbufs from the cache. '''
+        with self._lock:
+            self._cache.clear()
+            self._size = 0
+
+# vim: expandtab:sw=4:ts=4
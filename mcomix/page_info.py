@@ -0,0 +1,77 @@
+'''page_info.py - Page metadata read from image headers.'''
+
+import collections
+import os
+
+from mcomix import image_tools
+from mcomix import log
+from mcomix.lib import mt
+from mcomix.lib import reader
+
+#: Metadata of a page: format name, size (in pixels), Exif orientation
+#: (see image_tools.get_image_header_info) and file size (in bytes).
+PageInfo = collections.namedtuple(
+    'PageInfo', 'format width height orientation filesize')
+
+
+class PageInfoTable(object):
+
+    ''' Metadata of the pages of the current book, read in the background
+    from the image headers as the pages become available, so that their
+    size or format can be known without decoding them.
+    '''
+
+    def __init__(self):
+        #: Store page index => PageInfo
+        self._table = {}
+        self._lock = mt.Lock()
+        # Incremented by clear(), to drop the results for previous books.
+        self._generation = 0
+        self._thread = mt.ThreadPool(name=self.__class__.__name__, processes=1)
+
+    def get(self, index):
+        ''' Return the PageInfo of page <index>, or None if not known. '''
+        with self._lock:
+            return self._table.get(index)
+
+    def add(self, index, path):
+        ''' Read the metadata of page <index> from the image file at <path>
+        in the background (again, if already known). '''
+        with self._lock:
+            generation = self._generation
+        self._thread.apply_async(self._read, (index, path, generation))
+
+    def add_data(self, index, data):
+        ''' Read the metadata of page <index> from the image file content
+        <data> (i.e. for pages read directly from an archive), and return
+        it, or None if not supported. '''
+        try:
+            with reader.MemoryViewIO(data) as fio:
+                info = PageInfo(*image_tools.get_image_header_info(fio),
+                                len(data))
+        except Exception as e:
+            log.debug('Could not read header of page %u: %s', index + 1, e)
+            return None
+        with self._lock:
+            self._table[index] = info
+        return info
+
+    def clear(self):
+        ''' Forget about all pages. '''
+        with self._lock:
+            self._generation += 1
+            self._table.clear()
+
+    def _read(self, index, path, generation):
+        try:
+            filesize = os.stat(path).st_size
+            info = PageInfo(*image_tools.get_image_header_info(path), filesize)
+        except Exception as e:
+            # Not supported by PIL: the slow path will be used.
+            log.debug('Could not read header of page %u: %s', index + 1, e)
+            return
+        with self._lock:
+            if generation == self._generation:
+                self._table[index] = info
+
+# vim: expandtab:sw=4:ts=4
@@ -79,6 +79,9 @@ prefs = {
     'sharpness': 1.0,
     'auto contrast': False,
     'max pages to cache': 7,
+    'max cache size': 1024,
+    'decoded page cache': False,
+    'decoded page cache size': 2048,
     'window x': 0,
     'window y': 0,
     'window height': 600,
@@ -96,6 +99,8 @@ prefs = {
     constants.STATUS_PATH | constants.STATUS_FILENAME | constants.STATUS_FILESIZE,
     'max thumbnail threads': 3,
     'max extract threads': 1,
+    'max extraction workspace': 2048,
+    'decode in worker processes': False,
     'wrap mouse scroll': False,
     'scaling quality': 2,  # GdkPixbuf.InterpType.BILINEAR
     'escape quits': False,
@@ -107,6 +112,7 @@ prefs = {
     'animation mode': constants.ANIMATION_DISABLED,
     'animation background': False,
     'animation transform': False,
+    'animation cache size': 256,
     'temporary directory': None,
     'portable allow abspath': False,
     'osd max font size': 16,  # hard limited from 8 to 60
@@ -14,6 +14,7 @@ from mcomix import constants
 from mcomix import message_dialog
 from mcomix import keybindings
 from mcomix import keybindings_editor
+from mcomix.lib import decoder
 from mcomix.i18n import _
 
 _dialog = None
@@ -329,6 +330,11 @@ class _PreferencesDialog(Gtk.Dialog):
             'animation transform',
             _('Enable scale, rotate, flip and enhance operation on animation')))
 
+        page.add_row(Gtk.Label(label=_('Maximum memory used by animation frames (in MiB):')),
+                     self._create_pref_spinner('animation cache size',
+                                               1, 0, 65536, 16, 64, 0,
+                                               _('Set the max amount of memory used by decoded and transformed animation frames. When exceeded, the least recently shown frames are dropped, and decoded again if needed. A value of 0 means no limit.')))
+
         return page
 
     def _init_advanced_tab(self):
@@ -359,6 +365,14 @@ class _PreferencesDialog(Gtk.Dialog):
             _('Try loading FLIF files if flif_dec or flif library is found in system.\n'
               'Since the official reference is still not stable, mcomix may failed to load FLIF even if library found.')))
 
+        decode_button = self._create_pref_check_button(
+            _('Decode images in worker processes'),
+            'decode in worker processes',
+            _('Decode pages in separate processes, so that decoding big images does not slow down the interface. Uses more memory.'))
+        # Requires Python 3.8 or later.
+        decode_button.set_sensitive(decoder.is_available())
+        page.add_row(decode_button)
+
         page.new_section(_('Extraction and cache'))
 
         page.add_row(
@@ -367,6 +381,12 @@ class _PreferencesDialog(Gtk.Dialog):
                 'max extract threads', 1, 0, constants.CPU_COUNT, 1, 4, 0,
                 _('Set the maximum number of concurrent threads for formats that support it (0 to use all available cores).')))
 
+        page.add_row(
+            Gtk.Label(label=_('Maximum disk space used by extracted files (in MiB):')),
+            self._create_pref_spinner(
+                'max extraction workspace', 1, 0, 1048576, 64, 1024, 0,
+                _('Set the max amount of disk space used by the files extracted from the current archive. When exceeded, the files farthest from the current page are removed, and extracted again if needed. A value of 0 means no limit.')))
+
         page.add_row(self._create_pref_check_button(
             _('Store thumbnails for opened files'),
             'create thumbnails',
@@ -381,6 +401,21 @@ class _PreferencesDialog(Gtk.Dialog):
                                                1, -1, 500, 1, 3, 0,
                                                _('Set the max number of pages to cache. A value of -1 will cache the entire archive.')))
 
+        page.add_row(Gtk.Label(label=_('Maximum memory used by the cache (in MiB):')),
+                     self._create_pref_spinner('max cache size',
+                                               1, 0, 65536, 64, 256, 0,
+                                               _('Set the max amount of memory used by decoded pages. When exceeded, the pages farthest from the current one are dropped first. A value of 0 means no limit.')))
+
+        page.add_row(self._create_pref_check_button(
+            _('Store decoded pages on disk'),
+            'decoded page cache',
+            _('Keep decoded pages in the cache directory, so that reopening a book does not require extracting and decoding its pages again.')))
+
+        page.add_row(Gtk.Label(label=_('Maximum size of the decoded page cache (in MiB):')),
+                     self._create_pref_spinner('decoded page cache size',
+                                               1, 64, 1048576, 64, 1024, 0,
+                                               _('Set the max amount of disk space used by decoded pages. Least recently used pages are removed first.')))
+
         if sys.platform == 'linux':
             page.add_row(self._create_pref_check_button(
                 _('Mount tar and squashfs.'),
@@ -908,7 +943,7 @@ class _PreferencesDialog(Gtk.Dialog):
             self._window.thumbnailsidebar.resize()
             self._window.draw_image()
 
-        elif preference == 'max pages to cache':
+        elif preference in ('max pages to cache', 'max cache size'):
             prefs[preference] = int(value)
             self._window.imagehandler.do_cacheing()
 
@@ -920,7 +955,9 @@ class _PreferencesDialog(Gtk.Dialog):
             prefs[preference] = int(value)
             self._window.change_zoom_mode()
 
-        elif preference in ('max extract threads', 'max thumbnail threads'):
+        elif preference in ('max extract threads', 'max thumbnail threads',
+                            'max extraction workspace',
+                            'decoded page cache size', 'animation cache size'):
             prefs[preference] = int(value)
 
         elif preference == 'osd max font size':
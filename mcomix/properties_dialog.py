@@ -77,7 +77,7 @@ class _PropertiesDialog(Gtk.Dialog):
         # In case it's not ready yet, bump the cover extraction
         # in front of the queue.
         path = window.imagehandler.get_path_to_page(1)
-        if path is not None:
+        if path is not None and not window.filehandler.can_read_file():
             window.filehandler._ask_for_files([path])
         self._update_page_image(page, 1)
         filename = window.filehandler.get_pretty_current_filename()
@@ -100,7 +100,7 @@ class _PropertiesDialog(Gtk.Dialog):
         if not window.imagehandler.page_is_available():
             return
         self._update_page_image(page)
-        path = window.imagehandler.get_path_to_page()
+        path = window.imagehandler.get_extracted_path_to_page()
         filename = os.path.basename(path)
         page.set_filename(filename)
         width, height = window.imagehandler.get_size()
@@ -0,0 +1,39 @@
+'''reaper.py - Background removal of temporary directories.'''
+
+from mcomix import log
+from mcomix.lib import mt
+
+#: Filled on-demand by _get_pool()
+_pool = None
+
+
+def _get_pool():
+    global _pool
+
+    if _pool is None:
+        _pool = mt.ThreadPool(name='Reaper', processes=1)
+    return _pool
+
+
+def cleanup(tempdir):
+    ''' Remove the tempfile.TemporaryDirectory <tempdir> in the background,
+    so that closing an archive does not wait on the removal of all the files
+    extracted from it. '''
+    _get_pool().apply_async(tempdir.cleanup, error_callback=_cleanup_errcb)
+
+
+def join():
+    ''' Wait for pending removals to finish (e.g. before exiting). '''
+    global _pool
+
+    if _pool is None:
+        return
+    _pool.close()
+    _pool.join()
+    _pool = None
+
+
+def _cleanup_errcb(name, etype, value, tb):
+    log.warning('Failed to remove temporary directory: %s', value)
+
+# vim: expandtab:sw=4:ts=4
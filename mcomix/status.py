@@ -17,7 +17,7 @@ class Statusbar(Gtk.EventBox):
 
         self._loading = True
 
-        # Status text, page number, file number, resolution, path, filename, filesize
+        # Status text, page number, file number, resolution, path, filename, filesize, cache
         self.status = Gtk.Statusbar()
         self.add(self.status)
 
@@ -33,6 +33,7 @@ class Statusbar(Gtk.EventBox):
                 <menuitem action="rootpath" />
                 <menuitem action="filename" />
                 <menuitem action="filesize" />
+                <menuitem action="cacheinfo" />
             </popup>
         </ui>
         '''
@@ -51,6 +52,8 @@ class Statusbar(Gtk.EventBox):
             ('filename', None, _('Show filename'), None, None,
              self.toggle_status_visibility),
             ('filesize', None, _('Show filesize'), None, None,
+             self.toggle_status_visibility),
+            ('cacheinfo', None, _('Show cache usage'), None, None,
              self.toggle_status_visibility)])
         self.ui_manager.insert_action_group(actiongroup, 0)
 
@@ -65,6 +68,7 @@ class Statusbar(Gtk.EventBox):
         self._root = ''
         self._filename = ''
         self._filesize = ''
+        self._cache_info = ''
         self._update_sensitivity()
         self.show_all()
 
@@ -120,6 +124,10 @@ class Statusbar(Gtk.EventBox):
             size = ''
         self._filesize = size
 
+    def set_cache_info(self, info):
+        '''Update the page cache usage.'''
+        self._cache_info = info
+
     def update(self):
         '''Set the statusbar to display the current state.'''
 
@@ -147,6 +155,7 @@ class Statusbar(Gtk.EventBox):
             (constants.STATUS_PATH, self._root),
             (constants.STATUS_FILENAME, self._filename),
             (constants.STATUS_FILESIZE, self._filesize),
+            (constants.STATUS_CACHE, self._cache_info),
         ]
         p = prefs['statusbar fields']
 
@@ -166,6 +175,7 @@ class Statusbar(Gtk.EventBox):
             'filename': constants.STATUS_FILENAME,
             'filenumber': constants.STATUS_FILENUMBER,
             'filesize': constants.STATUS_FILESIZE,
+            'cacheinfo': constants.STATUS_CACHE,
         }
 
         bit = names[action.get_name()]
@@ -196,6 +206,7 @@ class Statusbar(Gtk.EventBox):
             'rootpath': p & constants.STATUS_PATH,
             'filename': p & constants.STATUS_FILENAME,
             'filesize': p & constants.STATUS_FILESIZE,
+            'cacheinfo': p & constants.STATUS_CACHE,
         }
 
         for n, v in names.items():
@@ -23,7 +23,6 @@ from mcomix import log
 from mcomix import mimetypes
 from mcomix import portability
 from mcomix import tools
-from mcomix.lib import reader
 from mcomix.preferences import prefs
 from mcomix.i18n import _
 
@@ -231,14 +230,14 @@ class Thumbnailer(object):
             if os.path.isfile(thumbpath):
                 # Check the thumbnail's stored mTime
                 try:
-                    with reader.LockedFileIO(thumbpath) as fio:
-                        with Image.open(fio) as img:
-                            info = img.info
-                            stored_mtime = float(info['Thumb::MTime'])
-                            # The source file might no longer exist
-                            file_mtime = os.path.isfile(filepath) and os.stat(filepath).st_mtime or stored_mtime
-                            return stored_mtime == file_mtime and \
-                                max(*img.size) == max(self.width, self.height)
+                    # Only the header is needed.
+                    with Image.open(thumbpath) as img:
+                        info = img.info
+                        stored_mtime = float(info['Thumb::MTime'])
+                        # The source file might no longer exist
+                        file_mtime = os.path.isfile(filepath) and os.stat(filepath).st_mtime or stored_mtime
+                        return stored_mtime == file_mtime and \
+                            max(*img.size) == max(self.width, self.height)
                 except IOError:
                     return False
             else:
@@ -149,6 +149,18 @@ def get_thumbnails_directory():
     return os.path.join(prefix, 'thumbnails/normal')
 
 
+def get_cache_directory():
+    '''Return the path to the mcomix cache directory.
+    It is get_home_directory()/.cache/mcomix if in portable mode.
+    If not in portable mode, it will be $XDG_CACHE_HOME/mcomix,
+    or get_home_directory()/.cache/mcomix if $XDG_CACHE_HOME is empty.
+    '''
+    prefix = os.path.join(get_home_directory(), '.cache')
+    if not is_portable_mode():
+        prefix = os.environ.get('XDG_CACHE_HOME', prefix)
+    return os.path.join(prefix, 'mcomix')
+
+
 def number_of_digits(n):
     if 0 == n:
         return 1
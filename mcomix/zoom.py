@@ -30,6 +30,12 @@ class ZoomModel(object):
             raise ValueError('No fit mode for id %d.' % fitmode)
         self._fitmode = fitmode
 
+    def get_fit_mode(self):
+        return self._fitmode
+
+    def is_identity_user_zoom(self):
+        return self._user_zoom_log == IDENTITY_ZOOM_LOG
+
     def get_scale_up(self):
         return self._scale_up
 
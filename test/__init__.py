@@ -73,15 +73,19 @@ class MComixTest(unittest.TestCase):
         prefs.update(default_prefs)
 
     def tearDown(self):
-        if hasattr(self, '_outcome'):  # Python 3.4+
+        if hasattr(self, '_feedErrorsToResult'):  # Python 3.4 - 3.10
             result = self.defaultTestResult()  # these 2 methods have no side effects
             if self._outcome is not None:
                 self._feedErrorsToResult(result, self._outcome.errors)
+        elif hasattr(self, '_outcome'):  # Python 3.11+
+            result = self._outcome
         else:  # Python 3.2 - 3.3 or 3.0 - 3.1 and 2.7
             result = getattr(self, '_outcomeForDoCleanups', self._resultForDoCleanups)
 
         if result is None:
             ok = False
+        elif result is getattr(self, '_outcome', None):
+            ok = result.success
         else:
             error = self.list2reason(result.errors)
             failure = self.list2reason(result.failures)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+''' Micro-benchmark of the PIL <-> GdkPixbuf conversions of image_tools,
+for all the image modes covered by test_image_tools.
+
+Run with: python -m test.benchmark_image_tools [WIDTH HEIGHT [REPEAT]]
+'''
+
+import sys
+import timeit
+
+from PIL import Image
+
+from mcomix import tools
+tools.nogui()
+from mcomix import image_tools
+from .test_image_tools import _IMAGE_MODES
+
+
+def main(width=6000, height=4000, repeat=5):
+    size = (width, height)
+    print('{} x {} pixels, best of {}:'.format(width, height, repeat))
+    print('{:6} {:>14} {:>14}'.format('mode', 'pil_to_pixbuf', 'pixbuf_to_pil'))
+    for can_save_to_png, gdk_mode, pil_mode in _IMAGE_MODES:
+        im = Image.new(pil_mode, size)
+        pixbuf = image_tools.pil_to_pixbuf(im)
+        assert gdk_mode == ('RGBA' if pixbuf.get_has_alpha() else 'RGB')
+        to_pixbuf = min(timeit.repeat(lambda: image_tools.pil_to_pixbuf(im),
+                                      number=1, repeat=repeat))
+        to_pil = min(timeit.repeat(lambda: image_tools.pixbuf_to_pil(pixbuf).load(),
+                                   number=1, repeat=repeat))
+        print('{:6} {:12.1f}ms {:12.1f}ms'.format(pil_mode, to_pixbuf * 1000,
+                                                 to_pil * 1000))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
+
+# vim: expandtab:sw=4:ts=4
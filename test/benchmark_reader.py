@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+''' Benchmark of lib.reader: time to fill the thumbnail bar of a book
+(i.e. read and thumbnail all its pages with a pool of threads), with the
+former reader (a single lock for all the reads in the process) and with
+the current one.
+
+Run with: python -m test.benchmark_reader [PAGES [THREADS [DIRECTORY]]]
+
+The book is created in a temporary directory under DIRECTORY: the
+difference is most visible on slow storage (e.g. a network mount), as
+the pages read from the page cache are mostly decoding-bound.
+'''
+
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing.dummy import Pool
+
+from PIL import Image
+
+from mcomix.lib import reader
+
+_lock = threading.Lock()
+
+
+class GlobalLockFileIO(io.BytesIO):
+    # The former reader.
+    def __init__(self, path):
+        with _lock:
+            with open(path, mode='rb') as f:
+                super().__init__(f.read())
+
+
+def thumbnail(args):
+    file_io, path = args
+    with file_io(path) as fio:
+        with Image.open(fio) as im:
+            im.thumbnail((128, 128), resample=Image.BOX)
+
+
+def fill(file_io, paths, threads):
+    start = time.monotonic()
+    with Pool(threads) as pool:
+        pool.map(thumbnail, [(file_io, path) for path in paths])
+    return time.monotonic() - start
+
+
+def main(pages=1000, threads=3, directory=None):
+    with tempfile.TemporaryDirectory(prefix='mcomix.benchmark.',
+                                     dir=directory) as tmpdir:
+        page = Image.effect_noise((1200, 1800), 64).convert('RGB')
+        paths = []
+        for n in range(pages):
+            path = os.path.join(tmpdir, '{:04}.jpg'.format(n))
+            page.save(path, quality=90)
+            paths.append(path)
+        print('{} pages, {} threads:'.format(pages, threads))
+        for name, file_io in (
+            ('global lock', GlobalLockFileIO),
+            ('FileReader', reader.FileReader),
+        ):
+            print('{:12} {:8.2f}s'.format(name, fill(file_io, paths, threads)))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*map(int, args[:2]), *args[2:3])
+
+# vim: expandtab:sw=4:ts=4
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import io
+from unittest import mock
+
+from PIL import Image
+
+from mcomix import tools
+tools.nogui()
+from mcomix import anime_tools
+from mcomix import constants
+from mcomix import image_tools
+from mcomix.preferences import prefs
+from . import MComixTest
+
+
+class _Frame(object):
+
+    def __init__(self, index, ops=()):
+        self.index = index
+        self.ops = ops
+
+    def __eq__(self, other):
+        return (self.index, self.ops) == (other.index, other.ops)
+
+    def __repr__(self):
+        return '_Frame(%r, %r)' % (self.index, self.ops)
+
+
+def _pil_to_pixbuf(im):
+    return _Frame(im.tell())
+
+
+def _transform(frame, *args, **kwargs):
+    return _Frame(frame.index, frame.ops + ((args, kwargs),))
+
+
+#: Duration of each frame, as saved and as played (in milliseconds).
+_DURATIONS = (50, 5, 200)
+_DELAYS = (50, 100, 200)
+
+
+def _gif():
+    frames = [Image.new('RGB', (4, 4), color) for color in
+              ((255, 0, 0), (0, 255, 0), (0, 0, 255))]
+    fp = io.BytesIO()
+    frames[0].save(fp, 'GIF', save_all=True, append_images=frames[1:],
+                   duration=list(_DURATIONS), loop=0)
+    return fp.getvalue()
+
+
+class _Image(object):
+
+    def __init__(self):
+        self.pixbuf = None
+
+    def set_from_pixbuf(self, pixbuf):
+        self.pixbuf = pixbuf
+
+    def get_pixbuf(self):
+        return self.pixbuf
+
+    def get_visible(self):
+        return True
+
+
+class _Thread(object):
+
+    def apply_async(self, func, args=()):
+        func(*args)
+
+
+class AnimationTest(MComixTest):
+
+    def setUp(self):
+        super(AnimationTest, self).setUp()
+        for name, new in (
+            ('pil_to_pixbuf', mock.Mock(side_effect=_pil_to_pixbuf)),
+            ('get_pixbuf_size', lambda pixbuf: 1),
+        ):
+            patcher = mock.patch.object(image_tools, name, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        prefs['animation mode'] = constants.ANIMATION_NORMAL
+        anime_tools.clear_cache()
+        self.animation = anime_tools.Animation(
+            anime_tools.FrameSource(_gif(), len(_DURATIONS), loop=0))
+
+    def test_frames(self):
+        self.assertEqual(self.animation.n_frames, 3)
+        self.assertEqual(self.animation.loop, 0)
+        for index in (0, 1, 2, 0):
+            self.assertEqual(self.animation.get_frame(index),
+                             (_Frame(index), _DELAYS[index]))
+        self.assertEqual(self.animation.get_static_image(), _Frame(0))
+        # Frames are only decoded once.
+        self.assertEqual(image_tools.pil_to_pixbuf.call_count, 3)
+        anime_tools.clear_cache()
+        self.animation.get_frame(1)
+        self.assertEqual(image_tools.pil_to_pixbuf.call_count, 4)
+
+    def test_transform(self):
+        # Transforms are disabled by default.
+        self.assertIs(self.animation.transform(_transform, 1), self.animation)
+        prefs['animation transform'] = True
+        transformed = self.animation.transform(_transform, [1, 2], key='value')
+        transformed = transformed.transform(_transform, 3)
+        ops = ((((1, 2),), {'key': 'value'}), ((3,), {}))
+        for index in (2, 1, 0):
+            self.assertEqual(transformed.get_frame(index),
+                             (_Frame(index, ops), _DELAYS[index]))
+        # The original frames are not modified, and shared.
+        self.assertEqual(self.animation.get_frame(1), (_Frame(1), _DELAYS[1]))
+        self.assertEqual(image_tools.pil_to_pixbuf.call_count, 3)
+
+    @mock.patch.object(anime_tools, '_get_thread', _Thread)
+    @mock.patch.object(anime_tools, 'GLib')
+    def test_player(self, GLib):
+        prefs['animation mode'] = constants.ANIMATION_ONCE
+        animation = anime_tools.Animation(
+            anime_tools.FrameSource(_gif(), len(_DURATIONS)))
+        image = _Image()
+        anime_tools.play(image, animation)
+        for index in (0, 1, 2):
+            self.assertEqual(image.pixbuf, _Frame(index))
+            if index == 2:
+                break
+            GLib.timeout_add.assert_called_with(_DELAYS[index], mock.ANY)
+            frame_due = GLib.timeout_add.call_args[0][1]
+            frame_ready, *args = GLib.idle_add.call_args[0]
+            frame_ready(*args)
+            self.assertEqual(image.pixbuf, _Frame(index))
+            frame_due()
+        # Played once, each frame delay being started before the next
+        # frame is decoded.
+        self.assertEqual([call[0] for call in GLib.method_calls],
+                         ['timeout_add', 'idle_add'] * 2)
+
+    def test_shutdown(self):
+        anime_tools.shutdown()
+        thread = anime_tools._get_thread()
+        self.assertEqual(thread.apply_async(sum, ((1, 2),)).get(), 3)
+        anime_tools.shutdown()
+        self.assertTrue(thread.closed)
+        # Started again if needed.
+        self.assertIsNot(anime_tools._get_thread(), thread)
+        anime_tools.shutdown()
+
+# vim: expandtab:sw=4:ts=4
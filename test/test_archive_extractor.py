@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import time
+from unittest import mock
+
+from mcomix import tools
+tools.nogui()
+from mcomix import archive_extractor
+from mcomix import archive_index
+from mcomix import archive_tools
+from mcomix import constants
+from . import MComixTest
+
+
+class _SolidArchive(object):
+
+    ''' Solid archive: files can only be extracted in a single pass,
+    in archive order. '''
+
+    support_concurrent_extractions = False
+    support_memory_extraction = False
+    support_batch_extraction = False
+    is_encrypted = False
+
+    def __init__(self, destdir, names):
+        self.destdir = destdir
+        self.names = names
+        self.written = []
+
+    def is_solid(self):
+        return True
+
+    def iter_contents(self):
+        return iter(self.names)
+
+    def list_contents(self):
+        return self.names[:]
+
+    def set_target_size(self, size):
+        return []
+
+    def iter_extract(self, entries, destination_dir, skip=None):
+        for name in self.names:
+            if name not in entries:
+                continue
+            if skip is not None and skip(name):
+                continue
+            self.written.append(name)
+            yield name
+
+    def close(self):
+        pass
+
+
+class ExtractorTest(MComixTest):
+
+    def setUp(self):
+        super(ExtractorTest, self).setUp()
+        self.names = ['%02u.png' % n for n in range(60)]
+        self.archive = _SolidArchive(self.tmp_dir, self.names)
+        for obj, name, new in (
+            (archive_tools, 'get_recursive_archive_handler',
+             lambda *args, **kwargs: self.archive),
+            (archive_index, 'get_archive_index', mock.Mock()),
+        ):
+            patcher = mock.patch.object(obj, name, new)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        archive_index.get_archive_index.return_value.load.return_value = None
+        self.extractor = archive_extractor.Extractor()
+        self.addCleanup(self.extractor.close)
+        self.condition = self.extractor.setup('book.cbr', mime=constants.RAR)
+        # Listed in the background.
+        for n in range(500):
+            if self.extractor.get_files() is not None:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.extractor.get_files(), self.names)
+        self.extractor.set_reading_order(self.names)
+
+    def _wait(self, name):
+        with self.condition:
+            self.assertTrue(self.condition.wait_for(
+                lambda: self.extractor.is_ready(name), timeout=5))
+
+    def test_solid_pass(self):
+        self.extractor.set_files(self.names)
+        self.extractor.set_wanted(self.names[:3])
+        self.extractor.extract()
+        self._wait(self.names[-1])
+        # Nothing to pass over: read ahead up to the end.
+        self.assertEqual(self.archive.written, self.names)
+
+    def test_solid_pass_far_page(self):
+        wanted = self.names[40:43]
+        self.extractor.set_files(wanted + self.names[:40] + self.names[43:])
+        self.extractor.set_wanted(wanted)
+        self.extractor.extract()
+        self._wait(self.names[-1])
+        self.extractor.stop()
+        # Files passed over on the way to the wanted files are not written,
+        # except those near them, and not extracted by another pass.
+        near = 40 - archive_extractor._KEEP_DISTANCE + 1
+        self.assertEqual(self.archive.written, self.names[near:])
+        self.assertEqual(self.extractor.get_stats()['pending'], near)
+        self.assertFalse(self.extractor.is_ready(self.names[0]))
+
+# vim: expandtab:sw=4:ts=4
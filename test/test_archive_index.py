@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+import zipfile
+from unittest import mock
+
+from mcomix import tools
+tools.nogui()
+from mcomix import archive_index
+from mcomix import archive_tools
+from mcomix import constants
+from mcomix import image_tools
+from mcomix.preferences import prefs
+from . import MComixTest
+
+
+def _is_image_file(path):
+    return os.path.splitext(path)[1] in ('.png', '.jpg')
+
+
+# Supported image formats depend on the GdkPixbuf loaders installed.
+@mock.patch.object(image_tools, 'is_image_file', _is_image_file)
+class ArchiveIndexTest(MComixTest):
+
+    def setUp(self):
+        super(ArchiveIndexTest, self).setUp()
+        self.index = archive_index.ArchiveIndex(
+            os.path.join(self.tmp_dir, 'listings'))
+        self.path = os.path.join(self.tmp_dir, 'book.cbz')
+        self.members = ['01.png', '02.jpg', 'info.txt', 'data.bin']
+        with zipfile.ZipFile(self.path, 'w') as zf:
+            for name in self.members:
+                zf.writestr(name, name)
+
+    def _open(self):
+        archive = archive_tools.get_recursive_archive_handler(
+            self.path, constants.ZIP)
+        self.addCleanup(archive.close)
+        return archive
+
+    def _store(self):
+        archive = self._open()
+        self.assertEqual(archive.list_contents(),
+                         [os.path.join(archive.destdir, 'main_archive', name)
+                          for name in self.members])
+        self.index.store(self.path, constants.ZIP, archive)
+
+    def test_store_load(self):
+        self.assertIsNone(self.index.load(self.path))
+        self._store()
+        entry = self.index.load(self.path)
+        self.assertEqual(entry['path'], os.path.abspath(self.path))
+        self.assertEqual(entry['mime'], constants.ZIP)
+        self.assertFalse(entry['solid'])
+        self.assertFalse(entry['encrypted'])
+        self.assertEqual(entry['members'], self.members)
+        self.assertEqual(entry['images'], ['01.png', '02.jpg'])
+        self.assertEqual(entry['comments'], ['info.txt'])
+        # The listing can be restored in a new handler.
+        archive = self._open()
+        self.assertTrue(archive.set_listing(entry['listing']))
+        self.assertEqual(archive.get_members(), self.members)
+        self.assertEqual(archive.read(archive.list_contents()[1]), b'02.jpg')
+
+    def test_comment_extensions(self):
+        self._store()
+        prefs['comment extensions'] = ['bin']
+        self.assertEqual(self.index.load(self.path)['comments'], ['data.bin'])
+
+    def test_modified_archive(self):
+        self._store()
+        with zipfile.ZipFile(self.path, 'a') as zf:
+            zf.writestr('03.png', '03.png')
+        os.utime(self.path, ns=(0, 0))
+        self.assertIsNone(self.index.load(self.path))
+        self.assertIsNone(self.index.load(self.path + '.missing'))
+
+    def test_invalid_entry(self):
+        self._store()
+        entry_path = self.index._get_path(self.index.get_key(self.path))
+        with open(entry_path, 'w') as fp:
+            fp.write('{"version": ')
+        self.assertIsNone(self.index.load(self.path))
+        # Invalid entries are removed.
+        self.assertFalse(os.path.exists(entry_path))
+
+    def test_prune(self):
+        paths = []
+        for n in range(3):
+            path = os.path.join(self.tmp_dir, '%u.cbz' % n)
+            with zipfile.ZipFile(path, 'w') as zf:
+                zf.writestr('01.png', '01.png')
+            paths.append(path)
+        archive = self._open()
+        archive.list_contents()
+        old_max_entries = archive_index._MAX_ENTRIES
+        archive_index._MAX_ENTRIES = 2
+        try:
+            for n, path in enumerate(paths):
+                self.index.store(path, constants.ZIP, archive)
+                entry_path = self.index._get_path(self.index.get_key(path))
+                os.utime(entry_path, (n, n))
+        finally:
+            archive_index._MAX_ENTRIES = old_max_entries
+        # The least recently used entry was removed.
+        self.assertIsNone(self.index.load(paths[0]))
+        self.assertIsNotNone(self.index.load(paths[1]))
+        self.assertIsNotNone(self.index.load(paths[2]))
+
+# vim: expandtab:sw=4:ts=4
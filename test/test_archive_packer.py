@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+import zipfile
+import zlib
+
+from mcomix import tools
+tools.nogui()
+from mcomix import archive_packer
+from . import MComixTest
+
+
+class PackerTest(MComixTest):
+
+    def _write(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        return path
+
+    def _pack(self, image_files, other_files, base_name='book'):
+        archive_path = os.path.join(self.tmp_dir, 'book.cbz')
+        packer = archive_packer.Packer(image_files, other_files,
+                                       archive_path, base_name)
+        packer.pack()
+        self.assertTrue(packer.wait())
+        return archive_path
+
+    def test_pack(self):
+        # Not compressible.
+        noise = os.urandom(20000)
+        contents = {
+            'a.png': b'\0' * 20000,
+            'b.bmp': b'\0' * 20000,
+            'c.bmp': noise,
+            'info.txt': b'comment\n' * 1000,
+            'été.nfo': b'',
+        }
+        paths = {name: self._write(name, data) for name, data in contents.items()}
+        archive_path = self._pack(
+            [paths['a.png'], paths['b.bmp'], paths['c.bmp']],
+            [paths['info.txt'], paths['été.nfo']], base_name='Book')
+        expected = [
+            # Already compressed format: stored as is.
+            ('1 - Book.png', 'a.png', zipfile.ZIP_STORED),
+            ('2 - Book.bmp', 'b.bmp', zipfile.ZIP_DEFLATED),
+            # Deflate would not make it smaller.
+            ('3 - Book.bmp', 'c.bmp', zipfile.ZIP_STORED),
+            ('info.txt', 'info.txt', zipfile.ZIP_DEFLATED),
+            ('été.nfo', 'été.nfo', zipfile.ZIP_STORED),
+        ]
+        with zipfile.ZipFile(archive_path) as zf:
+            self.assertIsNone(zf.testzip())
+            infos = zf.infolist()
+            self.assertEqual([info.filename for info in infos],
+                             [arcname for arcname, name, compress_type in expected])
+            for info, (arcname, name, compress_type) in zip(infos, expected):
+                data = contents[name]
+                self.assertEqual(info.compress_type, compress_type, msg=arcname)
+                self.assertEqual(info.file_size, len(data), msg=arcname)
+                self.assertEqual(info.CRC, zlib.crc32(data), msg=arcname)
+                self.assertEqual(zf.read(info), data, msg=arcname)
+        # No temporary file left behind.
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         sorted(['book.cbz', 'home', 'tmp'] + list(contents)))
+
+    def test_name_clash(self):
+        image = self._write('a.png', b'image')
+        other_dir = os.path.join(self.tmp_dir, 'other')
+        os.mkdir(other_dir)
+        other = os.path.join(other_dir, '1 - book.png')
+        with open(other, 'wb') as fp:
+            fp.write(b'other')
+        archive_path = self._pack([image], [other])
+        with zipfile.ZipFile(archive_path) as zf:
+            self.assertEqual(zf.namelist(), ['1 - book.png', '_1 - book.png'])
+            self.assertEqual(zf.read('_1 - book.png'), b'other')
+
+    def test_replace(self):
+        archive_path = self._write('book.cbz', b'old')
+        os.chmod(archive_path, 0o640)
+        image = self._write('a.png', b'image')
+        self._pack([image], [])
+        self.assertEqual(os.stat(archive_path).st_mode & 0o777, 0o640)
+        with zipfile.ZipFile(archive_path) as zf:
+            self.assertEqual(zf.read('1 - book.png'), b'image')
+
+# vim: expandtab:sw=4:ts=4
@@ -1,11 +1,18 @@
 
 from __future__ import absolute_import
+import io
 import os
+import struct
+import tarfile
+import zipfile
+from unittest import mock
 
 from mcomix import tools
 tools.nogui()
 from mcomix import archive_tools
 from mcomix import constants
+from mcomix.archive import rar
+from mcomix.archive import sevenzip_external
 from . import MComixTest, get_testfile_path
 
 
@@ -56,3 +63,173 @@ class ArchiveToolsTest(MComixTest):
                    )
             )
             self.assertEqual(archive_type, expected_type, msg=msg)
+
+
+class SniffMimeTypeTest(MComixTest):
+
+    def _write(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        return path
+
+    def _zip(self, compress_type=zipfile.ZIP_DEFLATED):
+        fp = io.BytesIO()
+        with zipfile.ZipFile(fp, 'w', compress_type) as zf:
+            zf.writestr('01.png', b'\0' * 1000)
+            zf.writestr('02.png', b'\1' * 1000)
+        return fp.getvalue()
+
+    def _tar(self, mode='w'):
+        fp = io.BytesIO()
+        with tarfile.open(fileobj=fp, mode=mode) as tf:
+            info = tarfile.TarInfo('01.png')
+            info.size = 1000
+            tf.addfile(info, io.BytesIO(b'\0' * 1000))
+        return fp.getvalue()
+
+    def assertMimeType(self, name, data, mime):
+        path = self._write(name, data)
+        self.assertEqual(archive_tools.archive_mime_type(path), mime, msg=name)
+
+    def test_zip(self):
+        self.assertMimeType('stored.zip', self._zip(zipfile.ZIP_STORED), constants.ZIP)
+        self.assertMimeType('deflated.zip', self._zip(), constants.ZIP)
+        # Data prepended to the archive, e.g. self-extracting.
+        self.assertMimeType('sfx.zip', b'MZ' + b'\0' * 1000 + self._zip(), constants.ZIP)
+
+    def test_zip_unsupported(self):
+        # Members compressed with a method zipfile does not support.
+        data = bytearray(self._zip())
+        pos = data.find(zipfile.stringCentralDir)
+        while pos != -1:
+            struct.pack_into('<H', data, pos + 10, 98)
+            pos = data.find(zipfile.stringCentralDir, pos + 1)
+        self.assertMimeType('ppmd.zip', bytes(data), constants.ZIP_EXTERNAL)
+
+    def test_tar(self):
+        self.assertMimeType('book.tar', self._tar(), constants.TAR)
+        self.assertMimeType('book.tar.gz', self._tar('w:gz'), constants.GZIP)
+        self.assertMimeType('book.tar.bz2', self._tar('w:bz2'), constants.BZIP2)
+        self.assertMimeType('book.tar.xz', self._tar('w:xz'), constants.XZ)
+
+    def test_magic(self):
+        with mock.patch.object(sevenzip_external, 'is_7z_support_rar', return_value=True):
+            self.assertMimeType('book.rar', b'Rar!\x1a\x07\x00' + b'\0' * 100, constants.RAR)
+        with mock.patch.object(sevenzip_external, 'is_7z_support_rar', return_value=False):
+            self.assertMimeType('book5.rar', b'Rar!\x1a\x07\x01\x00' + b'\0' * 100, constants.RAR5)
+        self.assertMimeType('book.7z', b'7z\xbc\xaf\x27\x1c' + b'\0' * 100, constants.SEVENZIP)
+        self.assertMimeType('book.lha', b'\x00\x00-lh5-' + b'\0' * 100, constants.LHA)
+        self.assertMimeType('book.pdf', b'%PDF-1.4\n', constants.PDF)
+        self.assertMimeType('book.sqsh', b'hsqs' + b'\0' * 100, constants.SQUASHFS)
+
+    def test_truncated(self):
+        zip_data = self._zip()
+        # Without the end of central directory record.
+        self.assertMimeType('truncated.zip', zip_data[:len(zip_data) // 2], None)
+        # The central directory is cut short.
+        self.assertMimeType('truncated_cd.zip', zip_data[:-30] + zip_data[-22:], None)
+        self.assertMimeType('truncated.tar', self._tar()[:100], None)
+        self.assertMimeType('truncated.tar.gz', self._tar('w:gz')[:10], None)
+        self.assertMimeType('truncated.tar.bz2', self._tar('w:bz2')[:10], None)
+        self.assertMimeType('empty.cbz', b'', None)
+
+    def test_garbage(self):
+        self.assertMimeType('garbage.cbz', bytes(range(256)) * 8, None)
+        self.assertMimeType('zeros.cbz', b'\0' * 4096, None)
+        # Compressed data that is not a tar archive.
+        self.assertMimeType('not_tar.gz', b'\x1f\x8b\x08' + b'\0' * 100, None)
+        self.assertMimeType('not_tar.bz2', b'BZh9' + b'\0' * 100, None)
+        self.assertIsNone(archive_tools.archive_mime_type(self.tmp_dir))
+        self.assertIsNone(archive_tools.archive_mime_type(
+            os.path.join(self.tmp_dir, 'missing.cbz')))
+
+    def test_is_tar_header(self):
+        data = self._tar()
+        self.assertTrue(archive_tools._is_tar_header(data[:tarfile.BLOCKSIZE]))
+        self.assertTrue(archive_tools._is_tar_header(data[:archive_tools._SNIFF_SIZE]))
+        self.assertFalse(archive_tools._is_tar_header(data[:100]))
+        self.assertFalse(archive_tools._is_tar_header(b''))
+        self.assertFalse(archive_tools._is_tar_header(b'\0' * tarfile.BLOCKSIZE))
+        # Bad checksum.
+        header = bytearray(data[:tarfile.BLOCKSIZE])
+        header[0] ^= 1
+        self.assertFalse(archive_tools._is_tar_header(bytes(header)))
+
+    def test_sniff_zip(self):
+        self.assertTrue(archive_tools._sniff_zip(io.BytesIO(self._zip())))
+        self.assertIsNone(archive_tools._sniff_zip(io.BytesIO(self._tar())))
+        self.assertIsNone(archive_tools._sniff_zip(io.BytesIO(b'')))
+        # Bad central directory signature.
+        data = self._zip().replace(zipfile.stringCentralDir, b'PK\0\0')
+        self.assertRaises(zipfile.BadZipFile, archive_tools._sniff_zip, io.BytesIO(data))
+
+
+class NestedArchiveTest(MComixTest):
+
+    def setUp(self):
+        super(NestedArchiveTest, self).setUp()
+        fp = io.BytesIO()
+        with zipfile.ZipFile(fp, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name in ('a.png', 'b.png'):
+                zf.writestr(name, name * 100)
+        self.path = os.path.join(self.tmp_dir, 'book.cbz')
+        with zipfile.ZipFile(self.path, 'w') as zf:
+            zf.writestr('01.png', '01.png')
+            zf.writestr('ch1.zip', fp.getvalue(), zipfile.ZIP_STORED)
+            zf.writestr('99.png', '99.png')
+
+    def test_stored_sub_archive(self):
+        archive = archive_tools.get_recursive_archive_handler(
+            self.path, constants.ZIP)
+        self.addCleanup(archive.close)
+        contents = archive.list_contents()
+        self.assertEqual([os.path.basename(name) for name in contents],
+                         ['01.png', 'a.png', 'b.png', '99.png'])
+        # Read in place from the parent archive, without a temporary copy.
+        for dirpath, dirnames, filenames in os.walk(archive.destdir):
+            self.assertEqual(filenames, [], msg=dirpath)
+        self.assertEqual(archive.read(contents[2]), b'b.png' * 100)
+        self.assertEqual(archive.read(contents[1]), b'a.png' * 100)
+        self.assertEqual(archive.read(contents[3]), b'99.png')
+
+
+class RarArchiveTest(MComixTest):
+
+    def setUp(self):
+        super(RarArchiveTest, self).setUp()
+        if not rar.RarArchive.is_available():
+            self.skipTest('unrar library not available')
+
+    def test_read(self):
+        # Members are read through a separate handle, which must not
+        # disturb extractions, and can go back to previous members.
+        for filename in ('Flat.rar', 'RAR4.rar', 'RAR5.rar'):
+            archive = rar.RarArchive(get_testfile_path('archives', filename))
+            try:
+                contents = archive.list_contents()
+                self.assertTrue(archive.support_memory_extraction, msg=filename)
+                dst_dir = os.path.join(self.tmp_dir, filename)
+                for name in contents:
+                    path = archive.extract(name, dst_dir)
+                    with open(path, 'rb') as fp:
+                        expected = fp.read()
+                    self.assertEqual(archive.read(name), expected,
+                                     msg='%s: %s' % (filename, name))
+                for name in reversed(contents):
+                    with open(os.path.join(dst_dir, name), 'rb') as fp:
+                        expected = fp.read()
+                    self.assertEqual(archive.read(name), expected,
+                                     msg='%s: %s' % (filename, name))
+                self.assertRaises(KeyError, archive.read, 'missing.jpg')
+            finally:
+                archive.close()
+
+    def test_solid(self):
+        archive = rar.RarArchive(get_testfile_path('archives', 'SolidFlat.rar'))
+        try:
+            archive.list_contents()
+            self.assertTrue(archive.is_solid())
+            self.assertFalse(archive.support_memory_extraction)
+        finally:
+            archive.close()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import os
+from unittest import mock
+
+from mcomix import tools
+tools.nogui()
+from mcomix import disk_page_cache
+from mcomix.preferences import prefs
+from . import MComixTest
+
+
+class _Pixbuf(object):
+
+    def __init__(self, width, height, has_alpha=False, orientation=None):
+        self.width = width
+        self.height = height
+        self.has_alpha = has_alpha
+        self.rowstride = width * (4 if has_alpha else 3)
+        self.pixels = bytes(range(256)) * (self.rowstride * height // 256 + 1)
+        self.pixels = self.pixels[:self.rowstride * height]
+        if orientation is not None:
+            self.orientation = orientation
+
+    def get_width(self):
+        return self.width
+
+    def get_height(self):
+        return self.height
+
+    def get_rowstride(self):
+        return self.rowstride
+
+    def get_has_alpha(self):
+        return self.has_alpha
+
+    def get_pixels(self):
+        return self.pixels
+
+
+@mock.patch.object(disk_page_cache, 'GLib')
+@mock.patch.object(disk_page_cache, 'GdkPixbuf')
+class DiskPageCacheTest(MComixTest):
+
+    def setUp(self):
+        super(DiskPageCacheTest, self).setUp()
+        self.cache = disk_page_cache.DiskPageCache(
+            os.path.join(self.tmp_dir, 'pages'))
+
+    def _entry_size(self, pixbuf):
+        return disk_page_cache._HEADER.size + len(pixbuf.get_pixels())
+
+    def test_key(self, GdkPixbuf, GLib):
+        path = os.path.join(self.tmp_dir, 'book.cbz')
+        with open(path, 'wb') as fp:
+            fp.write(b'content')
+        key = self.cache.get_key(path, 'page1.png')
+        self.assertEqual(key, self.cache.get_key(path, 'page1.png'))
+        self.assertNotEqual(key, self.cache.get_key(path, 'page2.png'))
+        # Modified archives do not reuse old entries.
+        with open(path, 'ab') as fp:
+            fp.write(b'more content')
+        self.assertNotEqual(key, self.cache.get_key(path, 'page1.png'))
+        self.assertIsNone(self.cache.get_key(path + '.missing'))
+
+    def test_store_load(self, GdkPixbuf, GLib):
+        pixbuf = _Pixbuf(30, 20, has_alpha=True, orientation='6')
+        self.assertFalse(self.cache.contains('key'))
+        self.assertIsNone(self.cache.load('key'))
+        self.cache._store('key', pixbuf)
+        self.assertTrue(self.cache.contains('key'))
+        loaded = self.cache.load('key')
+        self.assertIs(loaded, GdkPixbuf.Pixbuf.new_from_bytes.return_value)
+        GLib.Bytes.new.assert_called_once_with(pixbuf.get_pixels())
+        args = GdkPixbuf.Pixbuf.new_from_bytes.call_args[0]
+        self.assertEqual(args[2:], (True, 8, 30, 20, 120))
+        self.assertEqual(loaded.orientation, '6')
+
+    def test_invalid_entry(self, GdkPixbuf, GLib):
+        self.cache._store('key', _Pixbuf(30, 20))
+        path = self.cache._get_path('key')
+        with open(path, 'r+b') as fp:
+            fp.truncate(os.path.getsize(path) - 1)
+        self.assertIsNone(self.cache.load('key'))
+        # Invalid entries are removed.
+        self.assertFalse(self.cache.contains('key'))
+
+    def test_size(self, GdkPixbuf, GLib):
+        small, big = _Pixbuf(10, 10), _Pixbuf(20, 20)
+        self.cache._store('a', small)
+        self.cache._store('b', small)
+        self.assertEqual(self.cache._size, 2 * self._entry_size(small))
+        # Replacing an entry only accounts for the new one.
+        self.cache._store('b', big)
+        self.assertEqual(self.cache._size,
+                         self._entry_size(small) + self._entry_size(big))
+        self.assertEqual(self.cache._size, self.cache._get_total_size())
+        self.cache.clear()
+        self.assertEqual(self.cache._size, 0)
+        self.assertFalse(self.cache.contains('a'))
+
+    def test_evict(self, GdkPixbuf, GLib):
+        pixbuf = _Pixbuf(512, 512)
+        entry_size = self._entry_size(pixbuf)
+        # Room for 2 entries.
+        prefs['decoded page cache size'] = 2 * entry_size // 1048576 + 1
+        self.assertLess(prefs['decoded page cache size'] * 1048576, 3 * entry_size)
+        for mtime, key in enumerate(('a', 'b')):
+            self.cache._store(key, pixbuf)
+            os.utime(self.cache._get_path(key), (mtime, mtime))
+        # Loading marks the entry as recently used.
+        self.cache.load('a')
+        self.cache._store('c', pixbuf)
+        self.assertTrue(self.cache.contains('a'))
+        self.assertFalse(self.cache.contains('b'))
+        self.assertTrue(self.cache.contains('c'))
+        self.assertEqual(self.cache._size, 2 * entry_size)
+
+# vim: expandtab:sw=4:ts=4
@@ -3,6 +3,7 @@
 from __future__ import absolute_import
 
 import binascii
+import operator
 import os
 import sys
 import tempfile
@@ -586,6 +587,57 @@ class ImageToolsTest(object):
                 self.assertImagesEqual(result, expected, msg=msg)
 
 
+class GroupColorsTest(MComixTest):
+
+    def setUp(self):
+        super(GroupColorsTest, self).setUp()
+        if image_tools.numpy is None:
+            self.skipTest('NumPy not available')
+
+    def _edge_colors(self, pixels):
+        # Same as get_edge_colors(), for an edge with <pixels>.
+        numpy = image_tools.numpy
+        pixels = numpy.asarray(pixels, numpy.uint8)
+        channels = pixels.shape[2]
+        keys = numpy.zeros(pixels.shape[:2], numpy.uint32)
+        for channel in range(channels):
+            keys = (keys << 8) | pixels[:, :, channel]
+        keys, counts = numpy.unique(keys, return_counts=True)
+        return channels, keys, counts
+
+    def assertSameColor(self, left, right, msg=None):
+        left, right = self._edge_colors(left), self._edge_colors(right)
+        colors = image_tools._get_colors_list(left) + \
+            image_tools._get_colors_list(right)
+        colors.sort(key=operator.itemgetter(1))
+        self.assertEqual(image_tools._group_colors_numpy(left, right),
+                         tuple(image_tools._group_colors(colors)), msg=msg)
+
+    def test_random(self):
+        numpy = image_tools.numpy
+        for channels in (3, 4):
+            for seed in range(20):
+                random = numpy.random.RandomState(seed)
+                # Noisy pixels from a few base colors.
+                palette = random.randint(0, 256, (3, channels))
+                edges = []
+                for side in range(2):
+                    pixels = palette[random.randint(0, len(palette), (40, 2))]
+                    pixels += random.randint(-6, 7, pixels.shape)
+                    edges.append(numpy.clip(pixels, 0, 255))
+                self.assertSameColor(*edges, msg='%u/%u' % (channels, seed))
+
+    def test_ties(self):
+        for channels in (3, 4):
+            black, white = (10,) * channels, (200,) * channels
+            dark = (12,) * channels
+            # Groups with as many colors: the first one is used.
+            self.assertSameColor([[white, black]] * 2, [[black, white]] * 2)
+            # Colors of a group as frequent: the first one is used.
+            self.assertSameColor([[dark, black]] * 3, [[black, dark]] * 3)
+            self.assertSameColor([[dark]] * 2, [[black]] * 2)
+
+
 class_list = []
 
 if hasattr(image_tools, 'USE_PIL'):
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from unittest import mock
+
+from mcomix import tools
+tools.nogui()
+from mcomix import image_tools
+from mcomix import page_cache
+from . import MComixTest
+
+
+class _Pixbuf(object):
+
+    def __init__(self, size):
+        self.size = size
+
+
+def _get_pixbuf_size(pixbuf):
+    return pixbuf.size
+
+
+@mock.patch.object(image_tools, 'get_pixbuf_size', _get_pixbuf_size)
+class PageCacheTest(MComixTest):
+
+    def test_size(self):
+        cache = page_cache.PageCache()
+        cache[0] = _Pixbuf(100)
+        cache[1] = _Pixbuf(200)
+        self.assertEqual(cache.size, 300)
+        # Replacing a page only accounts for the new pixbuf.
+        cache[1] = _Pixbuf(50)
+        self.assertEqual(cache.size, 150)
+        self.assertEqual(len(cache), 2)
+        del cache[0]
+        self.assertEqual(cache.size, 50)
+        self.assertEqual(cache.pop(1).size, 50)
+        self.assertIsNone(cache.pop(1))
+        self.assertEqual(cache.size, 0)
+        cache[2] = _Pixbuf(10)
+        cache.clear()
+        self.assertEqual((cache.size, len(cache)), (0, 0))
+
+    def test_evict_farthest(self):
+        cache = page_cache.PageCache(limit=300)
+        cache.set_current(5)
+        for index in (5, 6, 9, 2):
+            cache[index] = _Pixbuf(100)
+        # Page 9 is the farthest from the current page.
+        self.assertEqual(sorted(cache), [2, 5, 6])
+        self.assertEqual(cache.size, 300)
+        self.assertEqual(cache.evictions, 1)
+        # The page just added is kept, even if the farthest.
+        cache[0] = _Pixbuf(100)
+        self.assertEqual(sorted(cache), [0, 5, 6])
+
+    def test_evict_wanted(self):
+        cache = page_cache.PageCache(limit=0)
+        for index in range(6):
+            cache[index] = _Pixbuf(100)
+        # Wanted pages are kept, even if over the limit.
+        cache.limit = 200
+        cache.set_current(0, wanted=[0, 4, 5])
+        self.assertEqual(sorted(cache), [0, 4, 5])
+        self.assertEqual(cache.size, 300)
+        self.assertEqual(cache.evictions, 3)
+
+    def test_stats(self):
+        cache = page_cache.PageCache()
+        cache[0] = _Pixbuf(100)
+        self.assertIsNotNone(cache.lookup(0))
+        self.assertIsNone(cache.lookup(1))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        cache.reset_stats()
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+
+
+@mock.patch.object(image_tools, 'get_pixbuf_size', _get_pixbuf_size)
+class RenderCacheTest(MComixTest):
+
+    def test_evict_least_recently_used(self):
+        cache = page_cache.RenderCache(3)
+        for key in 'abc':
+            cache.add(key, _Pixbuf(1))
+        self.assertIsNotNone(cache.get('a'))
+        cache.add('d', _Pixbuf(1))
+        self.assertIsNone(cache.get('b'))
+        for key in 'acd':
+            self.assertIsNotNone(cache.get(key))
+
+    def test_size(self):
+        cache = page_cache.RenderCache(10, limit=250)
+        cache.add('a', _Pixbuf(100))
+        cache.add('b', _Pixbuf(100))
+        # Replacing an entry only accounts for the new pixbuf.
+        cache.add('b', _Pixbuf(50))
+        self.assertIsNotNone(cache.get('a'))
+        cache.add('c', _Pixbuf(100))
+        self.assertIsNotNone(cache.get('a'))
+        # Over the limit: the least recently used is evicted.
+        cache.add('d', _Pixbuf(50))
+        self.assertIsNone(cache.get('b'))
+        for key in 'acd':
+            self.assertIsNotNone(cache.get(key))
+
+    def test_single_entry_over_limit(self):
+        # The last entry added is always kept.
+        cache = page_cache.RenderCache(10, limit=10)
+        cache.add('a', _Pixbuf(100))
+        self.assertIsNotNone(cache.get('a'))
+        cache.add('b', _Pixbuf(100))
+        self.assertIsNone(cache.get('a'))
+        self.assertIsNotNone(cache.get('b'))
+        cache.clear()
+        self.assertIsNone(cache.get('b'))
+
+    def test_remove_matching(self):
+        cache = page_cache.RenderCache(10, limit=250)
+        cache.add(('1.png', 100), _Pixbuf(100))
+        cache.add(('1.png', 50), _Pixbuf(50))
+        cache.add(('2.png', 100), _Pixbuf(100))
+        cache.remove_matching(lambda key: key[0] == '1.png')
+        self.assertIsNone(cache.get(('1.png', 100)))
+        self.assertIsNone(cache.get(('1.png', 50)))
+        self.assertIsNotNone(cache.get(('2.png', 100)))
+        # The size of removed entries is no longer accounted for.
+        cache.add(('3.png', 100), _Pixbuf(100))
+        self.assertIsNotNone(cache.get(('2.png', 100)))